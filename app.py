@@ -19,6 +19,8 @@ login_manager = LoginManager()
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# Let Apache/lighttpd (mod_xsendfile) stream attachment files instead of the Python worker
+app.use_x_sendfile = os.environ.get("USE_X_SENDFILE", "False").lower() == "true"
 
 # Configure the database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///escola_aquisicoes.db")
@@ -29,7 +31,27 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 
 # Configure file uploads
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Uploads are streamed to disk in chunks (attachment_uploads.py), so this limit can be raised safely
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", 16)) * 1024 * 1024
+
+# Resumable chunked uploads (upload_sessions.py): chunk size of each PUT and max assembled file size
+app.config['UPLOAD_SESSION_CHUNK_SIZE'] = int(os.environ.get("UPLOAD_SESSION_CHUNK_KB", 1024)) * 1024
+app.config['MAX_RESUMABLE_UPLOAD_SIZE'] = int(os.environ.get("MAX_RESUMABLE_UPLOAD_MB", 200)) * 1024 * 1024
+
+# Photos larger than this (longest side, in pixels) are downscaled at upload; 0 keeps the original
+app.config['IMAGE_MAX_DIMENSION'] = int(os.environ.get("IMAGE_MAX_DIMENSION", 0))
+app.config['IMAGE_JPEG_QUALITY'] = int(os.environ.get("IMAGE_JPEG_QUALITY", 85))
+
+# Cache of filter results (matching ids and totals) per filter and data version
+app.config['FILTER_CACHE_SIZE'] = int(os.environ.get("FILTER_CACHE_SIZE", 128))
+
+# On-disk cache of generated PDF reports per report type, filters and data version (LRU by size)
+app.config['REPORT_CACHE_PATH'] = os.environ.get("REPORT_CACHE_PATH", os.path.join(app.config['UPLOAD_FOLDER'], 'report_cache'))
+app.config['REPORT_CACHE_MAX_MB'] = int(os.environ.get("REPORT_CACHE_MAX_MB", 256))
+
+# Bulk import (bulk_import.py): max rows read from one spreadsheet and rows inserted per transaction
+app.config['BULK_IMPORT_MAX_ROWS'] = int(os.environ.get("BULK_IMPORT_MAX_ROWS", 10000))
+app.config['BULK_IMPORT_BATCH_SIZE'] = int(os.environ.get("BULK_IMPORT_BATCH_SIZE", 1000))
 
 @app.template_filter('dict_replace')
 def dict_replace_filter(d, key, value):
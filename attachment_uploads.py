@@ -0,0 +1,186 @@
+"""Pipeline único de upload de anexos.
+
+O arquivo enviado é copiado em blocos de tamanho fixo para um arquivo temporário,
+calculando tamanho e SHA-256 durante a cópia; o tipo é conferido pelos primeiros bytes
+(assinatura) e o arquivo é movido de forma atômica para o blob store. A memória usada
+não cresce com o tamanho do arquivo.
+
+Com IMAGE_MAX_DIMENSION definido, fotos maiores que isso são reduzidas (e regravadas com
+IMAGE_JPEG_QUALITY) antes de irem para o blob store; o tamanho enviado fica em
+attachment.original_file_size.
+"""
+import hashlib
+import os
+import secrets
+import tempfile
+from PIL import Image, ImageOps
+from werkzeug.utils import secure_filename
+from app import app
+from blob_store import put_blob_file, reserve_blob
+
+# Tamanho de cada bloco lido do upload
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+_OLE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'  # .doc/.xls (formato binário do Office)
+_ZIP = b'PK\x03\x04'  # .docx/.xlsx (Office Open XML)
+
+# Extensões aceitas e as assinaturas válidas para cada uma
+ALLOWED_SIGNATURES = {
+    'pdf': (b'%PDF',),
+    'doc': (_OLE,),
+    'docx': (_ZIP,),
+    'xls': (_OLE,),
+    'xlsx': (_ZIP,),
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',),
+}
+
+# Extensões de imagem que podem ser reduzidas no upload
+RESIZABLE_IMAGES = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG'}
+
+class UploadError(Exception):
+    """Arquivo recusado pelo pipeline de upload (mensagem exibível ao usuário)"""
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+def _temp_dir():
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'tmp')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def iter_chunks(stream, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Lê um stream em blocos de tamanho fixo"""
+    return iter(lambda: stream.read(chunk_size), b'')
+
+def stream_to_temp(chunks, extension, temp_dir=None):
+    """Grava os blocos em um arquivo temporário calculando tamanho e SHA-256 e conferindo a assinatura.
+
+    Retorna (caminho temporário, tamanho, sha256); lança UploadError se o conteúdo estiver
+    vazio ou não corresponder à extensão.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=temp_dir or _temp_dir(), prefix='upload-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in chunks:
+                if size == 0 and not chunk.startswith(ALLOWED_SIGNATURES[extension]):
+                    raise UploadError(f'o conteúdo não corresponde a um arquivo .{extension}')
+                digest.update(chunk)
+                size += len(chunk)
+                tmp.write(chunk)
+        if size == 0:
+            raise UploadError('arquivo vazio')
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, size, digest.hexdigest()
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter_chunks(f):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def downscale_image(tmp_path, extension):
+    """Reduz uma foto maior que IMAGE_MAX_DIMENSION; retorna (caminho, tamanho, sha256) ou None.
+
+    Só usa a versão reduzida se ela ficar menor que o arquivo enviado; nesse caso o
+    arquivo original é removido. Metadados EXIF (inclusive localização) não são mantidos.
+    """
+    max_dimension = app.config['IMAGE_MAX_DIMENSION']
+    image_format = RESIZABLE_IMAGES.get(extension)
+    if not max_dimension or image_format is None:
+        return None
+
+    with Image.open(tmp_path) as image:
+        if max(image.size) <= max_dimension:
+            return None
+        icc_profile = image.info.get('icc_profile')
+        if image_format == 'JPEG':
+            # Decodifica o JPEG já reduzido por uma potência de 2 (menos memória e CPU)
+            image.draft('RGB', (max_dimension, max_dimension))
+        resized = ImageOps.exif_transpose(image)
+        resized.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    fd, resized_path = tempfile.mkstemp(dir=os.path.dirname(tmp_path), prefix='upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            if image_format == 'JPEG':
+                if resized.mode not in ('RGB', 'L'):
+                    resized = resized.convert('RGB')
+                resized.save(out, 'JPEG', quality=app.config['IMAGE_JPEG_QUALITY'], optimize=True,
+                             progressive=True, icc_profile=icc_profile)
+            else:
+                resized.save(out, 'PNG', optimize=True, icc_profile=icc_profile)
+    except Exception:
+        os.remove(resized_path)
+        raise
+
+    size = os.path.getsize(resized_path)
+    if size >= os.path.getsize(tmp_path):
+        os.remove(resized_path)
+        return None
+    os.remove(tmp_path)
+    return resized_path, size, _file_digest(resized_path)
+
+def move_to_blob_store(tmp_path, blob_sha256):
+    """Move o arquivo verificado para o blob store (descarta se o conteúdo já existe e foi reservado)"""
+    if reserve_blob(blob_sha256):
+        os.remove(tmp_path)
+    else:
+        put_blob_file(blob_sha256, tmp_path)
+
+def store_verified_file(tmp_path, filename, extension, size, blob_sha256):
+    """Grava no blob store um arquivo já verificado (reduzindo fotos grandes) e retorna os dados do anexo.
+
+    Retorna {'filename', 'original_filename', 'file_size', 'original_file_size', 'blob_sha256'}.
+    """
+    original_size = None
+    try:
+        downscaled = downscale_image(tmp_path, extension)
+        if downscaled:
+            original_size = size
+            tmp_path, size, blob_sha256 = downscaled
+        move_to_blob_store(tmp_path, blob_sha256)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return {
+        'filename': unique_filename_for(filename),
+        'original_filename': filename,
+        'file_size': size,
+        'original_file_size': original_size,
+        'blob_sha256': blob_sha256,
+    }
+
+def unique_filename_for(filename):
+    name, ext = os.path.splitext(filename)
+    return f"{name}_{secrets.token_hex(8)}{ext}"
+
+def validate_filename(filename):
+    """Nome seguro e extensão; lança UploadError se a extensão não for permitida"""
+    filename = secure_filename(filename or '')
+    extension = _extension(filename)
+    if extension not in ALLOWED_SIGNATURES:
+        raise UploadError('tipo de arquivo não permitido')
+    return filename, extension
+
+def save_upload(file):
+    """Grava um FileStorage no blob store e retorna os dados do anexo.
+
+    Retorna os dados do anexo (ver store_verified_file); lança UploadError se o arquivo
+    estiver vazio, tiver extensão não permitida ou conteúdo que não corresponde à extensão.
+    """
+    filename, extension = validate_filename(file.filename)
+
+    stream = file.stream
+    if hasattr(stream, 'seek'):
+        stream.seek(0)
+    tmp_path, size, blob_sha256 = stream_to_temp(iter_chunks(stream), extension)
+    return store_verified_file(tmp_path, filename, extension, size, blob_sha256)
@@ -0,0 +1,101 @@
+"""Download em ZIP dos anexos de um pedido ou de todos os pedidos de um filtro.
+
+O ZIP é montado sob demanda enquanto é enviado: cada anexo é lido do blob store em blocos e
+os bytes comprimidos são repassados à resposta assim que produzidos, sem arquivo temporário
+e com memória constante (o zipfile grava tamanhos e CRC em descritores após cada arquivo,
+já que a saída não é "seekable"). Cada pedido vira uma pasta "<id> - <título>".
+"""
+import io
+import re
+import zipfile
+from datetime import datetime
+from models import AcquisitionRequest, Attachment
+from blob_store import open_attachment, COMPRESSIBLE_SIGNATURES, STREAM_CHUNK_SIZE
+
+# Tamanho máximo do título no nome da pasta
+FOLDER_TITLE_LENGTH = 60
+
+class _ZipOutput(io.RawIOBase):
+    """Saída do zipfile que acumula os bytes escritos até serem repassados à resposta"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _clean_name(name, max_length=None):
+    # Sem separadores de pasta nem caracteres de controle; acentos são mantidos (nomes em UTF-8)
+    name = re.sub(r'[\x00-\x1f/\\:*?"<>|\s]+', ' ', name or '').strip(' .')
+    if max_length:
+        name = name[:max_length].rstrip(' .')
+    return name
+
+def folder_name(request_id, title):
+    title = _clean_name(title, FOLDER_TITLE_LENGTH)
+    return f"{request_id} - {title}" if title else str(request_id)
+
+def _unique(name, used):
+    if name not in used:
+        used.add(name)
+        return name
+    stem, dot, extension = name.rpartition('.')
+    if not dot:
+        stem, extension = name, ''
+    counter = 2
+    while True:
+        candidate = f"{stem} ({counter}){dot}{extension}"
+        if candidate not in used:
+            used.add(candidate)
+            return candidate
+        counter += 1
+
+def attachment_entries(request_ids, batch_size=500):
+    """Anexos dos pedidos informados e o caminho de cada um no ZIP (só metadados, sem o conteúdo)"""
+    entries = []
+    used = set()
+    request_ids = list(request_ids)
+    for start in range(0, len(request_ids), batch_size):
+        rows = Attachment.query.join(AcquisitionRequest, Attachment.request_id == AcquisitionRequest.id) \
+            .filter(Attachment.request_id.in_(request_ids[start:start + batch_size])) \
+            .add_columns(AcquisitionRequest.title) \
+            .order_by(Attachment.request_id, Attachment.id).all()
+        for attachment, title in rows:
+            name = _clean_name(attachment.original_filename) or _clean_name(attachment.filename) or str(attachment.id)
+            entries.append((_unique(f"{folder_name(attachment.request_id, title)}/{name}", used), attachment))
+    return entries
+
+def stream_zip(entries):
+    """Gera os bytes do ZIP com os anexos de `entries` ([(caminho, anexo)]) à medida que são lidos"""
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, 'w', allowZip64=True) as archive:
+        for path, attachment in entries:
+            source = open_attachment(attachment)
+            if source is None:
+                continue
+            with source:
+                header = source.read(8)
+                info = zipfile.ZipInfo(path, date_time=(attachment.upload_date or datetime.utcnow()).timetuple()[:6])
+                # PDF e .doc/.xls comprimem bem; DOCX/XLSX e imagens vão sem recompressão
+                info.compress_type = zipfile.ZIP_DEFLATED if header.startswith(COMPRESSIBLE_SIGNATURES) \
+                    else zipfile.ZIP_STORED
+                # Tamanho esperado: o zipfile usa para decidir se o arquivo precisa de ZIP64
+                info.file_size = attachment.file_size or 0
+                with archive.open(info, 'w') as target:
+                    target.write(header)
+                    while chunk := source.read(STREAM_CHUNK_SIZE):
+                        target.write(chunk)
+                        data = output.take()
+                        if data:
+                            yield data
+            yield output.take()
+    yield output.take()
@@ -0,0 +1,121 @@
+"""Relatório de espaço do blob store e da compressão dos anexos.
+
+    python blob_storage_report.py                   # tamanho original x gravado, por tipo
+    python blob_storage_report.py --simulate zstd   # quanto gzip/zstd economizaria nos blobs atuais
+    python blob_storage_report.py --apply           # comprime os blobs existentes (BLOB_COMPRESSION)
+
+O tempo de leitura de todos os objetos gravados é informado como estimativa do tempo de backup.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from sqlalchemy import func
+from app import app, db
+from models import Attachment, Blob
+from blob_store import (get_blob_backend, get_compression, stored_encoding, encode_file, open_blob,
+                        COMPRESSIBLE_SIGNATURES, STREAM_CHUNK_SIZE, compressing_writer)
+
+_TYPES = ((b'%PDF', 'pdf'), (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'doc/xls'), (b'PK\x03\x04', 'docx/xlsx'),
+          (b'\x89PNG', 'png'), (b'\xff\xd8\xff', 'jpg'))
+
+def _content_type(header):
+    for signature, name in _TYPES:
+        if header.startswith(signature):
+            return name
+    return 'outros'
+
+class _CountingWriter:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+def _mb(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+def _simulated_size(sha256, method):
+    counter = _CountingWriter()
+    with open_blob(sha256) as source, compressing_writer(method, counter) as writer:
+        shutil.copyfileobj(source, writer, STREAM_CHUNK_SIZE)
+    return counter.size
+
+def report(simulate=None):
+    backend = get_blob_backend()
+    totals = {}
+    started = time.monotonic()
+    read_bytes = 0
+    for sha256, size in db.session.query(Blob.sha256, Blob.size).filter(Blob.ref_count > 0).yield_per(500):
+        with open_blob(sha256) as f:
+            header = f.read(8)
+        content_type = _content_type(header)
+        stored = backend.stored_size(sha256)
+        row = totals.setdefault(content_type, {'count': 0, 'size': 0, 'stored': 0, 'simulated': 0})
+        row['count'] += 1
+        row['size'] += size
+        row['stored'] += stored
+        if simulate:
+            compressible = header.startswith(COMPRESSIBLE_SIGNATURES)
+            row['simulated'] += _simulated_size(sha256, simulate) if compressible else stored
+
+        # Leitura completa do objeto gravado: aproxima o custo de copiá-lo num backup
+        with backend.open(sha256) as f:
+            while chunk := f.read(STREAM_CHUNK_SIZE):
+                read_bytes += len(chunk)
+    elapsed = time.monotonic() - started
+
+    print(f"{'tipo':<10} {'blobs':>6} {'original':>12} {'gravado':>12}" + (f" {simulate:>12}" if simulate else ''))
+    for content_type, row in sorted(totals.items()):
+        line = f"{content_type:<10} {row['count']:>6} {_mb(row['size']):>12} {_mb(row['stored']):>12}"
+        print(line + (f" {_mb(row['simulated']):>12}" if simulate else ''))
+    size = sum(row['size'] for row in totals.values())
+    stored = sum(row['stored'] for row in totals.values())
+    print(f"Total: {_mb(size)} de conteúdo, {_mb(stored)} gravados"
+          + (f" ({100 * (1 - stored / size):.0f}% de economia)" if size else ''))
+    if simulate and size:
+        simulated = sum(row['simulated'] for row in totals.values())
+        print(f"Com {simulate}: {_mb(simulated)} ({100 * (1 - simulated / size):.0f}% de economia)")
+    print(f"Leitura de todos os objetos gravados ({_mb(read_bytes)}): {elapsed:.1f}s")
+
+    reduced = db.session.query(func.count(Attachment.id), func.sum(Attachment.original_file_size),
+                               func.sum(Attachment.file_size)) \
+        .filter(Attachment.original_file_size.isnot(None)).one()
+    if reduced[0]:
+        print(f"Imagens reduzidas no upload: {reduced[0]}, de {_mb(reduced[1])} para {_mb(reduced[2])}")
+
+def compress_existing():
+    """Regrava comprimidos os blobs existentes que se beneficiam (BLOB_COMPRESSION). Retorna a quantidade."""
+    method = get_compression()
+    if method is None:
+        raise SystemExit("Defina BLOB_COMPRESSION=gzip ou zstd para comprimir os blobs existentes.")
+    backend = get_blob_backend()
+    compressed = 0
+    for (sha256,) in db.session.query(Blob.sha256).filter(Blob.ref_count > 0).yield_per(500):
+        if stored_encoding(backend.read_header(sha256)):
+            continue
+        fd, tmp_path = tempfile.mkstemp(prefix='blob-')
+        with os.fdopen(fd, 'wb') as tmp, backend.open(sha256) as source:
+            shutil.copyfileobj(source, tmp, STREAM_CHUNK_SIZE)
+        encoded_path = encode_file(tmp_path, method)
+        if encoded_path != tmp_path:
+            backend.put_file(sha256, encoded_path)
+            compressed += 1
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return compressed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Espaço ocupado pelos anexos no blob store")
+    parser.add_argument("--simulate", choices=['gzip', 'zstd'], help="estima o tamanho com essa compressão")
+    parser.add_argument("--apply", action="store_true", help="comprime os blobs existentes")
+    args = parser.parse_args()
+    with app.app_context():
+        if args.apply:
+            print(f"Blobs comprimidos: {compress_existing()}")
+        report(args.simulate)
@@ -0,0 +1,591 @@
+"""Armazenamento de anexos endereçado por conteúdo (SHA-256).
+
+Cada conteúdo distinto é gravado uma única vez no backend; os anexos guardam apenas
+blob_sha256. A tabela blob mantém a contagem de referências, atualizada na mesma
+transação das inserções/exclusões de anexos (hook after_flush abaixo). Blobs sem
+referências há mais de BLOB_GC_GRACE_HOURS são removidos por collect_unreferenced_blobs(),
+executado pelo scheduler; um upload que reaproveita um conteúdo já gravado o reserva antes
+(reserve_blob), na transação do anexo.
+
+Backend escolhido por BLOB_BACKEND: 'filesystem' (padrão, em BLOB_STORE_PATH) ou 's3'
+(BLOB_S3_BUCKET, BLOB_S3_PREFIX, BLOB_S3_ENDPOINT_URL; requer boto3). Os dois expõem a
+mesma interface de objetos (put/put_file/get/open/exists/delete), de modo que o diretório local
+faz o papel do bucket em desenvolvimento.
+
+Com BLOB_COMPRESSION=gzip ou zstd (zstd requer o pacote zstandard), PDFs e .doc/.xls são
+gravados comprimidos quando isso economiza espaço. A codificação é reconhecida pelos primeiros
+bytes do objeto, então blobs antigos (sem compressão) continuam legíveis; a leitura e o
+download descomprimem em blocos. O hash e blob.size sempre se referem ao conteúdo original.
+"""
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from urllib.parse import quote as url_quote
+from flask import Response, request, send_file, redirect, abort
+from werkzeug.wsgi import wrap_file
+from sqlalchemy import event, inspect, select, update, delete, case
+from sqlalchemy.orm import Session, undefer
+from app import app, db
+from models import Attachment, Blob
+from stats import upsert_statement
+
+# Assinaturas dos objetos gravados comprimidos
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Tipos que costumam comprimir bem: PDF e .doc/.xls binários (DOCX/XLSX, JPG e PNG já são comprimidos)
+COMPRESSIBLE_SIGNATURES = (b'%PDF', b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1')
+
+# Só grava comprimido se o objeto ficar pelo menos 10% menor
+MIN_COMPRESSION_SAVING = 0.10
+
+# Tamanho dos blocos lidos/escritos ao comprimir e descomprimir
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Blob sem referências só é coletado depois deste prazo (contado de blob.released_at)
+BLOB_GC_GRACE = timedelta(hours=int(os.environ.get("BLOB_GC_GRACE_HOURS", 24)))
+
+# session.info: conteúdos gravados no backend pela transação em andamento
+_WRITTEN_BLOBS_KEY = 'blob_store_written'
+
+def _umask_file_mode():
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+# Permissão dos arquivos publicados (como um open() comum): o mkstemp cria com 0600, e o
+# nginx/Apache que entrega os downloads (X-Accel-Redirect/X-Sendfile) costuma ser outro usuário
+PUBLISHED_FILE_MODE = _umask_file_mode()
+
+class FilesystemBlobBackend:
+    """Objetos em <root>/ab/cd/<sha256>, gravados de forma atômica (arquivo temporário + rename)"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp_path, PUBLISHED_FILE_MODE)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_file(self, key, source_path):
+        """Move um arquivo local já gravado para o store (rename atômico; cópia se em outro disco)"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.chmod(source_path, PUBLISHED_FILE_MODE)
+            os.replace(source_path, path)
+        except OSError:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+            os.close(fd)
+            shutil.copyfile(source_path, tmp_path)
+            os.chmod(tmp_path, PUBLISHED_FILE_MODE)
+            os.replace(tmp_path, path)
+            os.remove(source_path)
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def read_header(self, key, size=4):
+        with self.open(key) as f:
+            return f.read(size)
+
+    def local_path(self, key):
+        """Caminho no disco (permite sendfile/X-Sendfile nos downloads)"""
+        return self._path(key)
+
+    def stored_size(self, key):
+        return os.path.getsize(self._path(key))
+
+    def relative_path(self, key):
+        return '/'.join((key[:2], key[2:4], key))
+
+    def get(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+class S3BlobBackend:
+    """Objetos em um bucket S3 (ou compatível: MinIO, R2...) sob <prefix><sha256>"""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("BLOB_BACKEND=s3 requer o pacote boto3")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def put_file(self, key, source_path):
+        self.client.upload_file(source_path, self.bucket, self._key(key))
+        os.remove(source_path)
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body']
+
+    def read_header(self, key, size=4):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key), Range=f'bytes=0-{size - 1}')['Body'].read()
+
+    def get(self, key):
+        return self.open(key).read()
+
+    def local_path(self, key):
+        return None
+
+    def stored_size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=self._key(key))['ContentLength']
+
+    def presigned_url(self, key, download_name, mimetype, expires_in=300):
+        """URL temporária para o navegador baixar direto do bucket (Range e cache ficam a cargo do S3)"""
+        return self.client.generate_presigned_url('get_object', Params={
+            'Bucket': self.bucket,
+            'Key': self._key(key),
+            'ResponseContentType': mimetype,
+            'ResponseContentDisposition': f'attachment; filename="{download_name}"',
+        }, ExpiresIn=expires_in)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+_backend = None
+
+def get_blob_backend():
+    """Backend configurado (instanciado uma vez por processo)"""
+    global _backend
+    if _backend is None:
+        name = os.environ.get("BLOB_BACKEND", "filesystem").lower()
+        if name == 's3':
+            _backend = S3BlobBackend(
+                os.environ["BLOB_S3_BUCKET"],
+                prefix=os.environ.get("BLOB_S3_PREFIX", "attachments/"),
+                endpoint_url=os.environ.get("BLOB_S3_ENDPOINT_URL")
+            )
+        elif name == 'filesystem':
+            _backend = FilesystemBlobBackend(
+                os.environ.get("BLOB_STORE_PATH", os.path.join(app.config['UPLOAD_FOLDER'], 'blobs'))
+            )
+        else:
+            raise ValueError(f"BLOB_BACKEND inválido: {name} (use filesystem ou s3)")
+    return _backend
+
+def get_compression():
+    """Compressão configurada em BLOB_COMPRESSION: None, 'gzip' ou 'zstd'"""
+    name = os.environ.get("BLOB_COMPRESSION", "none").lower()
+    if name in ('', 'none'):
+        return None
+    if name == 'zstd':
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise RuntimeError("BLOB_COMPRESSION=zstd requer o pacote zstandard")
+    elif name != 'gzip':
+        raise ValueError(f"BLOB_COMPRESSION inválido: {name} (use none, gzip ou zstd)")
+    return name
+
+def stored_encoding(header):
+    """Codificação de um objeto gravado, pelos primeiros bytes: 'gzip', 'zstd' ou None"""
+    if header.startswith(_GZIP_MAGIC):
+        return 'gzip'
+    if header.startswith(_ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+def compressing_writer(method, out):
+    if method == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=6).stream_writer(out, closefd=False)
+    return gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6, mtime=0)
+
+def encode_file(path, method=None):
+    """Comprime o arquivo para gravação, se o tipo for compressível e houver ganho.
+
+    Retorna o caminho a gravar (o próprio `path` ou um temporário comprimido ao lado dele;
+    nesse caso `path` é removido). Conteúdo que já começa com a assinatura de gzip/zstd é
+    sempre comprimido, para que a leitura nunca o confunda com um objeto comprimido.
+    """
+    method = method or get_compression()
+    with open(path, 'rb') as f:
+        header = f.read(8)
+    forced = stored_encoding(header) is not None
+    if not forced and (method is None or not header.startswith(COMPRESSIBLE_SIGNATURES)):
+        return path
+
+    fd, encoded_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.z-')
+    try:
+        with os.fdopen(fd, 'wb') as out, open(path, 'rb') as source:
+            with compressing_writer(method or 'gzip', out) as writer:
+                shutil.copyfileobj(source, writer, STREAM_CHUNK_SIZE)
+    except Exception:
+        os.remove(encoded_path)
+        raise
+
+    if forced or os.path.getsize(encoded_path) <= os.path.getsize(path) * (1 - MIN_COMPRESSION_SAVING):
+        os.remove(path)
+        return encoded_path
+    os.remove(encoded_path)
+    return path
+
+def put_blob_file(sha256, path):
+    """Grava no backend o arquivo local com o conteúdo de `sha256` (comprimido se configurado).
+
+    O conteúdo é gravado antes do commit do anexo; se a transação for desfeita, o hook
+    _remove_uncommitted_blobs apaga o arquivo (sem linha em blob, a coleta não o encontraria).
+    """
+    get_blob_backend().put_file(sha256, encode_file(path))
+    db.session.info.setdefault(_WRITTEN_BLOBS_KEY, set()).add(sha256)
+
+def reserve_blob(sha256):
+    """Reserva, na transação da sessão, um conteúdo que um novo anexo vai reaproveitar.
+
+    Retorna True se o conteúdo já está no backend e pode ser usado sem gravar de novo. O
+    UPDATE na linha do blob bloqueia a coleta até o commit do anexo (e espera uma coleta em
+    andamento terminar, inclusive a remoção do arquivo); sem linha em blob, retorna False e
+    quem chamou grava o conteúdo.
+    """
+    table = Blob.__table__
+    result = db.session.execute(
+        update(table).where(table.c.sha256 == sha256).values(
+            released_at=case((table.c.ref_count <= 0, datetime.utcnow()), else_=table.c.released_at)
+        )
+    )
+    return result.rowcount > 0 and get_blob_backend().exists(sha256)
+
+def store_blob(data):
+    """Grava o conteúdo no backend (se ainda não existir) e retorna (sha256, tamanho).
+
+    A linha em blob e a contagem de referências são atualizadas quando o anexo que
+    aponta para o hash é gravado.
+    """
+    sha256 = hashlib.sha256(data).hexdigest()
+    if not reserve_blob(sha256):
+        fd, tmp_path = tempfile.mkstemp(prefix='blob-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            put_blob_file(sha256, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return sha256, len(data)
+
+class _ReadStream(io.RawIOBase):
+    """Stream de leitura sobre uma função read(n); ao fechar, fecha também `closeables`"""
+
+    def __init__(self, read, *closeables):
+        self._read = read
+        self._closeables = closeables
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            for closeable in self._closeables:
+                closeable.close()
+        super().close()
+
+def _prefixed_read(prefix, raw):
+    """read(n) que devolve `prefix` (bytes já lidos) antes do restante de `raw`"""
+    pending = [prefix]
+
+    def read(size):
+        if pending[0]:
+            data, pending[0] = pending[0][:size], pending[0][size:]
+            return data
+        return raw.read(size)
+    return read
+
+def decoded_stream(raw):
+    """Stream com o conteúdo original de um objeto do backend (descomprime em blocos se preciso)"""
+    header = raw.read(4)
+    if getattr(raw, 'seekable', lambda: False)():
+        raw.seek(0)
+        source = raw
+    else:
+        source = io.BufferedReader(_ReadStream(_prefixed_read(header, raw), raw))
+
+    encoding = stored_encoding(header)
+    if encoding is None:
+        return source
+    if encoding == 'zstd':
+        import zstandard
+        decoder = zstandard.ZstdDecompressor().stream_reader(source)
+    else:
+        decoder = gzip.GzipFile(fileobj=source, mode='rb')
+    return io.BufferedReader(_ReadStream(decoder.read, decoder, source), STREAM_CHUNK_SIZE)
+
+def open_blob(sha256):
+    """Abre o conteúdo original para leitura (objeto file-like)"""
+    return decoded_stream(get_blob_backend().open(sha256))
+
+def guess_mimetype(filename):
+    return mimetypes.guess_type(filename or '')[0] or 'application/octet-stream'
+
+def send_blob(sha256, download_name, as_attachment=True, cache_max_age=None):
+    """Resposta de download de um blob com ETag forte (o próprio hash), GET condicional e Range.
+
+    Sem `cache_max_age` o navegador revalida a cada acesso (304); com ele, a resposta é
+    marcada como imutável por esse tempo (para objetos derivados do hash, como miniaturas).
+
+    No backend em disco o arquivo é enviado com sendfile (ou X-Sendfile, se app.use_x_sendfile);
+    com BLOB_X_ACCEL_PREFIX definido, o nginx entrega o arquivo via X-Accel-Redirect. No S3 o
+    navegador é redirecionado para uma URL pré-assinada.
+    """
+    backend = get_blob_backend()
+    mimetype = guess_mimetype(download_name)
+
+    path = backend.local_path(sha256)
+    if path is not None and not os.path.exists(path):
+        abort(404)
+    if stored_encoding(backend.read_header(sha256)):
+        return _send_decoded(sha256, download_name, mimetype, as_attachment, cache_max_age)
+    if path is None:
+        return redirect(backend.presigned_url(sha256, download_name, mimetype))
+
+    accel_prefix = os.environ.get("BLOB_X_ACCEL_PREFIX")
+    if accel_prefix:
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + backend.relative_path(sha256)
+        response.headers['Content-Disposition'] = _content_disposition(download_name, as_attachment)
+        response.set_etag(sha256)
+        _set_cache_headers(response, cache_max_age)
+        return response.make_conditional(request)
+
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        etag=sha256,
+        conditional=True,
+        max_age=0
+    )
+    _set_cache_headers(response, cache_max_age)
+    return response
+
+def _content_disposition(download_name, as_attachment):
+    disposition = 'attachment' if as_attachment else 'inline'
+    return f"{disposition}; filename*=UTF-8''{url_quote(download_name)}"
+
+def _send_decoded(sha256, download_name, mimetype, as_attachment, cache_max_age):
+    """Download de um blob gravado comprimido: descomprime em blocos durante o envio (sem Range)"""
+    response = Response(
+        wrap_file(request.environ, open_blob(sha256), STREAM_CHUNK_SIZE),
+        mimetype=mimetype,
+        direct_passthrough=True
+    )
+    blob = db.session.get(Blob, sha256)
+    if blob is not None and blob.size:
+        response.content_length = blob.size
+    response.headers['Content-Disposition'] = _content_disposition(download_name, as_attachment)
+    response.set_etag(sha256)
+    _set_cache_headers(response, cache_max_age)
+    return response.make_conditional(request)
+
+def _set_cache_headers(response, cache_max_age):
+    # Conteúdo endereçado por hash: sem prazo, o navegador revalida com If-None-Match e recebe 304
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if cache_max_age:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = cache_max_age
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = 0
+        response.cache_control.no_cache = True
+
+def open_attachment(attachment):
+    """Abre o conteúdo de um anexo para leitura em blocos (None se não houver conteúdo)"""
+    if attachment.blob_sha256:
+        return open_blob(attachment.blob_sha256)
+    if attachment.file_content:
+        return io.BytesIO(attachment.file_content)
+    path = os.path.join(app.config['UPLOAD_FOLDER'], attachment.filename)
+    if os.path.exists(path):
+        return open(path, 'rb')
+    return None
+
+def read_attachment(attachment):
+    """Conteúdo de um anexo: blob store, coluna legada file_content ou arquivo legado em uploads/"""
+    if attachment.blob_sha256:
+        with open_blob(attachment.blob_sha256) as f:
+            return f.read()
+    if attachment.file_content:
+        return attachment.file_content
+    path = os.path.join(app.config['UPLOAD_FOLDER'], attachment.filename)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    return None
+
+@event.listens_for(Session, 'after_commit')
+def _forget_written_blobs(session):
+    session.info.pop(_WRITTEN_BLOBS_KEY, None)
+
+@event.listens_for(Session, 'after_rollback')
+def _remove_uncommitted_blobs(session):
+    """Apaga do backend os conteúdos gravados na transação desfeita que não têm linha em blob"""
+    written = session.info.pop(_WRITTEN_BLOBS_KEY, None)
+    if not written:
+        return
+    try:
+        # Conexão própria: a sessão acabou de desfazer a transação. Um conteúdo com linha em
+        # blob (gravado por outro anexo) fica a cargo de collect_unreferenced_blobs
+        with db.engine.connect() as conn:
+            existing = set(conn.scalars(select(Blob.sha256).where(Blob.sha256.in_(written))))
+        backend = get_blob_backend()
+        for sha256 in written - existing:
+            backend.delete(sha256)
+    except Exception as e:
+        app.logger.warning(f"Blob store: falha ao remover conteúdo de transação desfeita: {e}")
+
+@event.listens_for(Session, 'after_flush')
+def _update_blob_refs(session, flush_context):
+    """Ajusta blob.ref_count, na mesma transação, conforme anexos criados/excluídos no flush"""
+    deltas = {}
+    sizes = {}
+
+    def add(sha256, amount, size=None):
+        if sha256:
+            deltas[sha256] = deltas.get(sha256, 0) + amount
+            if size is not None:
+                sizes[sha256] = size
+
+    for obj in session.new:
+        if isinstance(obj, Attachment):
+            add(obj.blob_sha256, 1, obj.file_size)
+
+    for obj in session.deleted:
+        if isinstance(obj, Attachment):
+            history = inspect(obj).attrs.blob_sha256.history
+            add((history.deleted or history.unchanged or [None])[0], -1)
+
+    for obj in session.dirty:
+        if isinstance(obj, Attachment):
+            history = inspect(obj).attrs.blob_sha256.history
+            if history.has_changes():
+                for old in history.deleted:
+                    add(old, -1)
+                for new in history.added:
+                    add(new, 1, obj.file_size)
+
+    table = Blob.__table__
+    connection = session.connection()
+    now = datetime.utcnow()
+    for sha256, amount in deltas.items():
+        if amount == 0:
+            continue
+        if amount < 0:
+            connection.execute(
+                update(table).where(table.c.sha256 == sha256).values(
+                    ref_count=table.c.ref_count + amount,
+                    # Início do prazo de coleta quando o último anexo sai
+                    released_at=case((table.c.ref_count + amount <= 0, now), else_=None)
+                )
+            )
+            continue
+        # Upsert atômico: dois uploads novos do mesmo conteúdo não disputam o INSERT da linha
+        stmt = upsert_statement(connection, table).values(
+            sha256=sha256, size=sizes.get(sha256) or 0, ref_count=amount
+        )
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['sha256'],
+            set_={
+                'ref_count': table.c.ref_count + stmt.excluded.ref_count,
+                'released_at': case((table.c.ref_count + stmt.excluded.ref_count <= 0, now), else_=None),
+            }
+        ))
+
+def collect_unreferenced_blobs(grace=BLOB_GC_GRACE):
+    """Remove do banco e do backend os blobs sem anexos há mais de `grace`. Retorna a quantidade removida."""
+    backend = get_blob_backend()
+    table = Blob.__table__
+    cutoff = datetime.utcnow() - grace
+    candidates = db.session.query(Blob.sha256, Blob.preview_format).filter(
+        Blob.ref_count <= 0, Blob.released_at < cutoff
+    ).all()
+    removed = 0
+    for sha256, preview_format in candidates:
+        # Condicional: um upload pode ter voltado a referenciar (ou reservado) o blob desde a consulta
+        result = db.session.execute(
+            delete(table).where(table.c.sha256 == sha256, table.c.ref_count <= 0, table.c.released_at < cutoff)
+        )
+        try:
+            if result.rowcount:
+                # Arquivos removidos antes do commit: enquanto a linha está bloqueada, um upload do
+                # mesmo conteúdo espera em reserve_blob e, sem a linha, grava o conteúdo de novo
+                backend.delete(sha256)
+                if preview_format:
+                    backend.delete(f"{sha256}.preview.{preview_format}")
+                removed += 1
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"Falha ao remover o blob {sha256[:12]}: {e}")
+    return removed
+
+def migrate_legacy_attachments(batch_size=100):
+    """Move para o blob store o conteúdo de anexos antigos (file_content ou arquivo em uploads/)"""
+    migrated = 0
+    last_id = 0
+    while True:
+        batch = Attachment.query.options(undefer(Attachment.file_content)) \
+            .filter(Attachment.blob_sha256.is_(None), Attachment.id > last_id) \
+            .order_by(Attachment.id).limit(batch_size).all()
+        if not batch:
+            break
+        for attachment in batch:
+            last_id = attachment.id
+            data = read_attachment(attachment)
+            if not data:
+                continue
+            attachment.blob_sha256, attachment.file_size = store_blob(data)
+            attachment.file_content = None
+            migrated += 1
+        db.session.commit()
+    return migrated
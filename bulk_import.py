@@ -0,0 +1,85 @@
+"""Gravação em lote dos pedidos importados da planilha (ver excel_template_generator.read_import_file).
+
+Os pedidos são gravados em blocos de BULK_IMPORT_BATCH_SIZE, com um commit por bloco: um
+INSERT ... RETURNING em lote para os pedidos, outro para o histórico inicial de status e a
+atualização de request_stats. Se um bloco falhar, os pedidos dele são regravados um a um
+para apontar as linhas com problema. Os pedidos podem vir de um gerador: só um bloco
+fica em memória por vez.
+"""
+from itertools import islice
+from sqlalchemy import insert
+from app import app, db
+from models import User, AcquisitionRequest, StatusChange
+from stats import record_inserted_requests
+
+IMPORT_STATUS_COMMENT = 'Pedido criado via importação em lote'
+
+def user_name_map():
+    """Nome completo (sem diferenciar maiúsculas/minúsculas) → id do usuário, lido uma vez por importação"""
+    names = {}
+    for user_id, full_name in db.session.query(User.id, User.full_name).order_by(User.id):
+        if full_name:
+            names.setdefault(full_name.strip().casefold(), user_id)
+    return names
+
+def _request_values(pedido, user_id):
+    return {
+        'title': pedido['titulo'],
+        'description': pedido['descricao'],
+        'status': pedido['status'],
+        'priority': pedido['priority'],
+        'impact': pedido['impact'],
+        'classe': pedido['classe'],
+        'categoria': pedido['categoria'],
+        'estimated_value': pedido['valor_estimado'],
+        'final_value': pedido['valor_final'],
+        'responsible_id': pedido['responsible_id'],
+        'observations': pedido['observacoes'],
+        'request_date': pedido['data_solicitacao'],
+        'created_by_id': user_id,
+    }
+
+def _insert_batch(rows, user_id):
+    """Grava os pedidos, o histórico inicial e os totais consolidados em uma transação"""
+    request_ids = db.session.scalars(
+        insert(AcquisitionRequest).returning(AcquisitionRequest.id, sort_by_parameter_order=True),
+        rows
+    ).all()
+    db.session.execute(insert(StatusChange), [
+        {
+            'old_status': None,
+            'new_status': row['status'],
+            'request_id': request_id,
+            'changed_by_id': user_id,
+            'comments': IMPORT_STATUS_COMMENT,
+        }
+        for row, request_id in zip(rows, request_ids)
+    ])
+    # insert() em lote não passa pelo after_flush que mantém request_stats
+    record_inserted_requests(db.session, rows)
+    db.session.commit()
+
+def import_requests(pedidos, user, batch_size=None):
+    """Grava os pedidos validados (lista ou gerador) em nome de `user`. Retorna (quantidade criada, erros)."""
+    batch_size = batch_size or app.config['BULK_IMPORT_BATCH_SIZE']
+    user_id = user.id
+    created_count = 0
+    erros = []
+    pedidos = iter(pedidos)
+    while batch := list(islice(pedidos, batch_size)):
+        try:
+            _insert_batch([_request_values(pedido, user_id) for pedido in batch], user_id)
+            created_count += len(batch)
+            continue
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning(f"Importação em lote: bloco da linha {batch[0]['linha']} falhou ({e}); gravando um a um")
+
+        for pedido in batch:
+            try:
+                _insert_batch([_request_values(pedido, user_id)], user_id)
+                created_count += 1
+            except Exception as e:
+                db.session.rollback()
+                erros.append(f"Linha {pedido['linha']}: Erro ao criar pedido - {str(e)}")
+    return created_count, erros
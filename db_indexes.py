@@ -0,0 +1,142 @@
+import sqlalchemy as sa
+from sqlalchemy import text
+from app import db
+
+# Tabelas cujos índices declarados nos modelos são garantidos pelas migrações
+INDEXED_TABLES = ('acquisition_request', 'status_change', 'attachment', 'blob', 'job_run')
+
+# Consultas representativas das listagens, usadas no relatório de planos de execução
+PROBE_QUERIES = [
+    ('Dashboard filtrado por status',
+     "SELECT id FROM acquisition_request WHERE status = :value ORDER BY updated_at DESC, id DESC LIMIT 10",
+     {'value': 'aberto'}),
+    ('Dashboard filtrado por responsável',
+     "SELECT id FROM acquisition_request WHERE responsible_id = :value ORDER BY updated_at DESC, id DESC LIMIT 10",
+     {'value': 1}),
+    ('Dashboard filtrado por classe',
+     "SELECT id FROM acquisition_request WHERE classe = :value ORDER BY updated_at DESC, id DESC LIMIT 10",
+     {'value': 'ensino'}),
+    ('Dashboard por período',
+     "SELECT id FROM acquisition_request WHERE request_date >= :value ORDER BY updated_at DESC, id DESC LIMIT 10",
+     {'value': '2025-01-01'}),
+    ('Página seguinte (cursor)',
+     "SELECT id FROM acquisition_request WHERE updated_at < :value ORDER BY updated_at DESC, id DESC LIMIT 10",
+     {'value': '2025-01-01 00:00:00'}),
+    ('Pedidos recentes (admin)',
+     "SELECT id FROM acquisition_request ORDER BY created_at DESC LIMIT 5",
+     {}),
+    ('Histórico de status de um pedido',
+     "SELECT id FROM status_change WHERE request_id = :value ORDER BY change_date DESC",
+     {'value': 1}),
+    ('Anexos de um pedido',
+     "SELECT id FROM attachment WHERE request_id = :value",
+     {'value': 1}),
+]
+
+def ensure_indexes(engine):
+    """Cria os índices declarados nos modelos que ainda não existem no banco.
+
+    Cada índice é criado à parte: uma falha não impede os demais. Retorna (criados, falhas),
+    com falhas como pares (nome, erro). No PostgreSQL usa CREATE INDEX CONCURRENTLY, que não
+    bloqueia as escritas na tabela durante a criação.
+    """
+    is_postgres = engine.dialect.name == 'postgresql'
+    inspector = sa.inspect(engine)
+    created = []
+    failed = []
+    for table_name in INDEXED_TABLES:
+        table = db.metadata.tables[table_name]
+        existing = {index['name'] for index in inspector.get_indexes(table_name)}
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name in existing:
+                continue
+            try:
+                if is_postgres:
+                    _create_index_concurrently(engine, index)
+                else:
+                    with engine.begin() as conn:
+                        index.create(bind=conn)
+                created.append(index.name)
+            except Exception as e:
+                failed.append((index.name, str(e)))
+    return created, failed
+
+def _create_index_concurrently(engine, index):
+    # CONCURRENTLY não pode rodar dentro de uma transação
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        index.dialect_options['postgresql']['concurrently'] = True
+        try:
+            index.create(bind=conn)
+        except Exception:
+            # Uma criação concorrente interrompida deixa o índice inválido no banco
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+            raise
+        finally:
+            index.dialect_options['postgresql']['concurrently'] = False
+
+def _is_sequential_scan(plan_line):
+    if 'Seq Scan' in plan_line:
+        return True
+    # SQLite: "SCAN tabela" sem "USING INDEX" percorre a tabela inteira
+    return plan_line.startswith('SCAN ') and 'USING' not in plan_line
+
+def explain_probe_queries():
+    """Executa EXPLAIN nas consultas representativas e indica quais fazem varredura sequencial"""
+    is_postgres = db.engine.dialect.name == 'postgresql'
+    prefix = 'EXPLAIN ' if is_postgres else 'EXPLAIN QUERY PLAN '
+    results = []
+    for label, sql, params in PROBE_QUERIES:
+        rows = db.session.execute(text(prefix + sql), params).all()
+        plan = [str(row[-1]) for row in rows]
+        results.append({
+            'label': label,
+            'sql': sql,
+            'plan': plan,
+            'sequential_scan': any(_is_sequential_scan(line.strip()) for line in plan),
+        })
+    return results
+
+def get_missing_indexes():
+    """Índices declarados nos modelos que não existem no banco"""
+    inspector = sa.inspect(db.engine)
+    missing = []
+    for table_name in INDEXED_TABLES:
+        existing = {index['name'] for index in inspector.get_indexes(table_name)}
+        missing.extend(sorted(ix.name for ix in db.metadata.tables[table_name].indexes if ix.name not in existing))
+    return missing
+
+def get_index_usage():
+    """Lista os índices das tabelas de pedidos com estatísticas de uso (apenas PostgreSQL)"""
+    if db.engine.dialect.name == 'postgresql':
+        rows = db.session.execute(text("""
+            SELECT s.relname, s.indexrelname, s.idx_scan, s.idx_tup_read,
+                   pg_size_pretty(pg_relation_size(s.indexrelid))
+            FROM pg_stat_user_indexes s
+            WHERE s.relname IN :tables
+            ORDER BY s.relname, s.indexrelname
+        """).bindparams(sa.bindparam('tables', expanding=True)), {'tables': list(INDEXED_TABLES)}).all()
+        indexes = [
+            {'table': table, 'name': name, 'scans': scans, 'tuples_read': tuples, 'size': size}
+            for table, name, scans, tuples, size in rows
+        ]
+        table_rows = db.session.execute(text("""
+            SELECT relname, seq_scan, idx_scan, n_live_tup
+            FROM pg_stat_user_tables
+            WHERE relname IN :tables
+            ORDER BY relname
+        """).bindparams(sa.bindparam('tables', expanding=True)), {'tables': list(INDEXED_TABLES)}).all()
+        tables = [
+            {'table': table, 'seq_scans': seq, 'index_scans': idx, 'rows': live}
+            for table, seq, idx, live in table_rows
+        ]
+        return {'has_usage_stats': True, 'indexes': indexes, 'tables': tables}
+
+    # SQLite não mantém estatísticas de uso; lista apenas os índices existentes
+    inspector = sa.inspect(db.engine)
+    indexes = [
+        {'table': table_name, 'name': index['name'], 'columns': ', '.join(c for c in index['column_names'] if c),
+         'scans': None, 'tuples_read': None, 'size': None}
+        for table_name in INDEXED_TABLES
+        for index in inspector.get_indexes(table_name)
+    ]
+    return {'has_usage_stats': False, 'indexes': indexes, 'tables': []}
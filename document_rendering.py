@@ -0,0 +1,175 @@
+"""Geração de PDFs em um pool de processos, fora da thread da requisição.
+
+O reportlab é Python puro e só usa CPU: montado na thread do worker web, um relatório segura
+o worker (e o GIL) do começo ao fim. As rotas leem os dados do banco (pdf_generator.*_data,
+dicionários simples, sem objetos do ORM) e enviam só esses dados ao pool, que grava o PDF
+direto no arquivo de destino; downloads simultâneos usam núcleos diferentes.
+
+Cada worker web tem o seu pool, criado no primeiro uso. Este módulo não importa o app: os
+processos do pool (spawn) carregam só o pdf_generator.
+
+- DOCUMENT_RENDER_PROCESSES: processos do pool (0 = gera na própria thread, sem pool)
+- DOCUMENT_RENDER_MAX_PENDING: documentos em andamento ou na fila do pool; acima disso a
+  chamada espera até DOCUMENT_RENDER_QUEUE_WAIT segundos por uma vaga e lança RenderBusy
+- DOCUMENT_RENDER_TIMEOUT: tempo máximo, em segundos, que a requisição espera pelo documento
+  (vaga, fila e renderização) antes de RenderTimeout; somado à folga de 5 s, deve ficar abaixo
+  do timeout do gunicorn (30 s por padrão). As rotas mandam relatórios que passam disso para a
+  fila de relatórios (report_jobs)
+"""
+import math
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pdf_generator import render_request_pdf, render_general_report
+
+RENDER_PROCESSES = int(os.environ.get("DOCUMENT_RENDER_PROCESSES", min(2, os.cpu_count() or 1)))
+
+RENDER_MAX_PENDING = int(os.environ.get("DOCUMENT_RENDER_MAX_PENDING", RENDER_PROCESSES * 2))
+
+RENDER_QUEUE_WAIT = int(os.environ.get("DOCUMENT_RENDER_QUEUE_WAIT", 10))
+
+RENDER_TIMEOUT = int(os.environ.get("DOCUMENT_RENDER_TIMEOUT", 20))
+
+# Folga da requisição além de DOCUMENT_RENDER_TIMEOUT (e para o processo encerrar pelo próprio alarme)
+RENDER_KILL_GRACE = 5
+
+# Tipo de documento: função que monta o arquivo a partir dos dados (data, caminho de saída)
+RENDERERS = {
+    'request_pdf': render_request_pdf,
+    'general_report': render_general_report,
+}
+
+class RenderError(Exception):
+    """Falha ao gerar um documento no pool"""
+
+class RenderBusy(RenderError):
+    """Limite de documentos simultâneos atingido"""
+
+class RenderTimeout(RenderError):
+    """Renderização passou de DOCUMENT_RENDER_TIMEOUT"""
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(RENDER_MAX_PENDING, 1))
+# Documentos enviados ao pool e ainda não concluídos: future -> prazo para considerar o processo travado
+_submitted = {}
+
+def _render_in_worker(kind, data, output_path, timeout):
+    """Executado no processo do pool: grava o documento em output_path em até `timeout` segundos"""
+    timed_out = []
+
+    def on_alarm(signum, frame):
+        timed_out.append(True)
+        raise RenderTimeout('tempo limite de renderização excedido')
+
+    # A tarefa roda na thread principal do processo, então o SIGALRM interrompe o reportlab
+    # e o processo continua disponível para os próximos documentos
+    signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        RENDERERS[kind](data, output_path)
+    except Exception:
+        # O reportlab às vezes embrulha a exceção do alarme em outra
+        if timed_out:
+            raise RenderTimeout('tempo limite de renderização excedido') from None
+        raise
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: os processos não herdam conexões do banco nem as threads do worker web
+            _executor = ProcessPoolExecutor(max_workers=RENDER_PROCESSES,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+def _discard_executor(executor):
+    """Descarta um pool travado ou quebrado (o próximo documento cria outro)"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    # Não há API pública para interromper uma tarefa em execução: finaliza os processos
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _hard_limit(timeout):
+    """Prazo, contado do envio, depois do qual um documento ainda pendente indica processo travado.
+
+    Quem encerra uma renderização lenta é o alarme do próprio processo (_render_in_worker). O
+    future.running() não diz quando o documento começou (o pool marca como em execução tudo o
+    que entra na fila de chamadas), então o prazo cobre a espera atrás de todos os documentos
+    que cabem no pool.
+    """
+    waves = math.ceil(max(RENDER_MAX_PENDING, 1) / max(RENDER_PROCESSES, 1))
+    return max(timeout, RENDER_TIMEOUT) * waves + RENDER_KILL_GRACE
+
+def _discard_if_hung():
+    """Descarta o pool se algum documento passou de _hard_limit (processo que nem o alarme interrompe)"""
+    executor = _executor
+    now = time.monotonic()
+    if executor is not None and any(now > limit for limit in list(_submitted.values())):
+        _discard_executor(executor)
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _on_done(future):
+    _submitted.pop(future, None)
+    _slots.release()
+
+def render_document(kind, data, output_path, timeout=None):
+    """Gera o documento `kind` (ver RENDERERS) com `data` em output_path, em um processo do pool.
+
+    A chamada espera no máximo `timeout` (padrão DOCUMENT_RENDER_TIMEOUT) mais uma pequena folga,
+    somando a espera por vaga, a fila do pool e a renderização: lança RenderBusy se não houver
+    vaga a tempo e RenderTimeout se o documento não ficar pronto no prazo. Nesse caso o
+    documento é cancelado (ou, se já estiver no processo, o arquivo gerado é descartado).
+    """
+    timeout = timeout or RENDER_TIMEOUT
+    if RENDER_PROCESSES <= 0:
+        RENDERERS[kind](data, output_path)
+        return
+
+    deadline = time.monotonic() + timeout + RENDER_KILL_GRACE
+    _discard_if_hung()
+    if not _slots.acquire(timeout=min(RENDER_QUEUE_WAIT, timeout)):
+        raise RenderBusy('muitos documentos sendo gerados no momento')
+    try:
+        executor = _get_executor()
+        future = executor.submit(_render_in_worker, kind, data, output_path, timeout)
+    except BaseException:
+        _slots.release()
+        raise
+    # A vaga só é liberada quando o pool termina o documento, mesmo que a requisição desista antes
+    _submitted[future] = time.monotonic() + _hard_limit(timeout)
+    future.add_done_callback(_on_done)
+
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RenderTimeout('tempo limite de renderização excedido')
+            try:
+                return future.result(timeout=min(remaining, 0.5))
+            except FutureTimeoutError:
+                pass
+    except BrokenProcessPool as e:
+        _discard_executor(executor)
+        raise RenderError('processo de renderização interrompido') from e
+    except BaseException:
+        # Requisição desistiu (prazo ou interrupção): o documento que ainda não saiu da fila é
+        # cancelado; o que já está no processo termina (ou cai no alarme) e o arquivo é apagado
+        if not future.cancel():
+            future.add_done_callback(lambda f: _remove_quietly(output_path))
+        raise
@@ -0,0 +1,361 @@
+"""Fila transacional de e-mails (tabela email_outbox).
+
+As rotas apenas gravam mensagens com enqueue_email(), na mesma transação da alteração do
+pedido; o envio acontece no worker (scheduler.py) via deliver_pending(), em lotes, com
+concorrência, novas tentativas com espera exponencial e deduplicação.
+
+O transporte é escolhido por EMAIL_TRANSPORT: 'resend' (padrão), 'smtp' ou 'file'.
+"""
+import hashlib
+import json
+import os
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+import resend
+from sqlalchemy import func
+from app import app, db
+from models import User, EmailOutbox
+
+# Número máximo de tentativas antes de marcar a mensagem como 'failed'
+MAX_ATTEMPTS = int(os.environ.get("EMAIL_OUTBOX_MAX_ATTEMPTS", 6))
+
+# Espera antes da 2ª tentativa; dobra a cada falha (60s, 2min, 4min, ...) até RETRY_MAX_DELAY
+RETRY_BASE_DELAY = timedelta(seconds=60)
+RETRY_MAX_DELAY = timedelta(hours=6)
+
+BATCH_SIZE = int(os.environ.get("EMAIL_OUTBOX_BATCH_SIZE", 50))
+CONCURRENCY = int(os.environ.get("EMAIL_OUTBOX_CONCURRENCY", 4))
+
+# Mensagem idêntica (mesma chave) enfileirada ou enviada dentro desta janela não é repetida
+DEDUP_WINDOW = timedelta(hours=24)
+
+# Mensagens em 'sending' há mais tempo que isso (worker interrompido) voltam para a fila
+STALE_LOCK_AFTER = timedelta(minutes=15)
+
+# ---------------------------------------------------------------------------
+# Conteúdo das mensagens
+# ---------------------------------------------------------------------------
+
+def build_notification_email(recipient_name, request_obj):
+    """Assunto e HTML da notificação de pedido criado/atualizado"""
+    # Format specifications
+    specs = f"""
+        <ul>
+            <li><strong>ID:</strong> #{request_obj.id}</li>
+            <li><strong>Título:</strong> {request_obj.title}</li>
+            <li><strong>Status:</strong> {request_obj.get_status_display()}</li>
+            <li><strong>Prioridade:</strong> {request_obj.get_priority_display()}</li>
+            <li><strong>Impacto:</strong> {request_obj.get_impact_display()}</li>
+            <li><strong>Classe:</strong> {request_obj.get_classe_display()}</li>
+            <li><strong>Categoria:</strong> {request_obj.get_categoria_display()}</li>
+            <li><strong>Data do Pedido:</strong> {request_obj.request_date.strftime('%d/%m/%Y')}</li>
+            <li><strong>Valor Estimado:</strong> R$ {request_obj.estimated_value or 0:,.2f}</li>
+            <li><strong>Descrição:</strong> {request_obj.description}</li>
+        </ul>
+        """
+
+    subject = f"Atualização de Pedido: {request_obj.title} (ID: #{request_obj.id})"
+    html = f"""
+            <p>Olá <strong>{recipient_name}</strong>,</p>
+            <p>O seguinte pedido de aquisição foi atribuído ou atualizado para você:</p>
+            {specs}
+            <p>Por favor, acesse o sistema para mais detalhes.</p>
+            """
+    return subject, html
+
+def build_deadline_alert_email(recipient_name, request_obj):
+    """Assunto e HTML do alerta de prazo de entrega vencido"""
+    # Calculate days overdue
+    days_overdue = abs(request_obj.days_until_deadline) if request_obj.days_until_deadline else 0
+
+    # Format deadline info
+    deadline_str = request_obj.delivery_deadline.strftime('%d/%m/%Y') if request_obj.delivery_deadline else 'Não definido'
+
+    # Format specifications
+    specs = f"""
+        <ul>
+            <li><strong>ID:</strong> #{request_obj.id}</li>
+            <li><strong>Título:</strong> {request_obj.title}</li>
+            <li><strong>Status:</strong> {request_obj.get_status_display()}</li>
+            <li><strong>Prazo de Entrega:</strong> <span style="color: #dc3545; font-weight: bold;">{deadline_str}</span></li>
+            <li><strong>Dias de Atraso:</strong> <span style="color: #dc3545; font-weight: bold;">{days_overdue} dias</span></li>
+            <li><strong>Prioridade:</strong> {request_obj.get_priority_display()}</li>
+            <li><strong>Impacto:</strong> {request_obj.get_impact_display()}</li>
+            <li><strong>Descrição:</strong> {request_obj.description}</li>
+        </ul>
+        """
+
+    subject = f"⚠️ ALERTA DE PRAZO VENCIDO: {request_obj.title} (ID: #{request_obj.id})"
+    html = f"""
+            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+                <div style="background-color: #dc3545; color: white; padding: 20px; text-align: center;">
+                    <h2 style="margin: 0;">⚠️ Alerta de Prazo Vencido</h2>
+                </div>
+                <div style="padding: 20px; background-color: #f8f9fa;">
+                    <p>Olá <strong>{recipient_name}</strong>,</p>
+                    <p style="color: #dc3545; font-weight: bold;">O seguinte pedido de aquisição está com o prazo de entrega VENCIDO:</p>
+                    {specs}
+                    <p style="margin-top: 20px;">Por favor, acesse o sistema e tome as providências necessárias com urgência.</p>
+                </div>
+                <div style="background-color: #343a40; color: white; padding: 10px; text-align: center; font-size: 12px;">
+                    Sistema de Gestão de Aquisições - 121 - Escola Senai "Carlos Pasquale"
+                </div>
+            </div>
+            """
+    return subject, html
+
+# ---------------------------------------------------------------------------
+# Enfileiramento (chamado pelas rotas, sem I/O de rede)
+# ---------------------------------------------------------------------------
+
+def enqueue_email(kind, recipient_email, recipient_name, subject, html, request_id=None, dedup_key=None):
+    """Adiciona a mensagem à sessão atual; é gravada no commit da transação de quem chamou.
+
+    Retorna a mensagem criada ou None se uma mensagem com a mesma chave de deduplicação
+    já foi enfileirada/enviada dentro de DEDUP_WINDOW.
+    """
+    if dedup_key is None:
+        digest = hashlib.sha256(f"{recipient_email}\n{subject}\n{html}".encode()).hexdigest()
+        dedup_key = f"{kind}:{digest}"
+
+    duplicate = EmailOutbox.query.filter(
+        EmailOutbox.dedup_key == dedup_key,
+        EmailOutbox.status.in_(['pending', 'sending', 'sent']),
+        EmailOutbox.created_at >= datetime.utcnow() - DEDUP_WINDOW
+    ).first()
+    if duplicate:
+        return None
+
+    message = EmailOutbox(
+        kind=kind,
+        request_id=request_id,
+        recipient_email=recipient_email,
+        recipient_name=recipient_name,
+        subject=subject,
+        html_body=html,
+        dedup_key=dedup_key
+    )
+    db.session.add(message)
+    return message
+
+def queue_request_notification(request_obj):
+    """Enfileira a notificação para o responsável do pedido.
+
+    Retorna o e-mail do destinatário, ou None se não há destinatário ou se a mesma notificação
+    já foi enfileirada dentro de DEDUP_WINDOW.
+    """
+    if not request_obj.responsible_id:
+        return None
+    responsible_user = db.session.get(User, request_obj.responsible_id)
+    if not responsible_user or not responsible_user.email:
+        return None
+
+    subject, html = build_notification_email(responsible_user.full_name, request_obj)
+    message = enqueue_email('notification', responsible_user.email, responsible_user.full_name, subject, html,
+                            request_id=request_obj.id)
+    return responsible_user.email if message is not None else None
+
+def queue_deadline_alert(user, request_obj):
+    """Enfileira o alerta de prazo vencido para um usuário (um por prazo e destinatário)"""
+    subject, html = build_deadline_alert_email(user.full_name, request_obj)
+    deadline = request_obj.delivery_deadline.isoformat() if request_obj.delivery_deadline else ''
+    return enqueue_email('deadline_alert', user.email, user.full_name, subject, html,
+                         request_id=request_obj.id,
+                         dedup_key=f"deadline_alert:{request_obj.id}:{deadline}:{user.email}")
+
+# ---------------------------------------------------------------------------
+# Transportes
+# ---------------------------------------------------------------------------
+
+class ResendTransport:
+    """Envio pela API do Resend (RESEND_API_KEY, EMAIL_FROM)"""
+
+    def __init__(self):
+        self.api_key = os.environ.get("RESEND_API_KEY")
+        self.from_email = os.environ.get("EMAIL_FROM")
+
+    def send(self, message):
+        if not self.api_key or not self.from_email:
+            raise RuntimeError("RESEND_API_KEY or EMAIL_FROM not configured")
+        resend.api_key = self.api_key
+        resend.Emails.send({
+            "from": self.from_email,
+            "to": [message['to']],
+            "subject": message['subject'],
+            "html": message['html'],
+        })
+
+class SmtpTransport:
+    """Envio por SMTP (SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_STARTTLS, EMAIL_FROM)"""
+
+    def __init__(self):
+        self.host = os.environ.get("SMTP_HOST", "localhost")
+        self.port = int(os.environ.get("SMTP_PORT", 25))
+        self.user = os.environ.get("SMTP_USER")
+        self.password = os.environ.get("SMTP_PASSWORD")
+        self.starttls = os.environ.get("SMTP_STARTTLS", "False").lower() == "true"
+        self.from_email = os.environ.get("EMAIL_FROM", "noreply@localhost")
+
+    def send(self, message):
+        email = EmailMessage()
+        email['From'] = self.from_email
+        email['To'] = message['to']
+        email['Subject'] = message['subject']
+        email.set_content("Esta mensagem requer um leitor de e-mail com suporte a HTML.")
+        email.add_alternative(message['html'], subtype='html')
+
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.user:
+                smtp.login(self.user, self.password or '')
+            smtp.send_message(email)
+
+class FileTransport:
+    """Grava cada mensagem como JSON em EMAIL_FILE_DIR (desenvolvimento e testes)"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.environ.get("EMAIL_FILE_DIR", "sent_emails")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def send(self, message):
+        path = os.path.join(self.directory, f"{message['id']:08d}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(message, f, ensure_ascii=False, indent=2)
+
+TRANSPORTS = {
+    'resend': ResendTransport,
+    'smtp': SmtpTransport,
+    'file': FileTransport,
+}
+
+def get_transport():
+    """Instancia o transporte configurado em EMAIL_TRANSPORT"""
+    name = os.environ.get("EMAIL_TRANSPORT", "resend").lower()
+    if name not in TRANSPORTS:
+        raise ValueError(f"EMAIL_TRANSPORT inválido: {name} (use {', '.join(TRANSPORTS)})")
+    return TRANSPORTS[name]()
+
+# ---------------------------------------------------------------------------
+# Entrega (worker)
+# ---------------------------------------------------------------------------
+
+def _retry_delay(attempts):
+    return min(RETRY_BASE_DELAY * (2 ** (attempts - 1)), RETRY_MAX_DELAY)
+
+def _release_stale_locks(now):
+    """Devolve à fila mensagens presas em 'sending' por um worker interrompido"""
+    EmailOutbox.query.filter(
+        EmailOutbox.status == 'sending',
+        EmailOutbox.locked_at < now - STALE_LOCK_AFTER
+    ).update({'status': 'pending', 'locked_at': None}, synchronize_session=False)
+    db.session.commit()
+
+def _claim_batch(now, batch_size):
+    """Marca como 'sending' um lote de mensagens pendentes; ignora as já reservadas por outro worker"""
+    candidate_ids = [row[0] for row in db.session.query(EmailOutbox.id).filter(
+        EmailOutbox.status == 'pending',
+        EmailOutbox.next_attempt_at <= now
+    ).order_by(EmailOutbox.next_attempt_at, EmailOutbox.id).limit(batch_size).all()]
+
+    claimed = []
+    for message_id in candidate_ids:
+        updated = EmailOutbox.query.filter(
+            EmailOutbox.id == message_id,
+            EmailOutbox.status == 'pending'
+        ).update({'status': 'sending', 'locked_at': now}, synchronize_session=False)
+        if updated:
+            claimed.append(message_id)
+    db.session.commit()
+
+    if not claimed:
+        return []
+    return EmailOutbox.query.filter(EmailOutbox.id.in_(claimed)).order_by(EmailOutbox.id).all()
+
+def _send_one(transport, message):
+    try:
+        transport.send(message)
+        return None
+    except Exception as e:
+        return str(e) or e.__class__.__name__
+
+def deliver_pending(batch_size=BATCH_SIZE, concurrency=CONCURRENCY, transport=None):
+    """Envia um lote de mensagens pendentes. Retorna {'sent', 'retried', 'failed', 'duplicates'}."""
+    transport = transport or get_transport()
+    now = datetime.utcnow()
+    _release_stale_locks(now)
+
+    batch = _claim_batch(now, batch_size)
+    result = {'sent': 0, 'retried': 0, 'failed': 0, 'duplicates': 0}
+    if not batch:
+        return result
+
+    # Deduplicação no envio: mesma chave já enviada (ou repetida no próprio lote) não sai de novo
+    keys = {message.dedup_key for message in batch}
+    already_sent = {row[0] for row in db.session.query(EmailOutbox.dedup_key).filter(
+        EmailOutbox.dedup_key.in_(keys),
+        EmailOutbox.status == 'sent',
+        EmailOutbox.sent_at >= now - DEDUP_WINDOW
+    ).distinct().all()}
+
+    to_send = []
+    for message in batch:
+        if message.dedup_key in already_sent:
+            message.status = 'sent'
+            message.last_error = 'Duplicada: mensagem equivalente já enviada'
+            message.locked_at = None
+            result['duplicates'] += 1
+        else:
+            already_sent.add(message.dedup_key)
+            to_send.append(message)
+
+    # O envio roda em threads com dados simples; a sessão do banco fica só nesta thread
+    payloads = [
+        {'id': message.id, 'to': message.recipient_email, 'subject': message.subject, 'html': message.html_body}
+        for message in to_send
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        errors = list(executor.map(lambda payload: _send_one(transport, payload), payloads))
+
+    finished_at = datetime.utcnow()
+    for message, error in zip(to_send, errors):
+        message.attempts += 1
+        message.locked_at = None
+        if error is None:
+            message.status = 'sent'
+            message.sent_at = finished_at
+            message.last_error = None
+            result['sent'] += 1
+        elif message.attempts >= MAX_ATTEMPTS:
+            message.status = 'failed'
+            message.last_error = error
+            result['failed'] += 1
+            app.logger.error(f"E-mail #{message.id} para {message.recipient_email} descartado após {message.attempts} tentativas: {error}")
+        else:
+            message.status = 'pending'
+            message.last_error = error
+            message.next_attempt_at = finished_at + _retry_delay(message.attempts)
+            result['retried'] += 1
+            app.logger.warning(f"Falha ao enviar e-mail #{message.id} (tentativa {message.attempts}): {error}")
+    db.session.commit()
+    return result
+
+def drain_outbox(max_batches=20, **kwargs):
+    """Envia lotes até esvaziar as mensagens prontas (ou atingir max_batches). Retorna os totais."""
+    totals = {'sent': 0, 'retried': 0, 'failed': 0, 'duplicates': 0}
+    for _ in range(max_batches):
+        result = deliver_pending(**kwargs)
+        for key in totals:
+            totals[key] += result[key]
+        if not any(result.values()):
+            break
+    return totals
+
+def get_outbox_counts():
+    """Quantidade de mensagens por status, para o painel administrativo"""
+    rows = db.session.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status).all()
+    counts = {'pending': 0, 'sending': 0, 'sent': 0, 'failed': 0}
+    counts.update(rows)
+    return counts
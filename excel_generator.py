@@ -1,16 +1,88 @@
+import io
 import os
+import queue
+import threading
 from datetime import datetime
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
 from app import db
 
+REQUEST_HEADERS = [
+    "ID", "Título", "Descrição", "Status", "Classe", "Categoria",
+    "Responsável", "Valor Estimado", "Valor Final", "Data Solicitação",
+    "Observações", "Data Criação", "Última Atualização", "Criado por", "Anexos"
+]
+
+# Cores das colunas Status (4), Classe (5) e Categoria (6)
+STATUS_FILLS = {'finalizado': "D4E6B7", 'a_caminho': "FFF2CC", 'fase_compra': "E1D5E7"}
+DEFAULT_STATUS_FILL = "F2F2F2"
+CLASSE_FILLS = {'ensino': "CCE5FF", 'manutencao': "E6E6FA", 'administrativo': "FFFACD"}
+CATEGORIA_FILLS = {'material': "D4EDDA", 'servico': "FFF3CD"}
+
+# Pedidos lidos por vez do cursor na exportação em streaming
+EXCEL_STREAM_BATCH_SIZE = 500
+
+def _header_width(header):
+    if header in ["Título", "Descrição"]:
+        return 30
+    if header in ["Observações", "Responsável"]:
+        return 25
+    return 15
+
+def _request_row(request, attachments_count):
+    """Valores de uma linha da planilha de pedidos"""
+    attachments_text = f"{attachments_count} arquivo(s)" if attachments_count > 0 else "Nenhum anexo"
+
+    classe_display = ""
+    if hasattr(request, 'classe') and request.classe:
+        classe_names = {'ensino': 'Ensino', 'manutencao': 'Manutenção', 'administrativo': 'Administrativo'}
+        classe_display = classe_names.get(request.classe, request.classe)
+
+    categoria_display = ""
+    if hasattr(request, 'categoria') and request.categoria:
+        categoria_names = {'material': 'Material', 'servico': 'Serviço'}
+        categoria_display = categoria_names.get(request.categoria, request.categoria)
+
+    return [
+        request.id,
+        request.title,
+        request.description or "",
+        request.get_status_display(),
+        classe_display,
+        categoria_display,
+        request.responsible.full_name if request.responsible else "",
+        f"R$ {request.estimated_value:.2f}" if request.estimated_value else "Não informado",
+        f"R$ {request.final_value:.2f}" if request.final_value else "Não informado",
+        request.request_date.strftime("%d/%m/%Y") if request.request_date else "",
+        request.observations or "",
+        request.created_at.strftime("%d/%m/%Y %H:%M") if request.created_at else "",
+        request.updated_at.strftime("%d/%m/%Y %H:%M") if request.updated_at else "",
+        request.creator.full_name if request.creator else "",
+        attachments_text
+    ]
+
+def _cell_fill_color(col, request):
+    """Cor de fundo da célula (status, classe e categoria) ou None"""
+    if col == 4:
+        return STATUS_FILLS.get(request.status, DEFAULT_STATUS_FILL)
+    if col == 5:
+        return CLASSE_FILLS.get(getattr(request, 'classe', None))
+    if col == 6:
+        return CATEGORIA_FILLS.get(getattr(request, 'categoria', None))
+    return None
+
 def generate_requests_excel(requests=None):
     """Generate Excel file with all acquisition requests"""
     from models import AcquisitionRequest, User, StatusChange, Attachment
+    from request_queries import with_people, get_attachment_counts
     
     if requests is None:
-        requests = AcquisitionRequest.query.all()
+        requests = with_people(AcquisitionRequest.query).all()
+    
+    # Attachment counts for all rows in grouped queries instead of one per row
+    attachment_counts = get_attachment_counts([req.id for req in requests])
     
     wb = Workbook()
     ws = wb.active
@@ -24,106 +96,26 @@ def generate_requests_excel(requests=None):
                    top=Side(style='thin'), bottom=Side(style='thin'))
     
     # Headers
-    headers = [
-        "ID", "Título", "Descrição", "Status", "Classe", "Categoria",
-        "Responsável", "Valor Estimado", "Valor Final", "Data Solicitação",
-        "Observações", "Data Criação", "Última Atualização", "Criado por", "Anexos"
-    ]
-    
-    for col, header in enumerate(headers, 1):
+    for col, header in enumerate(REQUEST_HEADERS, 1):
         cell = ws.cell(row=1, column=col, value=header)
         cell.font = header_font
         cell.fill = header_fill
         cell.alignment = header_alignment
         cell.border = border
-        
-        # Set column width
-        if header in ["Título", "Descrição"]:
-            ws.column_dimensions[get_column_letter(col)].width = 30
-        elif header in ["Observações", "Responsável"]:
-            ws.column_dimensions[get_column_letter(col)].width = 25
-        else:
-            ws.column_dimensions[get_column_letter(col)].width = 15
+        ws.column_dimensions[get_column_letter(col)].width = _header_width(header)
     
     # Data rows
     for row, request in enumerate(requests, 2):
-        # Get responsible user name
-        responsible_name = ""
-        if request.responsible_id:
-            responsible = User.query.get(request.responsible_id)
-            if responsible:
-                responsible_name = responsible.full_name
-        
-        # Get status display
-        status_display = request.get_status_display()
-        
-        # Get attachments count
-        attachments_count = request.attachments.count()
-        attachments_text = f"{attachments_count} arquivo(s)" if attachments_count > 0 else "Nenhum anexo"
-        
-        # Get classe and categoria display names
-        classe_display = ""
-        if hasattr(request, 'classe') and request.classe:
-            classe_names = {'ensino': 'Ensino', 'manutencao': 'Manutenção', 'administrativo': 'Administrativo'}
-            classe_display = classe_names.get(request.classe, request.classe)
-            
-        categoria_display = ""
-        if hasattr(request, 'categoria') and request.categoria:
-            categoria_names = {'material': 'Material', 'servico': 'Serviço'}
-            categoria_display = categoria_names.get(request.categoria, request.categoria)
-            
-        # Data
-        data = [
-            request.id,
-            request.title,
-            request.description or "",
-            status_display,
-            classe_display,
-            categoria_display,
-            responsible_name,
-            f"R$ {request.estimated_value:.2f}" if request.estimated_value else "Não informado",
-            f"R$ {request.final_value:.2f}" if request.final_value else "Não informado",
-            request.request_date.strftime("%d/%m/%Y") if request.request_date else "",
-            request.observations or "",
-            request.created_at.strftime("%d/%m/%Y %H:%M") if request.created_at else "",
-            request.updated_at.strftime("%d/%m/%Y %H:%M") if request.updated_at else "",
-            request.creator.full_name if request.creator else "",
-            attachments_text
-        ]
-        
+        data = _request_row(request, attachment_counts.get(request.id, 0))
         for col, value in enumerate(data, 1):
             cell = ws.cell(row=row, column=col, value=value)
             cell.border = border
             cell.alignment = Alignment(vertical="top", wrap_text=True)
             
-            # Color coding based on status (column 4)
-            if col == 4:  # Status column
-                if request.status == 'finalizado':
-                    cell.fill = PatternFill(start_color="D4E6B7", end_color="D4E6B7", fill_type="solid")
-                elif request.status == 'a_caminho':
-                    cell.fill = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
-                elif request.status == 'fase_compra':
-                    cell.fill = PatternFill(start_color="E1D5E7", end_color="E1D5E7", fill_type="solid")
-                else:  # orcamento
-                    cell.fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
-            
-            # Color coding for Classe (column 5)
-            elif col == 5:
-                if hasattr(request, 'classe'):
-                    if request.classe == 'ensino':
-                        cell.fill = PatternFill(start_color="CCE5FF", end_color="CCE5FF", fill_type="solid")  # Light blue
-                    elif request.classe == 'manutencao':
-                        cell.fill = PatternFill(start_color="E6E6FA", end_color="E6E6FA", fill_type="solid")  # Light lavender
-                    elif request.classe == 'administrativo':
-                        cell.fill = PatternFill(start_color="FFFACD", end_color="FFFACD", fill_type="solid")  # Lemon Chiffon
-                        
-            # Color coding for Categoria (column 6)  
-            elif col == 6:
-                if hasattr(request, 'categoria'):
-                    if request.categoria == 'material':
-                        cell.fill = PatternFill(start_color="D4EDDA", end_color="D4EDDA", fill_type="solid")  # Light green
-                    elif request.categoria == 'servico':
-                        cell.fill = PatternFill(start_color="FFF3CD", end_color="FFF3CD", fill_type="solid")  # Light yellow
+            # Color coding: status, classe and categoria columns
+            color = _cell_fill_color(col, request)
+            if color:
+                cell.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
     
     # Add summary sheet
     ws2 = wb.create_sheet("Resumo")
@@ -150,11 +142,161 @@ def generate_requests_excel(requests=None):
     
     return wb
 
+class _QueueWriter(io.RawIOBase):
+    """Destino do wb.save() que repassa os bytes gravados, em blocos, para uma fila"""
+
+    def __init__(self, chunks, chunk_size=64 * 1024):
+        self._chunks = chunks
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self._chunks.put(bytes(self._buffer))
+            self._buffer = bytearray()
+
+def _iter_saved_workbook(wb):
+    """Bytes do .xlsx à medida que o wb.save os grava (o save roda em uma thread auxiliar)"""
+    chunks = queue.Queue(maxsize=8)
+    errors = []
+
+    def save():
+        try:
+            writer = _QueueWriter(chunks)
+            wb.save(writer)
+            writer.flush()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            chunks.put(None)
+
+    thread = threading.Thread(target=save, daemon=True)
+    thread.start()
+    finished = False
+    try:
+        while (chunk := chunks.get()) is not None:
+            yield chunk
+        finished = True
+    finally:
+        if not finished:
+            # Cliente desconectou: consome o restante para a thread não ficar bloqueada na fila
+            while chunks.get() is not None:
+                pass
+        thread.join()
+    if errors:
+        raise errors[0]
+
+def _add_named_styles(wb):
+    """Estilos nomeados compartilhados pelas células (um registro de estilo por tipo, não por célula)"""
+    border = Border(left=Side(style='thin'), right=Side(style='thin'),
+                    top=Side(style='thin'), bottom=Side(style='thin'))
+    wb.add_named_style(NamedStyle(
+        name='pedido_cabecalho', border=border,
+        font=Font(bold=True, color="FFFFFF"),
+        fill=PatternFill(start_color="366092", end_color="366092", fill_type="solid"),
+        alignment=Alignment(horizontal="center", vertical="center")
+    ))
+    wb.add_named_style(NamedStyle(name='pedido_celula', border=border,
+                                  alignment=Alignment(vertical="top", wrap_text=True)))
+    colors = {DEFAULT_STATUS_FILL, *STATUS_FILLS.values(), *CLASSE_FILLS.values(), *CATEGORIA_FILLS.values()}
+    for color in colors:
+        wb.add_named_style(NamedStyle(
+            name=f'pedido_{color}', border=border,
+            fill=PatternFill(start_color=color, end_color=color, fill_type="solid"),
+            alignment=Alignment(vertical="top", wrap_text=True)
+        ))
+
+def _styled_cell(ws, value, style):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+def stream_requests_excel(query=None, progress=None, request_ids=None):
+    """Planilha de pedidos em streaming, com memória constante (workbook write_only).
+
+    Os pedidos são lidos da consulta em lotes (yield_per, cursor no servidor no PostgreSQL) ou,
+    com `request_ids` (ids já calculados pelo filtro, ver RequestFilter.get_ids), carregados
+    pelos ids em blocos, e gravados linha a linha. Mesmas colunas e cores de
+    generate_requests_excel. `progress(linhas gravadas)` é chamado após cada lote.
+
+    O workbook write_only guarda as linhas em um arquivo temporário e só produz o .xlsx no
+    wb.save: o primeiro bloco de conteúdo sai depois que todas as linhas foram gravadas. Um bloco
+    vazio é emitido antes, para que os cabeçalhos da resposta sejam enviados de imediato.
+    """
+    from models import AcquisitionRequest
+    from request_queries import with_people, get_attachment_counts, iter_request_batches
+
+    yield b''
+    wb = Workbook(write_only=True)
+    _add_named_styles(wb)
+    ws = wb.create_sheet("Pedidos de Aquisição")
+    for col, header in enumerate(REQUEST_HEADERS, 1):
+        ws.column_dimensions[get_column_letter(col)].width = _header_width(header)
+    ws.append([_styled_cell(ws, header, 'pedido_cabecalho') for header in REQUEST_HEADERS])
+
+    status_totals = {}
+    written = [0]
+
+    def write_batch(batch):
+        attachment_counts = get_attachment_counts([request.id for request in batch])
+        for request in batch:
+            status_totals[request.status] = status_totals.get(request.status, 0) + 1
+            data = _request_row(request, attachment_counts.get(request.id, 0))
+            ws.append([
+                _styled_cell(ws, value, f'pedido_{color}' if (color := _cell_fill_color(col, request)) else 'pedido_celula')
+                for col, value in enumerate(data, 1)
+            ])
+        written[0] += len(batch)
+        if progress:
+            progress(written[0])
+
+    if request_ids is not None:
+        for batch in iter_request_batches(request_ids, EXCEL_STREAM_BATCH_SIZE):
+            write_batch(batch)
+    else:
+        batch = []
+        for request in with_people(query).yield_per(EXCEL_STREAM_BATCH_SIZE):
+            batch.append(request)
+            if len(batch) >= EXCEL_STREAM_BATCH_SIZE:
+                write_batch(batch)
+                batch = []
+        if batch:
+            write_batch(batch)
+
+    # Resumo
+    ws2 = wb.create_sheet("Resumo")
+    title_cell = WriteOnlyCell(ws2, value='121 - Escola Senai "Carlos Pasquale"')
+    title_cell.font = Font(bold=True, size=16)
+    subtitle_cell = WriteOnlyCell(ws2, value="Relatório de Pedidos de Aquisição")
+    subtitle_cell.font = Font(bold=True, size=14)
+    stats_cell = WriteOnlyCell(ws2, value="Estatísticas:")
+    stats_cell.font = Font(bold=True)
+    ws2.append([title_cell])
+    ws2.append([subtitle_cell])
+    ws2.append([f"Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M')}"])
+    ws2.append([])
+    ws2.append([stats_cell])
+    ws2.append([f"Total de Pedidos: {sum(status_totals.values())}"])
+    for status_code, status_name in AcquisitionRequest.STATUS_CHOICES:
+        ws2.append([f"{status_name}: {status_totals.get(status_code, 0)}"])
+
+    yield from _iter_saved_workbook(wb)
+
 def generate_request_excel(request_id):
     """Generate Excel file for a specific request with detailed information"""
     from models import AcquisitionRequest, User, StatusChange, Attachment
+    from request_queries import with_people, status_history_query, attachments_query
     
-    request = AcquisitionRequest.query.get_or_404(request_id)
+    request = with_people(AcquisitionRequest.query).filter(AcquisitionRequest.id == request_id).first_or_404()
     
     wb = Workbook()
     ws = wb.active
@@ -182,8 +324,7 @@ def generate_request_excel(request_id):
     ws.cell(row=8, column=2, value=request.creator.full_name if request.creator else "")
     
     ws.cell(row=9, column=1, value="Responsável:").font = Font(bold=True)
-    responsible = User.query.get(request.responsible_id) if request.responsible_id else None
-    ws.cell(row=9, column=2, value=responsible.full_name if responsible else "Não definido")
+    ws.cell(row=9, column=2, value=request.responsible.full_name if request.responsible else "Não definido")
     
     ws.cell(row=10, column=1, value="Data de Criação:").font = Font(bold=True)
     ws.cell(row=10, column=2, value=request.created_at.strftime("%d/%m/%Y %H:%M") if request.created_at else "")
@@ -199,7 +340,7 @@ def generate_request_excel(request_id):
     ws.cell(row=13, column=2).alignment = Alignment(wrap_text=True)
     
     # Status history
-    status_history = StatusChange.query.filter_by(request_id=request.id).order_by(StatusChange.change_date.desc()).all()
+    status_history = status_history_query(request.id).all()
     if status_history:
         ws.cell(row=15, column=1, value="Histórico de Status:").font = Font(bold=True)
         
@@ -217,7 +358,7 @@ def generate_request_excel(request_id):
             ws.cell(row=row_num, column=5, value=change.comments or "")
     
     # Attachments
-    attachments = request.attachments.all()
+    attachments = attachments_query(request.id).all()
     if attachments:
         current_row = len(status_history) + 19 if status_history else 17
         ws.cell(row=current_row, column=1, value="Anexos:").font = Font(bold=True)
@@ -1,7 +1,11 @@
-from openpyxl import Workbook
+import codecs
+import csv
+from datetime import date, datetime
+from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
-from models import User, AcquisitionRequest
+from app import app
+from models import AcquisitionRequest
 import io
 
 def generate_import_template():
@@ -124,7 +128,7 @@ def generate_import_template():
         ["", ""],
         ["4. Observações importantes:", ""],
         ["   • Remova as linhas de exemplo (em azul) antes de importar", ""],
-        ["   • Máximo de 100 pedidos por arquivo", ""],
+        [f"   • Máximo de {app.config['BULK_IMPORT_MAX_ROWS']} pedidos por arquivo", ""],
         ["   • Use exatamente os nomes acima para evitar erros de validação", ""],
     ]
     
@@ -147,16 +151,57 @@ def generate_import_template():
     
     return wb
 
-def process_import_file(file_path, current_user):
-    """Processa o arquivo Excel importado e retorna lista de pedidos para criação"""
-    from openpyxl import load_workbook
-    
+# Colunas do modelo de importação (mesma ordem no .xlsx e no .csv)
+IMPORT_COLUMNS = 12
+
+def _iter_xlsx_rows(stream):
+    """Linhas de dados da planilha; em read_only as células são lidas do arquivo durante a iteração"""
+    wb = load_workbook(stream, read_only=True, data_only=True)
     try:
-        wb = load_workbook(file_path)
         ws = wb.active
-        
-        pedidos = []
-        erros = []
+        # Dimensões gravadas por outros programas podem estar erradas: lê até a última linha existente
+        ws.reset_dimensions()
+        for row_idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), 2):
+            yield row_idx, row
+    finally:
+        wb.close()
+
+def _iter_csv_rows(stream):
+    """Linhas de dados de um CSV com as colunas do modelo (separador , ; ou tab; UTF-8 ou Windows-1252)"""
+    sample = stream.read(64 * 1024)
+    stream.seek(0)
+    try:
+        # Decodificador incremental: o trecho lido pode terminar no meio de um caractere
+        text = codecs.getincrementaldecoder('utf-8-sig')().decode(sample)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        text = sample.decode('cp1252', errors='replace')
+        encoding = 'cp1252'
+    try:
+        dialect = csv.Sniffer().sniff(text, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+
+    reader = csv.reader(io.TextIOWrapper(stream, encoding=encoding, errors='replace', newline=''), dialect)
+    next(reader, None)  # cabeçalho
+    for row_idx, row in enumerate(reader, 2):
+        yield row_idx, [value.strip() or None for value in row]
+
+def read_import_file(stream, filename, erros):
+    """Lê a planilha (.xlsx) ou o CSV enviado e gera os pedidos válidos, um a um.
+
+    Lê direto do stream do upload, sem arquivo temporário nem planilha inteira em memória.
+    Problemas encontrados são acrescentados a `erros`; a leitura para em BULK_IMPORT_MAX_ROWS pedidos.
+    """
+    from bulk_import import user_name_map
+    
+    max_rows = app.config['BULK_IMPORT_MAX_ROWS']
+    try:
+        if filename.lower().endswith('.csv'):
+            rows = _iter_csv_rows(stream)
+        else:
+            rows = _iter_xlsx_rows(stream)
+        count = 0
         
         # Mapping for flexible text matching
         status_map = {s[1].lower(): s[0] for s in AcquisitionRequest.STATUS_CHOICES}
@@ -190,14 +235,28 @@ def process_import_file(file_path, current_user):
             if not final_parts: return "material"
             return ",".join(list(dict.fromkeys(final_parts))) # unique and joined
 
-        # Skip header row
-        for row_idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), 2):
+        def parse_float(val):
+            if val is None or val == "": return None
+            if isinstance(val, (int, float)): return float(val)  # célula numérica: já é o valor
+            text = str(val).replace('R$', '').strip()
+            if ',' in text:
+                # Formato brasileiro (1.234,50): ponto é separador de milhar e vírgula é decimal
+                text = text.replace('.', '').replace(',', '.')
+            try:
+                return float(text)
+            except ValueError: return None
+
+        # Responsáveis: nomes carregados uma vez (em vez de uma consulta por linha)
+        users_by_name = user_name_map()
+
+        # Header row is skipped by the readers
+        for row_idx, row in rows:
             if not any(row):  # Skip empty rows
                 continue
             
             # Ensure row has enough columns
-            row_data = list(row) + [None] * (12 - len(row))
-            titulo, descricao, status, prioridade, impacto, classe, categoria, data_solicitacao, valor_estimado, valor_final, responsavel_nome, observacoes = row_data[:12]
+            row_data = list(row) + [None] * (IMPORT_COLUMNS - len(row))
+            titulo, descricao, status, prioridade, impacto, classe, categoria, data_solicitacao, valor_estimado, valor_final, responsavel_nome, observacoes = row_data[:IMPORT_COLUMNS]
             
             # Clean text data
             titulo = str(titulo).strip() if titulo else ""
@@ -226,7 +285,6 @@ def process_import_file(file_path, current_user):
             # Validate and parse date
             try:
                 if data_solicitacao:
-                    from datetime import datetime
                     if isinstance(data_solicitacao, str):
                         # Try common formats
                         for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
@@ -240,33 +298,27 @@ def process_import_file(file_path, current_user):
                     else:
                         data_parsed = data_solicitacao.date() if hasattr(data_solicitacao, 'date') else data_solicitacao
                 else:
-                    from datetime import date
                     data_parsed = date.today()
             except Exception:
-                from datetime import date
                 data_parsed = date.today()
             
             # Find responsible user - flexible matching
             responsible_id = None
             if responsavel_nome:
-                resp_name = str(responsavel_nome).strip()
-                responsible = User.query.filter(User.full_name.ilike(resp_name)).first()
-                if responsible:
-                    responsible_id = responsible.id
-                else:
+                responsible_id = users_by_name.get(str(responsavel_nome).strip().casefold())
+                if responsible_id is None:
                     erros.append(f"Linha {row_idx}: Responsável '{responsavel_nome}' não encontrado.")
             
             # Parse values
-            def parse_float(val):
-                if val is None or val == "": return None
-                try:
-                    return float(str(val).replace('R$', '').replace('.', '').replace(',', '.').strip())
-                except: return None
-
             valor_estimado_parsed = parse_float(valor_estimado)
             valor_final_parsed = parse_float(valor_final)
             
-            pedidos.append({
+            if count >= max_rows:
+                erros.append(f"Limite de {max_rows} pedidos atingido.")
+                break
+            count += 1
+            
+            yield {
                 'titulo': titulo,
                 'descricao': descricao,
                 'status': status_val,
@@ -280,13 +332,7 @@ def process_import_file(file_path, current_user):
                 'responsible_id': responsible_id,
                 'observacoes': str(observacoes).strip() if observacoes else None,
                 'linha': row_idx
-            })
-            
-            if len(pedidos) >= 100:
-                erros.append("Limite de 100 pedidos atingido.")
-                break
-        
-        return pedidos, erros
+            }
         
     except Exception as e:
-        return [], [f"Erro crítico: {str(e)}"]
\ No newline at end of file
+        erros.append(f"Erro crítico: {str(e)}")
\ No newline at end of file
@@ -151,8 +151,8 @@ class SearchForm(FlaskForm):
         ]
 
 class BulkImportForm(FlaskForm):
-    excel_file = FileField('Arquivo Excel', validators=[
-        DataRequired('Por favor, selecione um arquivo Excel.'),
-        FileAllowed(['xlsx', 'xls'], 'Apenas arquivos Excel (.xlsx, .xls) são permitidos.')
+    excel_file = FileField('Arquivo Excel ou CSV', validators=[
+        DataRequired('Por favor, selecione um arquivo Excel ou CSV.'),
+        FileAllowed(['xlsx', 'xls', 'csv'], 'Apenas arquivos Excel (.xlsx, .xls) ou CSV (.csv) são permitidos.')
     ])
     submit = SubmitField('Importar Pedidos')
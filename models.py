@@ -13,6 +13,7 @@ class User(UserMixin, db.Model):
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
     active = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Invalida os PDFs em cache (nomes)
     
     @property
     def is_active(self):
@@ -30,23 +31,30 @@ class AcquisitionRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
-    status = db.Column(db.String(50), nullable=False, default='aberto')
+    status = db.Column(db.String(50), nullable=False, default='aberto', index=True)
     observations = db.Column(db.Text)
-    priority = db.Column(db.String(20)) # urgente, necessario, planejado
-    impact = db.Column(db.String(50)) # critico, alto, medio, baixo
+    priority = db.Column(db.String(20), index=True) # urgente, necessario, planejado
+    impact = db.Column(db.String(50), index=True) # critico, alto, medio, baixo
     estimated_value = db.Column(db.Numeric(10, 2))  # Valor estimado para fase de orçamento
     final_value = db.Column(db.Numeric(10, 2))      # Valor final para fase de compra/entrega
-    request_date = db.Column(db.Date, nullable=False, default=date.today)
+    request_date = db.Column(db.Date, nullable=False, default=date.today, index=True)
     delivery_deadline = db.Column(db.Date)  # Prazo de entrega (opcional)
     deadline_alert_sent = db.Column(db.Boolean, default=False, nullable=False)  # Flag para controlar envio de alerta
-    classe = db.Column(db.String(50), nullable=False, default='ensino')  # Ensino ou Manutenção
-    categoria = db.Column(db.String(100), nullable=False, default='material')  # Serviço ou Material (podem ser múltiplas separadas por vírgula)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    classe = db.Column(db.String(50), nullable=False, default='ensino', index=True)  # Ensino ou Manutenção
+    categoria = db.Column(db.String(100), nullable=False, default='material', index=True)  # Serviço ou Material (podem ser múltiplas separadas por vírgula)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Foreign keys
     created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    responsible_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    responsible_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    
+    __table_args__ = (
+        # Ordenação padrão das listagens e chave da paginação por cursor
+        db.Index('ix_acquisition_request_updated_at_id', 'updated_at', 'id'),
+        # Pedidos recentes de um usuário (importação em lote)
+        db.Index('ix_acquisition_request_created_by_created_at', 'created_by_id', 'created_at'),
+    )
     
     # Relationships
     attachments = db.relationship('Attachment', backref='request', lazy='dynamic', cascade='all, delete-orphan')
@@ -151,30 +159,58 @@ class Attachment(db.Model):
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.Integer)
-    file_content = db.Column(db.LargeBinary)  # Nova coluna para salvar no banco
+    original_file_size = db.Column(db.Integer)  # Tamanho enviado, quando a imagem foi reduzida no upload
+    # Legado: conteúdo migrado para o blob store (ver blob_sha256). Adiado: só é lido quando acessado (download)
+    file_content = db.deferred(db.Column(db.LargeBinary))
+    blob_sha256 = db.Column(db.String(64), index=True)  # Conteúdo no blob store (blob.sha256)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Foreign key
-    request_id = db.Column(db.Integer, db.ForeignKey('acquisition_request.id'), nullable=False)
+    request_id = db.Column(db.Integer, db.ForeignKey('acquisition_request.id'), nullable=False, index=True)
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
     # Relationships
     uploaded_by = db.relationship('User', backref='uploaded_files')
+    blob = db.relationship('Blob', primaryjoin='foreign(Attachment.blob_sha256) == Blob.sha256', viewonly=True)
+    
+    @property
+    def has_preview(self):
+        return self.blob is not None and self.blob.preview_status == 'ready'
     
     def __repr__(self):
         return f'<Attachment {self.original_filename}>'
 
+class Blob(db.Model):
+    """Conteúdo de anexo no blob store, endereçado pelo SHA-256 e compartilhado entre anexos iguais"""
+    __tablename__ = 'blob'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # Anexos que apontam para o blob; 0 = coletável
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    preview_status = db.Column(db.String(20), index=True)  # None = pendente, ready, unavailable, failed
+    preview_format = db.Column(db.String(10))  # png, jpeg
+    released_at = db.Column(db.DateTime)  # Quando ref_count chegou a 0 (coletável após BLOB_GC_GRACE_HOURS)
+    
+    def __repr__(self):
+        return f'<Blob {self.sha256[:12]} refs={self.ref_count}>'
+
 class StatusChange(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     old_status = db.Column(db.String(50))
     new_status = db.Column(db.String(50), nullable=False)
-    change_date = db.Column(db.DateTime, default=datetime.utcnow)
+    change_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     comments = db.Column(db.Text)
     
     # Foreign keys
     request_id = db.Column(db.Integer, db.ForeignKey('acquisition_request.id'), nullable=False)
     changed_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
+    __table_args__ = (
+        # Histórico de um pedido, sempre ordenado por data
+        db.Index('ix_status_change_request_id_change_date', 'request_id', 'change_date'),
+    )
+    
     def get_old_status_display(self):
         status_dict = dict(AcquisitionRequest.STATUS_CHOICES)
         return status_dict.get(self.old_status, self.old_status) if self.old_status else 'Criado'
@@ -185,3 +221,130 @@ class StatusChange(db.Model):
     
     def __repr__(self):
         return f'<StatusChange {self.old_status} -> {self.new_status}>'
+
+class RequestStat(db.Model):
+    """Totais consolidados de pedidos por status/classe/prioridade/responsável"""
+    __tablename__ = 'request_stats'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(50), nullable=False)
+    classe = db.Column(db.String(50), nullable=False)
+    priority = db.Column(db.String(20), nullable=False, default='')  # '' quando o pedido não tem prioridade
+    responsible_id = db.Column(db.Integer, nullable=False, default=0)  # 0 quando o pedido não tem responsável
+    request_count = db.Column(db.Integer, nullable=False, default=0)
+    estimated_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    final_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('status', 'classe', 'priority', 'responsible_id', name='uq_request_stats_key'),
+    )
+    
+    def __repr__(self):
+        return f'<RequestStat {self.status}/{self.classe}/{self.priority}/{self.responsible_id}: {self.request_count}>'
+
+class JobRun(db.Model):
+    """Execuções das tarefas periódicas (ex.: alertas de prazo), exibidas no painel administrativo"""
+    __tablename__ = 'job_run'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_name = db.Column(db.String(50), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, success, error
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text)
+    
+    __table_args__ = (
+        db.Index('ix_job_run_job_name_started_at', 'job_name', 'started_at'),
+        # Trava do job: no máximo uma execução 'running' por job (ver scheduler._start_run)
+        db.Index('uq_job_run_running', 'job_name', unique=True,
+                 postgresql_where=db.text("status = 'running'"), sqlite_where=db.text("status = 'running'")),
+    )
+    
+    @property
+    def duration_seconds(self):
+        if not self.finished_at:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+    
+    def __repr__(self):
+        return f'<JobRun {self.job_name} {self.status}>'
+
+class EmailOutbox(db.Model):
+    """Fila de e-mails gravada na mesma transação da alteração do pedido e enviada pelo worker"""
+    __tablename__ = 'email_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)  # notification, deadline_alert
+    request_id = db.Column(db.Integer)  # sem chave estrangeira: o histórico de envio sobrevive à exclusão do pedido
+    recipient_email = db.Column(db.String(120), nullable=False)
+    recipient_name = db.Column(db.String(120))
+    subject = db.Column(db.String(300), nullable=False)
+    html_body = db.Column(db.Text, nullable=False)
+    dedup_key = db.Column(db.String(200), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+    
+    def __repr__(self):
+        return f'<EmailOutbox {self.kind} {self.recipient_email} {self.status}>'
+
+class UploadSession(db.Model):
+    """Upload retomável em blocos numerados; o arquivo montado vira anexo ao salvar o pedido"""
+    __tablename__ = 'upload_session'
+    
+    id = db.Column(db.String(32), primary_key=True)  # token aleatório usado nas URLs da API
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    total_chunks = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='open')  # open, complete, attached
+    blob_sha256 = db.Column(db.String(64))  # preenchido ao concluir a montagem
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_upload_session_status_updated_at', 'status', 'updated_at'),
+    )
+    
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.filename} {self.status}>'
+
+class ReportJob(db.Model):
+    """Relatório pesado (PDF/Excel) gerado em segundo plano pelo worker de relatórios"""
+    __tablename__ = 'report_job'
+    
+    id = db.Column(db.String(32), primary_key=True)  # Aleatório: também identifica o link de download
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    kind = db.Column(db.String(30), nullable=False)  # pdf_filtered, excel_filtered
+    params = db.Column(db.Text, nullable=False, default='{}')  # Filtros do dashboard (JSON)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    progress = db.Column(db.Integer, nullable=False, default=0)  # 0 a 100
+    message = db.Column(db.String(300))
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    result_key = db.Column(db.String(100))  # Objeto no blob store com o arquivo gerado
+    result_name = db.Column(db.String(200))
+    result_size = db.Column(db.BigInteger)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, index=True)
+    
+    user = db.relationship('User')
+    
+    __table_args__ = (
+        db.Index('ix_report_job_status_created_at', 'status', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<ReportJob {self.kind} {self.status} {self.progress}%>'
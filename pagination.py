@@ -0,0 +1,105 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+def encode_cursor(sort_value, row_id, direction):
+    """Gera um token opaco para a posição (sort_value, row_id)"""
+    payload = json.dumps({
+        'v': sort_value.isoformat() if sort_value else None,
+        'i': row_id,
+        'd': direction
+    }, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Decodifica um token gerado por encode_cursor; retorna None se for inválido"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        sort_value = datetime.fromisoformat(payload['v']) if payload['v'] else None
+        direction = payload['d'] if payload['d'] in ('next', 'prev') else 'next'
+        return sort_value, int(payload['i']), direction
+    except (ValueError, KeyError, TypeError):
+        return None
+
+class KeysetPagination:
+    """Paginação por cursor em (sort_column, id_column), do mais recente para o mais antigo.
+
+    Ao contrário de query.paginate(), não usa OFFSET nem COUNT(*): cada página é
+    uma consulta com WHERE na chave de ordenação e LIMIT per_page + 1, com custo
+    constante em qualquer profundidade. O total é opcional e pode ser informado
+    pelo chamador (por exemplo, a contagem já calculada para os cards).
+    """
+    mode = 'keyset'
+
+    def __init__(self, query, sort_column, id_column, cursor=None, per_page=10, total=None):
+        self.per_page = per_page
+        self.total = total
+
+        position = decode_cursor(cursor)
+        direction = position[2] if position else 'next'
+        rows = self._fetch(query, sort_column, id_column, position, direction, per_page + 1)
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+
+        if direction == 'next':
+            self.items = rows
+            self.has_next = has_more
+            self.has_prev = position is not None
+        else:
+            self.items = list(reversed(rows))
+            self.has_next = True
+            self.has_prev = has_more
+
+        sort_key = sort_column.key
+        id_key = id_column.key
+        if self.items:
+            first, last = self.items[0], self.items[-1]
+            self.prev_cursor = encode_cursor(getattr(first, sort_key), getattr(first, id_key), 'prev') if self.has_prev else None
+            self.next_cursor = encode_cursor(getattr(last, sort_key), getattr(last, id_key), 'next') if self.has_next else None
+        else:
+            self.prev_cursor = None
+            self.next_cursor = None
+            self.has_next = self.has_prev = False
+
+    @staticmethod
+    def _fetch(query, sort_column, id_column, position, direction, limit):
+        """Linhas a partir do cursor na direção pedida.
+
+        Linhas com sort_column NULL (pedidos antigos sem updated_at) vêm depois de todas as
+        outras, ordenadas por id, em qualquer banco. Cada trecho é uma consulta separada para que
+        a parte com valor continue usando o índice em (sort_column, id).
+        """
+        sort_value, row_id = position[:2] if position else (None, None)
+        on_null = position is not None and sort_value is None
+        rows = []
+        if direction == 'next':
+            if not on_null:
+                valued = query.filter(sort_column.isnot(None))
+                if position:
+                    valued = valued.filter(or_(
+                        sort_column < sort_value,
+                        and_(sort_column == sort_value, id_column < row_id)
+                    ))
+                rows = valued.order_by(sort_column.desc(), id_column.desc()).limit(limit).all()
+            if len(rows) < limit:
+                nulls = query.filter(sort_column.is_(None))
+                if on_null:
+                    nulls = nulls.filter(id_column < row_id)
+                rows += nulls.order_by(id_column.desc()).limit(limit - len(rows)).all()
+        else:
+            if on_null:
+                rows = query.filter(sort_column.is_(None), id_column > row_id) \
+                    .order_by(id_column.asc()).limit(limit).all()
+            if len(rows) < limit:
+                valued = query.filter(sort_column.isnot(None))
+                if not on_null:
+                    valued = valued.filter(or_(
+                        sort_column > sort_value,
+                        and_(sort_column == sort_value, id_column > row_id)
+                    ))
+                rows += valued.order_by(sort_column.asc(), id_column.asc()).limit(limit - len(rows)).all()
+        return rows
@@ -3,55 +3,148 @@ from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from datetime import datetime
-from models import AcquisitionRequest, StatusChange, User
 import io
 
-def generate_request_pdf(request_obj):
-    """Gera PDF para um pedido específico"""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
+# Os PDFs são montados em duas etapas: *_data() lê o banco e devolve dicionários simples e
+# render_*() monta o PDF só a partir deles, sem ORM nem app (pode rodar em outro processo,
+# ver document_rendering.py). Os imports de models ficam dentro das funções *_data().
+
+# Estilos criados uma vez por processo e compartilhados pelos relatórios
+_STYLES = getSampleStyleSheet()
+
+NORMAL_STYLE = _STYLES['Normal']
+
+SECTION_STYLE = ParagraphStyle(
+    'SectionHeader',
+    parent=_STYLES['Heading2'],
+    fontSize=14,
+    spaceAfter=12,
+    textColor=colors.darkblue
+)
+
+FOOTER_STYLE = ParagraphStyle(
+    'Footer',
+    parent=_STYLES['Normal'],
+    fontSize=8,
+    alignment=1,
+    textColor=colors.grey
+)
+
+REQUEST_TITLE_STYLE = ParagraphStyle(
+    'RequestTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=18,
+    spaceAfter=30,
+    alignment=1,  # Center
+    textColor=colors.darkblue
+)
+
+REPORT_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=20,
+    spaceAfter=30,
+    alignment=1,
+    textColor=colors.darkblue
+)
+
+STATS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
+    ('TEXTCOLOR', (0, 0), (0, -1), colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+])
+
+STATUS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+])
+
+REQUEST_LIST_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+])
+
+REQUEST_LIST_HEADER = ['ID', 'Título', 'Status', 'Criado por', 'Responsável', 'Data']
+REQUEST_LIST_COL_WIDTHS = [0.5*inch, 2.2*inch, 1*inch, 1.3*inch, 1.3*inch, 0.8*inch]
+
+# Linhas por tabela na lista de pedidos: cada bloco cabe em uma página A4 e é diagramado
+# isoladamente (uma única tabela com milhares de linhas custa tempo e memória superlineares)
+REQUEST_LIST_CHUNK_ROWS = 45
+
+
+def request_pdf_data(request_obj):
+    """Dados do PDF de um pedido (pedido, anexos e histórico) em dicionários simples"""
+    from request_queries import status_history_query, attachments_query
+
+    return {
+        'id': request_obj.id,
+        'title': request_obj.title,
+        'status_display': request_obj.get_status_display(),
+        'estimated_value': request_obj.estimated_value,
+        'final_value': request_obj.final_value,
+        'creator_name': request_obj.creator.full_name,
+        'responsible_name': request_obj.responsible.full_name if request_obj.responsible else None,
+        'created_at': request_obj.created_at,
+        'updated_at': request_obj.updated_at,
+        'description': request_obj.description,
+        'observations': request_obj.observations,
+        'attachments': [{
+            'original_filename': attachment.original_filename,
+            'file_size': attachment.file_size,
+            'upload_date': attachment.upload_date,
+            'uploaded_by': attachment.uploaded_by.full_name,
+        } for attachment in attachments_query(request_obj.id)],
+        'status_history': [{
+            'change_date': change.change_date,
+            'old_status': change.get_old_status_display() if change.old_status else None,
+            'new_status': change.get_new_status_display(),
+            'changed_by': change.changed_by_user.full_name,
+            'comments': change.comments,
+        } for change in status_history_query(request_obj.id)],
+    }
+
+def render_request_pdf(data, output=None):
+    """Monta o PDF de um pedido a partir de request_pdf_data() (em `output`, se informado; senão retorna um BytesIO)"""
+    buffer = None
+    if output is None:
+        output = buffer = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=A4)
     story = []
-    styles = getSampleStyleSheet()
-    
-    # Estilo customizado para título
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        spaceAfter=30,
-        alignment=1,  # Center
-        textColor=colors.darkblue
-    )
-    
-    # Estilo para seções
-    section_style = ParagraphStyle(
-        'SectionHeader',
-        parent=styles['Heading2'],
-        fontSize=14,
-        spaceAfter=12,
-        textColor=colors.darkblue
-    )
     
     # Cabeçalho
-    story.append(Paragraph('121 - Escola Senai "Carlos Pasquale"', title_style))
-    story.append(Paragraph("Sistema de Controle de Aquisições", styles['Normal']))
+    story.append(Paragraph('121 - Escola Senai "Carlos Pasquale"', REQUEST_TITLE_STYLE))
+    story.append(Paragraph("Sistema de Controle de Aquisições", NORMAL_STYLE))
     story.append(Spacer(1, 20))
     
     # Título do pedido
-    story.append(Paragraph(f"Pedido de Aquisição #{request_obj.id}", section_style))
+    story.append(Paragraph(f"Pedido de Aquisição #{data['id']}", SECTION_STYLE))
     story.append(Spacer(1, 12))
     
     # Informações básicas
     info_data = [
-        ['Título:', request_obj.title],
-        ['Status:', request_obj.get_status_display()],
-        ['Valor Estimado:', f'R$ {request_obj.estimated_value:.2f}' if request_obj.estimated_value else 'Não informado'],
-        ['Valor Final:', f'R$ {request_obj.final_value:.2f}' if request_obj.final_value else 'Não informado'],
-        ['Criado por:', request_obj.creator.full_name],
-        ['Responsável:', request_obj.responsible.full_name if request_obj.responsible else 'Não definido'],
-        ['Data de criação:', request_obj.created_at.strftime('%d/%m/%Y às %H:%M')],
-        ['Última atualização:', request_obj.updated_at.strftime('%d/%m/%Y às %H:%M')]
+        ['Título:', data['title']],
+        ['Status:', data['status_display']],
+        ['Valor Estimado:', f"R$ {data['estimated_value']:.2f}" if data['estimated_value'] else 'Não informado'],
+        ['Valor Final:', f"R$ {data['final_value']:.2f}" if data['final_value'] else 'Não informado'],
+        ['Criado por:', data['creator_name']],
+        ['Responsável:', data['responsible_name'] or 'Não definido'],
+        ['Data de criação:', data['created_at'].strftime('%d/%m/%Y às %H:%M')],
+        ['Última atualização:', data['updated_at'].strftime('%d/%m/%Y às %H:%M')]
     ]
     
     info_table = Table(info_data, colWidths=[2.2*inch, 3.8*inch])
@@ -70,30 +163,30 @@ def generate_request_pdf(request_obj):
     story.append(Spacer(1, 20))
     
     # Descrição
-    story.append(Paragraph("Descrição", section_style))
-    description_text = request_obj.description.replace('\n', '<br/>')
-    story.append(Paragraph(description_text, styles['Normal']))
+    story.append(Paragraph("Descrição", SECTION_STYLE))
+    description_text = data['description'].replace('\n', '<br/>')
+    story.append(Paragraph(description_text, NORMAL_STYLE))
     story.append(Spacer(1, 15))
     
     # Observações
-    if request_obj.observations:
-        story.append(Paragraph("Observações", section_style))
-        observations_text = request_obj.observations.replace('\n', '<br/>')
-        story.append(Paragraph(observations_text, styles['Normal']))
+    if data['observations']:
+        story.append(Paragraph("Observações", SECTION_STYLE))
+        observations_text = data['observations'].replace('\n', '<br/>')
+        story.append(Paragraph(observations_text, NORMAL_STYLE))
         story.append(Spacer(1, 15))
     
     # Anexos
-    if request_obj.attachments.count() > 0:
-        story.append(Paragraph("Anexos", section_style))
+    if data['attachments']:
+        story.append(Paragraph("Anexos", SECTION_STYLE))
         attachment_data = [['Nome do Arquivo', 'Tamanho', 'Data de Upload', 'Enviado por']]
         
-        for attachment in request_obj.attachments:
-            file_size = f"{attachment.file_size / 1024:.1f} KB" if attachment.file_size else "N/A"
+        for attachment in data['attachments']:
+            file_size = f"{attachment['file_size'] / 1024:.1f} KB" if attachment['file_size'] else "N/A"
             attachment_data.append([
-                attachment.original_filename,
+                attachment['original_filename'],
                 file_size,
-                attachment.upload_date.strftime('%d/%m/%Y'),
-                attachment.uploaded_by.full_name
+                attachment['upload_date'].strftime('%d/%m/%Y'),
+                attachment['uploaded_by']
             ])
         
         attachment_table = Table(attachment_data, colWidths=[2.5*inch, 1*inch, 1.2*inch, 1.8*inch])
@@ -112,23 +205,18 @@ def generate_request_pdf(request_obj):
         story.append(Spacer(1, 20))
     
     # Histórico de status
-    story.append(Paragraph("Histórico de Alterações", section_style))
-    status_history = StatusChange.query.filter_by(request_id=request_obj.id).order_by(StatusChange.change_date.desc()).all()
+    story.append(Paragraph("Histórico de Alterações", SECTION_STYLE))
     
-    if status_history:
+    if data['status_history']:
         history_data = [['Data/Hora', 'Status Anterior', 'Novo Status', 'Alterado por', 'Comentários']]
         
-        for change in status_history:
-            old_status = change.get_old_status_display() if change.old_status else 'Criado'
-            new_status = change.get_new_status_display()
-            comments = change.comments if change.comments else '-'
-            
+        for change in data['status_history']:
             history_data.append([
-                change.change_date.strftime('%d/%m/%Y %H:%M'),
-                old_status,
-                new_status,
-                change.changed_by_user.full_name,
-                comments
+                change['change_date'].strftime('%d/%m/%Y %H:%M'),
+                change['old_status'] or 'Criado',
+                change['new_status'],
+                change['changed_by'],
+                change['comments'] or '-'
             ])
         
         history_table = Table(history_data, colWidths=[1.2*inch, 1.2*inch, 1.2*inch, 1.5*inch, 1.4*inch])
@@ -145,150 +233,146 @@ def generate_request_pdf(request_obj):
         
         story.append(history_table)
     
-    # Rodapé
+    # Rodapé: o PDF fica em cache enquanto os dados não mudam, então mostra a data dos dados
+    # (última alteração do pedido, anexo ou status), não a da geração do arquivo
+    dates = [data['updated_at']] + \
+        [attachment['upload_date'] for attachment in data['attachments']] + \
+        [change['change_date'] for change in data['status_history']]
+    dates = [value for value in dates if value]
     story.append(Spacer(1, 30))
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=8,
-        alignment=1,
-        textColor=colors.grey
-    )
-    story.append(Paragraph(f"Relatório gerado em {datetime.now().strftime('%d/%m/%Y às %H:%M')}", footer_style))
-    
+    if dates:
+        story.append(Paragraph(f"Dados de {max(dates).strftime('%d/%m/%Y às %H:%M')}", FOOTER_STYLE))
+
     doc.build(story)
-    buffer.seek(0)
+    if buffer is not None:
+        buffer.seek(0)
     return buffer
 
-def generate_general_report(requests=None):
-    """Gera relatório geral do sistema ou relatório filtrado"""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
+def generate_request_pdf(request_obj, output=None):
+    """Gera PDF para um pedido específico (em `output`, se informado; senão retorna um BytesIO)"""
+    return render_request_pdf(request_pdf_data(request_obj), output)
+
+def _request_list_row(row):
+    title = row['title']
+    return [
+        f"#{row['id']}",
+        title[:40] + "..." if len(title) > 40 else title,
+        row['status_display'],
+        row['creator_name'] or '',
+        row['responsible_name'] or 'Não definido',
+        row['created_at'].strftime('%d/%m/%Y') if row['created_at'] else ''
+    ]
+
+def _request_list_tables(rows):
+    """Lista de pedidos em tabelas de REQUEST_LIST_CHUNK_ROWS linhas, cada uma com o cabeçalho"""
+    for start in range(0, len(rows), REQUEST_LIST_CHUNK_ROWS):
+        table_rows = [REQUEST_LIST_HEADER] + [_request_list_row(row) for row in rows[start:start + REQUEST_LIST_CHUNK_ROWS]]
+        # repeatRows: se o bloco não couber no restante da página, o cabeçalho se repete na seguinte
+        table = Table(table_rows, colWidths=REQUEST_LIST_COL_WIDTHS, repeatRows=1)
+        table.setStyle(REQUEST_LIST_TABLE_STYLE)
+        yield table
+
+def general_report_data(requests=None, filtered=None):
+    """Dados do relatório geral em dicionários simples (uma linha por pedido, na ordem recebida).
+
+    Sem `requests`, usa todos os pedidos. `filtered` escolhe o título da lista; se omitido,
+    compara com o total de pedidos da tabela consolidada.
+    """
+    from models import AcquisitionRequest
+    from request_queries import with_people
+    from stats import get_rollup_totals, get_user_counts
+
+    if requests is None:
+        requests = with_people(AcquisitionRequest.query).all()
+        filtered = False
+
+    # Pedidos por status (uma passada pela lista)
+    counts_by_code = {}
+    rows = []
+    updated_at = None
+    for req in requests:
+        counts_by_code[req.status] = counts_by_code.get(req.status, 0) + 1
+        if req.updated_at and (updated_at is None or req.updated_at > updated_at):
+            updated_at = req.updated_at
+        rows.append({
+            'id': req.id,
+            'title': req.title,
+            'status_display': req.get_status_display(),
+            'creator_name': req.creator.full_name if req.creator else None,
+            'responsible_name': req.responsible.full_name if req.responsible else None,
+            'created_at': req.created_at,
+        })
+
+    if filtered is None:
+        filtered = len(rows) < get_rollup_totals()['count']
+    return {
+        'active_users': get_user_counts()['active_users'],
+        'status_counts': [(status_name, counts_by_code.get(status_code, 0))
+                          for status_code, status_name in AcquisitionRequest.STATUS_CHOICES],
+        'filtered': filtered,
+        'updated_at': updated_at,
+        'rows': rows,
+    }
+
+def render_general_report(data, output=None):
+    """Monta o relatório geral a partir de general_report_data() (em `output`, se informado; senão retorna um BytesIO)"""
+    buffer = None
+    if output is None:
+        output = buffer = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=A4)
     story = []
-    styles = getSampleStyleSheet()
-    
-    # Estilo customizado para título
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=20,
-        spaceAfter=30,
-        alignment=1,
-        textColor=colors.darkblue
-    )
-    
-    section_style = ParagraphStyle(
-        'SectionHeader',
-        parent=styles['Heading2'],
-        fontSize=14,
-        spaceAfter=12,
-        textColor=colors.darkblue
-    )
     
     # Cabeçalho
-    story.append(Paragraph('121 - Escola Senai "Carlos Pasquale"', title_style))
-    story.append(Paragraph("Relatório Geral de Aquisições", styles['Normal']))
+    story.append(Paragraph('121 - Escola Senai "Carlos Pasquale"', REPORT_TITLE_STYLE))
+    story.append(Paragraph("Relatório Geral de Aquisições", NORMAL_STYLE))
     story.append(Spacer(1, 20))
     
-    # Obter dados dos pedidos
-    if requests is None:
-        requests = AcquisitionRequest.query.all()
-    
     # Estatísticas gerais
-    total_requests = len(requests)
-    total_users = User.query.filter_by(is_active=True).count()
+    total_requests = len(data['rows'])
     
     stats_data = [
         ['Total de Pedidos:', str(total_requests)],
-        ['Usuários Ativos:', str(total_users)],
-        ['Data do Relatório:', datetime.now().strftime('%d/%m/%Y às %H:%M')]
+        ['Usuários Ativos:', str(data['active_users'])],
+        # O PDF fica em cache enquanto os dados não mudam: mostra a data dos dados, não a da geração
+        ['Dados de:', data['updated_at'].strftime('%d/%m/%Y às %H:%M') if data['updated_at'] else '-']
     ]
     
-    story.append(Paragraph("Estatísticas Gerais", section_style))
+    story.append(Paragraph("Estatísticas Gerais", SECTION_STYLE))
     stats_table = Table(stats_data, colWidths=[2*inch, 4*inch])
-    stats_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
-    
+    stats_table.setStyle(STATS_TABLE_STYLE)
     story.append(stats_table)
     story.append(Spacer(1, 20))
     
     # Pedidos por status
-    story.append(Paragraph("Distribuição por Status", section_style))
-    status_counts = {}
-    for status_code, status_name in AcquisitionRequest.STATUS_CHOICES:
-        count = sum(1 for req in requests if req.status == status_code)
-        status_counts[status_name] = count
-    
+    story.append(Paragraph("Distribuição por Status", SECTION_STYLE))
     status_data = [['Status', 'Quantidade', 'Percentual']]
-    for status_name, count in status_counts.items():
+    for status_name, count in data['status_counts']:
         percentage = (count / total_requests * 100) if total_requests > 0 else 0
         status_data.append([status_name, str(count), f"{percentage:.1f}%"])
     
     status_table = Table(status_data, colWidths=[2*inch, 1.5*inch, 1.5*inch])
-    status_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
-    
+    status_table.setStyle(STATUS_TABLE_STYLE)
     story.append(status_table)
     story.append(Spacer(1, 20))
     
     # Lista dos pedidos (filtrados se aplicável)
-    report_title = "Lista de Pedidos Filtrados" if len(requests) < AcquisitionRequest.query.count() else "Lista Completa de Pedidos"
-    story.append(Paragraph(report_title, section_style))
-    
-    if requests:
-        request_data = [['ID', 'Título', 'Status', 'Criado por', 'Responsável', 'Data']]
-        
-        for req in requests:
-            responsible = req.responsible.full_name if req.responsible else 'Não definido'
-            request_data.append([
-                f"#{req.id}",
-                req.title[:40] + "..." if len(req.title) > 40 else req.title,
-                req.get_status_display(),
-                req.creator.full_name,
-                responsible,
-                req.created_at.strftime('%d/%m/%Y')
-            ])
-        
-        request_table = Table(request_data, colWidths=[0.5*inch, 2.2*inch, 1*inch, 1.3*inch, 1.3*inch, 0.8*inch])
-        request_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ]))
-        
-        story.append(request_table)
+    report_title = "Lista de Pedidos Filtrados" if data['filtered'] else "Lista Completa de Pedidos"
+    story.append(Paragraph(report_title, SECTION_STYLE))
+    story.extend(_request_list_tables(data['rows']))
     
     # Rodapé
     story.append(Spacer(1, 30))
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=8,
-        alignment=1,
-        textColor=colors.grey
-    )
-    story.append(Paragraph(f"Relatório gerado em {datetime.now().strftime('%d/%m/%Y às %H:%M')}", footer_style))
-    story.append(Paragraph('121 - Escola Senai "Carlos Pasquale" - Sistema de Controle de Aquisições', footer_style))
+    story.append(Paragraph('121 - Escola Senai "Carlos Pasquale" - Sistema de Controle de Aquisições', FOOTER_STYLE))
     
     doc.build(story)
-    buffer.seek(0)
-    return buffer
\ No newline at end of file
+    if buffer is not None:
+        buffer.seek(0)
+    return buffer
+
+def generate_general_report(requests=None, output=None, filtered=None):
+    """Gera relatório geral do sistema ou relatório filtrado.
+
+    Com `output` (caminho ou arquivo aberto), o PDF é gravado direto nele; sem, retorna um
+    BytesIO. `filtered` escolhe o título da lista; se omitido, compara com o total de pedidos.
+    """
+    return render_general_report(general_report_data(requests, filtered), output)
@@ -0,0 +1,132 @@
+"""Miniaturas dos anexos, geradas em segundo plano pelo scheduler.
+
+PDFs: primeira página renderizada em PNG com pypdfium2 (dependência do projeto) ou, na falta
+dele, com o Ghostscript `gs`; sem nenhum dos dois os PDFs ficam sem miniatura ('unavailable').
+JPG/PNG: versão reduzida no mesmo formato. A miniatura é gravada no blob store ao lado do
+conteúdo (<sha256>.preview.<formato>), então anexos iguais compartilham a mesma miniatura;
+o estado fica em blob.preview_status.
+"""
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+from PIL import Image, ImageOps
+from app import app, db
+from models import Blob
+from blob_store import get_blob_backend, open_blob, stored_encoding
+
+# Maior lado da miniatura, em pixels
+PREVIEW_SIZE = 360
+
+# Resolução usada ao renderizar a primeira página do PDF (suficiente para PREVIEW_SIZE)
+PDF_RENDER_DPI = 60
+
+# Aviso de renderizador ausente é registrado uma única vez por processo
+_missing_renderer_logged = False
+
+def preview_key(sha256, preview_format):
+    return f"{sha256}.preview.{preview_format}"
+
+def _detect_type(header):
+    if header.startswith(b'%PDF'):
+        return 'pdf'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    return None
+
+def _render_pdf_first_page(path):
+    """PNG da primeira página, ou None se não houver renderizador disponível"""
+    global _missing_renderer_logged
+    try:
+        import pypdfium2
+    except ImportError:
+        pypdfium2 = None
+    if pypdfium2 is not None:
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            return pdf[0].render(scale=PDF_RENDER_DPI / 72).to_pil()
+        finally:
+            pdf.close()
+
+    gs = shutil.which('gs')
+    if gs:
+        result = subprocess.run(
+            [gs, '-q', '-dSAFER', '-dBATCH', '-dNOPAUSE', '-sDEVICE=png16m', '-dFirstPage=1', '-dLastPage=1',
+             f'-r{PDF_RENDER_DPI}', '-sOutputFile=-', path],
+            capture_output=True, timeout=60, check=True
+        )
+        return Image.open(io.BytesIO(result.stdout))
+
+    if not _missing_renderer_logged:
+        _missing_renderer_logged = True
+        app.logger.warning("Miniaturas de PDF desativadas: instale o pacote pypdfium2 ou o Ghostscript (gs)")
+    return None
+
+def _make_thumbnail(image, preview_format):
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE))
+    if preview_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    if preview_format == 'jpeg':
+        image.save(output, 'JPEG', quality=80, optimize=True)
+    else:
+        image.save(output, 'PNG', optimize=True)
+    return output.getvalue()
+
+def render_preview(sha256):
+    """Gera a miniatura de um blob. Retorna (formato, bytes) ou None se o tipo não tem miniatura."""
+    backend = get_blob_backend()
+    with open_blob(sha256) as f:
+        file_type = _detect_type(f.read(8))
+    if file_type is None:
+        return None
+
+    path = backend.local_path(sha256)
+    tmp_path = None
+    if path is None or stored_encoding(backend.read_header(sha256)):
+        # Backend remoto ou objeto comprimido: extrai para um arquivo temporário
+        fd, tmp_path = tempfile.mkstemp(prefix='preview-')
+        with os.fdopen(fd, 'wb') as tmp, open_blob(sha256) as source:
+            shutil.copyfileobj(source, tmp)
+        path = tmp_path
+
+    try:
+        if file_type == 'pdf':
+            image = _render_pdf_first_page(path)
+            if image is None:
+                return None
+            return 'png', _make_thumbnail(image, 'png')
+
+        with Image.open(path) as image:
+            if file_type == 'jpeg':
+                # Decodifica o JPEG já reduzido (bem mais rápido para fotos grandes)
+                image.draft('RGB', (PREVIEW_SIZE * 2, PREVIEW_SIZE * 2))
+            return file_type, _make_thumbnail(image, file_type)
+    finally:
+        if tmp_path:
+            os.remove(tmp_path)
+
+def generate_pending_previews(limit=20):
+    """Gera as miniaturas pendentes (blobs com preview_status nulo). Retorna a quantidade processada."""
+    backend = get_blob_backend()
+    pending = Blob.query.filter(Blob.preview_status.is_(None), Blob.ref_count > 0) \
+        .order_by(Blob.created_at).limit(limit).all()
+    for blob in pending:
+        try:
+            result = render_preview(blob.sha256)
+            if result is None:
+                blob.preview_status = 'unavailable'
+            else:
+                preview_format, data = result
+                backend.put(preview_key(blob.sha256, preview_format), data)
+                blob.preview_format = preview_format
+                blob.preview_status = 'ready'
+        except Exception as e:
+            app.logger.warning(f"Falha ao gerar miniatura do blob {blob.sha256[:12]}: {e}")
+            blob.preview_status = 'failed'
+        db.session.commit()
+    return len(pending)
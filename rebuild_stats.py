@@ -0,0 +1,11 @@
+from app import app
+from stats import rebuild_request_stats
+
+def rebuild():
+    """Recalcula a tabela request_stats a partir dos pedidos existentes."""
+    with app.app_context():
+        groups = rebuild_request_stats()
+        print(f"Tabela request_stats recalculada: {groups} grupo(s).")
+
+if __name__ == "__main__":
+    rebuild()
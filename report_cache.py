@@ -0,0 +1,125 @@
+"""Cache em disco dos PDFs gerados, chaveado por tipo de relatório, filtros e versão dos dados.
+
+Um PDF só é gerado de novo quando os dados que ele mostra mudam: a chave inclui a versão
+dos dados (get_data_version para os relatórios gerais, get_request_version para o PDF de
+um pedido). Os arquivos ficam em REPORT_CACHE_PATH e o total é limitado a
+REPORT_CACHE_MAX_MB; ao passar do limite, os menos usados recentemente (mtime, atualizado
+a cada acerto) são removidos. Compartilhado entre processos: gravações atômicas e remoções
+tolerantes a concorrência.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from sqlalchemy import func
+from app import app, db
+from models import User, AcquisitionRequest, Attachment, StatusChange
+from blob_store import PUBLISHED_FILE_MODE
+
+class ReportArtifactCache:
+    """Arquivos de relatório em disco com despejo LRU por tamanho total"""
+
+    def __init__(self, root, max_bytes):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.pdf")
+
+    def get(self, key):
+        """Caminho do arquivo em cache (marcado como usado agora) ou None"""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, write):
+        """Gera o arquivo com write(caminho temporário), publica de forma atômica e aplica o limite
+        de tamanho; retorna o caminho. O relatório é gravado direto no disco, sem cópia em memória."""
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.chmod(tmp_path, PUBLISHED_FILE_MODE)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """Remove os arquivos menos usados até o total caber em max_bytes"""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.root):
+                if entry.name.endswith('.pdf'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.pdf'):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+report_cache = ReportArtifactCache(app.config['REPORT_CACHE_PATH'], app.config['REPORT_CACHE_MAX_MB'] * 1024 * 1024)
+
+def report_cache_key(report_type, params, version):
+    payload = json.dumps({'type': report_type, 'params': params, 'version': version}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+def get_users_version():
+    """Última alteração de usuário: os PDFs mostram nomes de criadores, responsáveis e autores"""
+    last_update = db.session.query(func.max(User.updated_at)).scalar()
+    return last_update.isoformat() if last_update else ''
+
+def get_request_version(request_id):
+    """Versão dos dados mostrados no PDF de um pedido (pedido, anexos, histórico de status e nomes)"""
+    updated_at = db.session.query(AcquisitionRequest.updated_at).filter(AcquisitionRequest.id == request_id).scalar()
+    attachments = db.session.query(func.count(Attachment.id), func.max(Attachment.id)) \
+        .filter(Attachment.request_id == request_id).one()
+    changes = db.session.query(func.count(StatusChange.id), func.max(StatusChange.id)) \
+        .filter(StatusChange.request_id == request_id).one()
+    return (f"{updated_at.isoformat() if updated_at else ''}:{attachments[0]}:{attachments[1]}:"
+            f"{changes[0]}:{changes[1]}:{get_users_version()}")
+
+def get_report_version():
+    """Versão dos dados do relatório geral: pedidos, usuários ativos (estatísticas) e nomes"""
+    from stats import get_data_version, get_user_counts
+    return f"{get_data_version()}:{get_user_counts()['active_users']}:{get_users_version()}"
+
+def cached_report(report_type, params, version, build):
+    """Caminho do PDF em cache para (tipo, filtros, versão); se não houver, gera com build(caminho)"""
+    key = report_cache_key(report_type, params, version)
+    path = report_cache.get(key)
+    if path is not None:
+        return path, True
+    started = time.monotonic()
+    path = report_cache.put(key, build)
+    app.logger.info(f"Relatório {report_type} gerado em {time.monotonic() - started:.2f}s (cache {key[:8]})")
+    return path, False
@@ -0,0 +1,256 @@
+"""Fila de relatórios pesados (PDF e Excel filtrados) gerados fora dos workers web.
+
+A rota grava um ReportJob com os filtros e redireciona para a página do job, que acompanha
+o progresso; o worker (python report_jobs.py, ver Procfile) reserva o job com um UPDATE
+condicional, gera o arquivo, grava no blob store e marca o job como concluído. O arquivo
+fica disponível por REPORT_RESULT_TTL_HOURS e depois é removido pelo scheduler.
+
+Uso:
+    python report_jobs.py                  # laço contínuo
+    python report_jobs.py --processes 3    # três processos consumindo a fila
+    python report_jobs.py --once           # processa os jobs pendentes e sai
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import secrets
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from werkzeug.datastructures import MultiDict
+from app import app, db
+from models import AcquisitionRequest, ReportJob
+from blob_store import get_blob_backend
+from request_filters import RequestFilter
+
+# Por quanto tempo o arquivo gerado fica disponível para download
+REPORT_RESULT_TTL = timedelta(hours=int(os.environ.get("REPORT_RESULT_TTL_HOURS", 24)))
+
+# Filtros com mais pedidos que isso viram job em segundo plano; os menores são gerados na hora
+REPORT_SYNC_MAX_ROWS = int(os.environ.get("REPORT_SYNC_MAX_ROWS", 500))
+
+# Limite próprio da planilha síncrona: o .xlsx só sai depois de todas as linhas gravadas (~1 ms
+# por linha), então não acompanha um REPORT_SYNC_MAX_ROWS maior
+EXCEL_SYNC_MAX_ROWS = min(REPORT_SYNC_MAX_ROWS, int(os.environ.get("EXCEL_SYNC_MAX_ROWS", 300)))
+
+# Intervalo entre consultas à fila quando não há jobs pendentes (segundos)
+REPORT_POLL_INTERVAL = int(os.environ.get("REPORT_POLL_INTERVAL", 2))
+
+# Job em 'running' há mais tempo que isso (worker interrompido) volta para a fila
+STALE_JOB_AFTER = timedelta(minutes=30)
+
+MAX_ATTEMPTS = 2
+
+# Tipo de relatório: (descrição, prefixo do nome do arquivo, extensão)
+REPORT_KINDS = {
+    'pdf_filtered': ('Relatório PDF', 'Relatorio_Filtrado', 'pdf'),
+    'excel_filtered': ('Planilha Excel', 'pedidos_filtrados', 'xlsx'),
+}
+
+def enqueue_report(user, kind, request_filter):
+    """Cria o job de relatório com os filtros informados (commit incluído)"""
+    if kind not in REPORT_KINDS:
+        raise ValueError(f"Tipo de relatório inválido: {kind}")
+    job = ReportJob(
+        id=secrets.token_hex(16),
+        user_id=user.id,
+        kind=kind,
+        params=json.dumps(request_filter.to_args()),
+        message='Aguardando na fila'
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def job_info(job):
+    """Estado do job para a página de acompanhamento (JSON)"""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'label': REPORT_KINDS[job.kind][0],
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'result_name': job.result_name,
+        'result_size': job.result_size,
+        'expires_at': job.expires_at.isoformat() if job.expires_at else None,
+    }
+
+def _set_progress(job_id, progress, message=None):
+    # Conexão própria: um commit na sessão expiraria os pedidos já carregados pelo gerador
+    values = {'progress': max(0, min(100, int(progress)))}
+    if message:
+        values['message'] = message
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(update(ReportJob.__table__).where(ReportJob.__table__.c.id == job_id).values(**values))
+    except Exception as e:
+        # Progresso é informativo: não interrompe o relatório (ex.: SQLite bloqueado pela leitura em andamento)
+        app.logger.warning(f"Não foi possível atualizar o progresso do relatório {job_id}: {e}")
+
+def _release_stale_jobs(now):
+    """Devolve à fila jobs presos em 'running' por um worker interrompido"""
+    ReportJob.query.filter(
+        ReportJob.status == 'running',
+        ReportJob.started_at < now - STALE_JOB_AFTER
+    ).update({'status': 'pending', 'message': 'Aguardando nova tentativa'}, synchronize_session=False)
+    db.session.commit()
+
+def _claim_next(now):
+    """Reserva o job pendente mais antigo; ignora os já reservados por outro worker"""
+    candidate_ids = [row[0] for row in db.session.query(ReportJob.id).filter(
+        ReportJob.status == 'pending'
+    ).order_by(ReportJob.created_at).limit(5).all()]
+    for job_id in candidate_ids:
+        updated = ReportJob.query.filter(
+            ReportJob.id == job_id,
+            ReportJob.status == 'pending'
+        ).update({'status': 'running', 'started_at': now, 'attempts': ReportJob.attempts + 1,
+                  'message': 'Iniciando'}, synchronize_session=False)
+        db.session.commit()
+        if updated:
+            return db.session.get(ReportJob, job_id)
+    return None
+
+def _write_pdf(job, request_filter, path):
+    from pdf_generator import generate_general_report
+    from request_queries import load_requests
+    from report_cache import cached_report, get_report_version
+
+    def build(output_path):
+        request_ids = request_filter.get_ids()
+        total = len(request_ids) or 1
+        requests = []
+        for start in range(0, len(request_ids), 500):
+            requests.extend(load_requests(request_ids[start:start + 500]))
+            _set_progress(job.id, 50 * len(requests) / total, f'Carregando pedidos ({len(requests)} de {len(request_ids)})')
+
+        _set_progress(job.id, 60, 'Montando o PDF')
+        generate_general_report(requests, output=output_path)
+
+    # Mesmo cache da rota síncrona: relatório idêntico já gerado é apenas copiado
+    cached_path, _ = cached_report('general', request_filter.to_args(), get_report_version(), build)
+    shutil.copyfile(cached_path, path)
+
+def _write_excel(job, request_filter, path):
+    from excel_generator import stream_requests_excel
+
+    total = request_filter.get_totals()['count'] or 1
+    query = request_filter.query().order_by(AcquisitionRequest.updated_at.desc(), AcquisitionRequest.id.desc())
+
+    def progress(written):
+        _set_progress(job.id, 90 * written / total, f'Gravando linhas ({written} de {total})')
+
+    with open(path, 'wb') as f:
+        for chunk in stream_requests_excel(query, progress=progress):
+            f.write(chunk)
+
+_WRITERS = {'pdf_filtered': _write_pdf, 'excel_filtered': _write_excel}
+
+def run_job(job):
+    """Gera o arquivo do job, grava no blob store e marca o job como concluído (ou com falha)"""
+    _, filename_prefix, extension = REPORT_KINDS[job.kind]
+    fd, tmp_path = tempfile.mkstemp(prefix='report-', suffix=f'.{extension}')
+    os.close(fd)
+    try:
+        request_filter = RequestFilter.from_args(MultiDict(json.loads(job.params or '{}')))
+        _WRITERS[job.kind](job, request_filter, tmp_path)
+        size = os.path.getsize(tmp_path)
+        key = f"{job.id}.report"
+        get_blob_backend().put_file(key, tmp_path)
+
+        finished_at = datetime.utcnow()
+        job.status = 'done'
+        job.progress = 100
+        job.message = 'Pronto para download'
+        job.result_key = key
+        job.result_name = f"{filename_prefix}_{finished_at.strftime('%Y%m%d_%H%M%S')}.{extension}"
+        job.result_size = size
+        job.finished_at = finished_at
+        job.expires_at = finished_at + REPORT_RESULT_TTL
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Erro ao gerar relatório {job.id} ({job.kind}): {e}")
+        job = db.session.get(ReportJob, job.id)
+        job.status = 'failed' if job.attempts >= MAX_ATTEMPTS else 'pending'
+        job.message = f'Erro ao gerar o relatório: {e}'[:300]
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return job
+
+def run_pending_jobs(limit=None):
+    """Processa jobs pendentes até esvaziar a fila (ou até `limit`). Retorna a quantidade processada."""
+    processed = 0
+    _release_stale_jobs(datetime.utcnow())
+    while limit is None or processed < limit:
+        job = _claim_next(datetime.utcnow())
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
+
+def purge_expired_reports():
+    """Remove arquivos e registros de jobs expirados (e de jobs com falha mais antigos que o TTL)"""
+    now = datetime.utcnow()
+    backend = get_blob_backend()
+    expired = ReportJob.query.filter(db.or_(
+        ReportJob.expires_at < now,
+        db.and_(ReportJob.status == 'failed', ReportJob.created_at < now - REPORT_RESULT_TTL)
+    )).all()
+    for job in expired:
+        if job.result_key:
+            backend.delete(job.result_key)
+        db.session.delete(job)
+    db.session.commit()
+    return len(expired)
+
+def run_worker(poll_interval=REPORT_POLL_INTERVAL):
+    """Laço de um processo do worker de relatórios"""
+    with app.app_context():
+        # Processo filho (--processes): não reaproveita conexões herdadas do processo pai
+        db.engine.dispose(close=False)
+    while True:
+        with app.app_context():
+            try:
+                processed = run_pending_jobs()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Erro no worker de relatórios: {e}")
+                processed = 0
+            db.session.remove()
+        if not processed:
+            time.sleep(poll_interval)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera os relatórios enfileirados (PDF/Excel)')
+    parser.add_argument('--once', action='store_true', help='processa os jobs pendentes e sai')
+    parser.add_argument('--processes', type=int, default=int(os.environ.get("REPORT_WORKER_PROCESSES", 1)),
+                        help='processos consumindo a fila em paralelo')
+    parser.add_argument('--poll-interval', type=int, default=REPORT_POLL_INTERVAL,
+                        help='segundos entre consultas à fila vazia')
+    args = parser.parse_args()
+
+    from app import init_database
+    with app.app_context():
+        init_database()
+
+    if args.once:
+        with app.app_context():
+            print(f"Relatórios gerados: {run_pending_jobs()}")
+    elif args.processes > 1:
+        workers = [multiprocessing.Process(target=run_worker, args=(args.poll_interval,), daemon=True)
+                   for _ in range(args.processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    else:
+        run_worker(args.poll_interval)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from app import app
+from models import AcquisitionRequest
+from search import apply_search
+from stats import get_filtered_totals, get_rollup_totals, get_data_version
+
+class FilterResultCache:
+    """Cache LRU em memória (por processo) de resultados de filtros, chaveado por filtro e versão dos dados"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+filter_cache = FilterResultCache(app.config['FILTER_CACHE_SIZE'])
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+class RequestFilter:
+    """Filtros da listagem de pedidos, compartilhados por dashboard e exportações PDF/Excel"""
+
+    def __init__(self, search='', status='', priority='', impact='', classe='', categoria='',
+                 responsible_id=0, date_from=None, date_to=None):
+        self.search = (search or '').strip()
+        self.status = status or ''
+        self.priority = priority or ''
+        self.impact = impact or ''
+        self.classe = classe or ''
+        self.categoria = categoria or ''
+        self.responsible_id = responsible_id if responsible_id and responsible_id > 0 else 0
+        self.date_from = date_from
+        self.date_to = date_to
+
+    @classmethod
+    def from_args(cls, args):
+        """Lê os parâmetros de URL usados pelo formulário de busca do dashboard"""
+        return cls(
+            search=args.get('search', ''),
+            status=args.get('status_filter', ''),
+            priority=args.get('priority_filter', ''),
+            impact=args.get('impact_filter', ''),
+            classe=args.get('classe_filter', ''),
+            categoria=args.get('categoria_filter', ''),
+            responsible_id=args.get('responsible_filter', 0, type=int),
+            date_from=_parse_date(args.get('date_from', '')),
+            date_to=_parse_date(args.get('date_to', ''))
+        )
+
+    def to_args(self):
+        """Parâmetros de URL equivalentes, para montar links de exportação e paginação"""
+        return {
+            'search': self.search,
+            'status_filter': self.status,
+            'priority_filter': self.priority,
+            'impact_filter': self.impact,
+            'classe_filter': self.classe,
+            'categoria_filter': self.categoria,
+            'responsible_filter': self.responsible_id,
+            'date_from': self.date_from.isoformat() if self.date_from else '',
+            'date_to': self.date_to.isoformat() if self.date_to else '',
+        }
+
+    @property
+    def cache_key(self):
+        """Hash estável dos filtros normalizados"""
+        payload = json.dumps(self.to_args(), sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+    @property
+    def uses_rollup(self):
+        """True se todos os filtros ativos são colunas da tabela consolidada request_stats"""
+        return not (self.search or self.impact or self.categoria or self.date_from or self.date_to)
+
+    def apply(self, query):
+        """Aplica os filtros a uma consulta de AcquisitionRequest"""
+        if self.search:
+            query = apply_search(query, self.search)
+        if self.status:
+            query = query.filter(AcquisitionRequest.status == self.status)
+        if self.priority:
+            query = query.filter(AcquisitionRequest.priority == self.priority)
+        if self.impact:
+            query = query.filter(AcquisitionRequest.impact == self.impact)
+        if self.classe:
+            query = query.filter(AcquisitionRequest.classe == self.classe)
+        if self.categoria:
+            query = query.filter(AcquisitionRequest.categoria == self.categoria)
+        if self.responsible_id:
+            query = query.filter(AcquisitionRequest.responsible_id == self.responsible_id)
+        if self.date_from:
+            query = query.filter(AcquisitionRequest.request_date >= self.date_from)
+        if self.date_to:
+            query = query.filter(AcquisitionRequest.request_date <= self.date_to)
+        return query
+
+    def query(self):
+        return self.apply(AcquisitionRequest.query)
+
+    def _cached(self, name, compute):
+        key = (self.cache_key, name, get_data_version())
+        value = filter_cache.get(key)
+        if value is None:
+            value = compute()
+            filter_cache.set(key, value)
+        return value
+
+    def get_totals(self):
+        """Quantidade e valores somados dos pedidos filtrados (em cache por versão dos dados)"""
+        def compute():
+            if self.uses_rollup:
+                return get_rollup_totals(status=self.status, classe=self.classe,
+                                         priority=self.priority, responsible_id=self.responsible_id)
+            return get_filtered_totals(self.query())
+        return self._cached('totals', compute)
+
+    def get_ids(self):
+        """Ids dos pedidos filtrados, do mais recente ao mais antigo (em cache por versão dos dados)"""
+        def compute():
+            rows = self.query().with_entities(AcquisitionRequest.id) \
+                .order_by(AcquisitionRequest.updated_at.desc(), AcquisitionRequest.id.desc()).all()
+            return [row[0] for row in rows]
+        return self._cached('ids', compute)
@@ -0,0 +1,86 @@
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from app import db
+from models import User, AcquisitionRequest, Attachment, StatusChange
+
+# Limite de ids por cláusula IN ao agrupar contagens
+_IN_CHUNK_SIZE = 500
+
+def with_people(query):
+    """Carrega criador e responsável junto com os pedidos (evita uma consulta por linha)"""
+    return query.options(
+        joinedload(AcquisitionRequest.creator),
+        joinedload(AcquisitionRequest.responsible)
+    )
+
+def recent_requests_query(user=None):
+    """Pedidos mais recentes, opcionalmente apenas os criados pelo usuário informado"""
+    query = with_people(AcquisitionRequest.query)
+    if user is not None:
+        query = query.filter(AcquisitionRequest.created_by_id == user.id)
+    return query.order_by(AcquisitionRequest.created_at.desc())
+
+def status_history_query(request_id):
+    """Histórico de status de um pedido, do mais recente ao mais antigo, com o autor de cada alteração"""
+    return StatusChange.query.options(joinedload(StatusChange.changed_by_user)) \
+        .filter(StatusChange.request_id == request_id) \
+        .order_by(StatusChange.change_date.desc())
+
+def recent_changes_query():
+    """Alterações de status mais recentes de todo o sistema"""
+    return StatusChange.query.options(joinedload(StatusChange.changed_by_user)) \
+        .order_by(StatusChange.change_date.desc())
+
+def attachments_query(request_id):
+    """Anexos de um pedido com o usuário que enviou cada um e o estado da miniatura (sem o conteúdo: file_content é adiado)"""
+    return Attachment.query.options(joinedload(Attachment.uploaded_by), joinedload(Attachment.blob)) \
+        .filter(Attachment.request_id == request_id) \
+        .order_by(Attachment.upload_date)
+
+def attachment_metadata(request_id):
+    """Lista de anexos de um pedido apenas com metadados (nome, tamanho, data, autor), como dicionários"""
+    rows = db.session.query(
+        Attachment.id, Attachment.original_filename, Attachment.file_size, Attachment.upload_date,
+        Attachment.blob_sha256, User.full_name
+    ).outerjoin(User, User.id == Attachment.uploaded_by_id) \
+        .filter(Attachment.request_id == request_id) \
+        .order_by(Attachment.upload_date).all()
+    return [
+        {
+            'id': attachment_id,
+            'filename': filename,
+            'size': size,
+            'uploaded_at': uploaded_at.isoformat() if uploaded_at else None,
+            'sha256': sha256,
+            'uploaded_by': uploaded_by,
+        }
+        for attachment_id, filename, size, uploaded_at, sha256, uploaded_by in rows
+    ]
+
+def load_requests(request_ids):
+    """Carrega os pedidos (com criador e responsável) na ordem dos ids informados"""
+    by_id = {}
+    request_ids = list(request_ids)
+    for start in range(0, len(request_ids), _IN_CHUNK_SIZE):
+        chunk = request_ids[start:start + _IN_CHUNK_SIZE]
+        for request_obj in with_people(AcquisitionRequest.query).filter(AcquisitionRequest.id.in_(chunk)).all():
+            by_id[request_obj.id] = request_obj
+    return [by_id[request_id] for request_id in request_ids if request_id in by_id]
+
+def iter_request_batches(request_ids, batch_size):
+    """Pedidos (com criador e responsável) na ordem dos ids, carregados em blocos de `batch_size`"""
+    request_ids = list(request_ids)
+    for start in range(0, len(request_ids), batch_size):
+        yield load_requests(request_ids[start:start + batch_size])
+
+def get_attachment_counts(request_ids):
+    """Retorna {request_id: quantidade de anexos} com uma consulta agrupada por bloco de ids"""
+    counts = {}
+    request_ids = list(request_ids)
+    for start in range(0, len(request_ids), _IN_CHUNK_SIZE):
+        chunk = request_ids[start:start + _IN_CHUNK_SIZE]
+        rows = db.session.query(Attachment.request_id, func.count(Attachment.id)) \
+            .filter(Attachment.request_id.in_(chunk)) \
+            .group_by(Attachment.request_id).all()
+        counts.update(rows)
+    return counts
@@ -1,311 +1,128 @@
 import os
-import secrets
 from datetime import datetime, date
-from flask import render_template, redirect, url_for, flash, request, send_from_directory, abort, Response, send_file
+from flask import render_template, redirect, url_for, flash, request, send_from_directory, abort, Response, send_file, jsonify, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from flask_wtf.csrf import validate_csrf
+from wtforms import ValidationError
 from sqlalchemy import or_, desc, func
 from app import app, db
-from models import User, AcquisitionRequest, Attachment, StatusChange
-import resend
-
-def send_notification_email(recipient_email, recipient_name, request_obj):
-    """Send detailed notification email using Resend"""
-    api_key = os.environ.get("RESEND_API_KEY")
-    from_email = os.environ.get("EMAIL_FROM")
-    
-    if not api_key or not from_email:
-        app.logger.error("RESEND_API_KEY or EMAIL_FROM not configured")
-        return False, "Configuração de e-mail ausente"
-        
-    try:
-        resend.api_key = api_key
-        
-        # Format specifications
-        specs = f"""
-        <ul>
-            <li><strong>ID:</strong> #{request_obj.id}</li>
-            <li><strong>Título:</strong> {request_obj.title}</li>
-            <li><strong>Status:</strong> {request_obj.get_status_display()}</li>
-            <li><strong>Prioridade:</strong> {request_obj.get_priority_display()}</li>
-            <li><strong>Impacto:</strong> {request_obj.get_impact_display()}</li>
-            <li><strong>Classe:</strong> {request_obj.get_classe_display()}</li>
-            <li><strong>Categoria:</strong> {request_obj.get_categoria_display()}</li>
-            <li><strong>Data do Pedido:</strong> {request_obj.request_date.strftime('%d/%m/%Y')}</li>
-            <li><strong>Valor Estimado:</strong> R$ {request_obj.estimated_value or 0:,.2f}</li>
-            <li><strong>Descrição:</strong> {request_obj.description}</li>
-        </ul>
-        """
-        
-        params = {
-            "from": from_email,
-            "to": [recipient_email],
-            "subject": f"Atualização de Pedido: {request_obj.title} (ID: #{request_obj.id})",
-            "html": f"""
-            <p>Olá <strong>{recipient_name}</strong>,</p>
-            <p>O seguinte pedido de aquisição foi atribuído ou atualizado para você:</p>
-            {specs}
-            <p>Por favor, acesse o sistema para mais detalhes.</p>
-            """,
-        }
-        r = resend.Emails.send(params)
-        return True, recipient_email
-    except Exception as e:
-        app.logger.error(f"Failed to send email: {e}")
-        return False, str(e)
-
-def send_deadline_alert_email(recipient_email, recipient_name, request_obj):
-    """Send deadline alert email using Resend"""
-    api_key = os.environ.get("RESEND_API_KEY")
-    from_email = os.environ.get("EMAIL_FROM")
-    
-    if not api_key or not from_email:
-        app.logger.error("RESEND_API_KEY or EMAIL_FROM not configured")
-        return False, "Configuração de e-mail ausente"
-        
-    try:
-        resend.api_key = api_key
-        
-        # Calculate days overdue
-        days_overdue = abs(request_obj.days_until_deadline) if request_obj.days_until_deadline else 0
-        
-        # Format deadline info
-        deadline_str = request_obj.delivery_deadline.strftime('%d/%m/%Y') if request_obj.delivery_deadline else 'Não definido'
-        
-        # Format specifications
-        specs = f"""
-        <ul>
-            <li><strong>ID:</strong> #{request_obj.id}</li>
-            <li><strong>Título:</strong> {request_obj.title}</li>
-            <li><strong>Status:</strong> {request_obj.get_status_display()}</li>
-            <li><strong>Prazo de Entrega:</strong> <span style="color: #dc3545; font-weight: bold;">{deadline_str}</span></li>
-            <li><strong>Dias de Atraso:</strong> <span style="color: #dc3545; font-weight: bold;">{days_overdue} dias</span></li>
-            <li><strong>Prioridade:</strong> {request_obj.get_priority_display()}</li>
-            <li><strong>Impacto:</strong> {request_obj.get_impact_display()}</li>
-            <li><strong>Descrição:</strong> {request_obj.description}</li>
-        </ul>
-        """
-        
-        params = {
-            "from": from_email,
-            "to": [recipient_email],
-            "subject": f"⚠️ ALERTA DE PRAZO VENCIDO: {request_obj.title} (ID: #{request_obj.id})",
-            "html": f"""
-            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-                <div style="background-color: #dc3545; color: white; padding: 20px; text-align: center;">
-                    <h2 style="margin: 0;">⚠️ Alerta de Prazo Vencido</h2>
-                </div>
-                <div style="padding: 20px; background-color: #f8f9fa;">
-                    <p>Olá <strong>{recipient_name}</strong>,</p>
-                    <p style="color: #dc3545; font-weight: bold;">O seguinte pedido de aquisição está com o prazo de entrega VENCIDO:</p>
-                    {specs}
-                    <p style="margin-top: 20px;">Por favor, acesse o sistema e tome as providências necessárias com urgência.</p>
-                </div>
-                <div style="background-color: #343a40; color: white; padding: 10px; text-align: center; font-size: 12px;">
-                    Sistema de Gestão de Aquisições - 121 - Escola Senai "Carlos Pasquale"
-                </div>
-            </div>
-            """,
-        }
-        r = resend.Emails.send(params)
-        return True, recipient_email
-    except Exception as e:
-        app.logger.error(f"Failed to send deadline alert email: {e}")
-        return False, str(e)
-
-def check_and_send_deadline_alerts():
-    """Check for overdue requests and send alerts if not already sent"""
-    try:
-        # Find all requests with overdue deadlines that haven't received alerts yet
-        overdue_requests = AcquisitionRequest.query.filter(
-            AcquisitionRequest.delivery_deadline.isnot(None),
-            AcquisitionRequest.delivery_deadline < date.today(),
-            AcquisitionRequest.deadline_alert_sent == False,
-            AcquisitionRequest.status.notin_(['recebido', 'finalizado', 'cancelado'])  # Only active requests
-        ).all()
-        
-        for request_obj in overdue_requests:
-            emails_sent = []
-            
-            # Send to responsible user
-            if request_obj.responsible_id:
-                responsible = db.session.get(User, request_obj.responsible_id)
-                if responsible and responsible.email:
-                    success, info = send_deadline_alert_email(responsible.email, responsible.full_name, request_obj)
-                    if success:
-                        emails_sent.append(f"responsável: {info}")
-            
-            # Send to creator
-            if request_obj.created_by_id:
-                creator = db.session.get(User, request_obj.created_by_id)
-                if creator and creator.email:
-                    # Don't send duplicate if creator is also responsible
-                    if not request_obj.responsible_id or request_obj.responsible_id != request_obj.created_by_id:
-                        success, info = send_deadline_alert_email(creator.email, creator.full_name, request_obj)
-                        if success:
-                            emails_sent.append(f"criador: {info}")
-            
-            # Mark alert as sent
-            if emails_sent:
-                request_obj.deadline_alert_sent = True
-                db.session.commit()
-                app.logger.info(f"Alerta de prazo enviado para pedido #{request_obj.id}: {', '.join(emails_sent)}")
-    
-    except Exception as e:
-        app.logger.error(f"Error checking deadline alerts: {e}")
+from models import User, AcquisitionRequest, Attachment, StatusChange, ReportJob
 
 from forms import LoginForm, AcquisitionRequestForm, EditRequestForm, UserForm, SearchForm, FirstPasswordForm, BulkImportForm
-from pdf_generator import generate_request_pdf, generate_general_report
-from excel_generator import generate_requests_excel, generate_request_excel
-from excel_template_generator import generate_import_template, process_import_file
+from pdf_generator import request_pdf_data, general_report_data
+from document_rendering import render_document, RenderBusy, RenderTimeout
+from excel_generator import stream_requests_excel, generate_request_excel
+from row_exports import stream_csv, stream_ndjson
+from report_jobs import enqueue_report, job_info, REPORT_SYNC_MAX_ROWS, EXCEL_SYNC_MAX_ROWS
+from report_cache import cached_report, get_request_version, get_report_version
+from excel_template_generator import generate_import_template, read_import_file
+from bulk_import import import_requests
+from pagination import KeysetPagination
+from request_queries import with_people, recent_requests_query, recent_changes_query, status_history_query, attachments_query, attachment_metadata, load_requests
+from request_filters import RequestFilter
+from db_indexes import get_index_usage, get_missing_indexes, explain_probe_queries
+from search import get_snippets, search_requests
+from stats import get_request_stats, get_user_counts
+from scheduler import get_last_runs, DEADLINE_ALERT_INTERVAL
+from email_outbox import queue_request_notification, get_outbox_counts
+from blob_store import send_blob, guess_mimetype
+from previews import preview_key
+from attachment_zip import attachment_entries, stream_zip
+from attachment_uploads import save_upload, UploadError
+from upload_sessions import (create_session, get_session, session_info, write_chunk, complete_session,
+                             take_completed_uploads, discard_session)
 from flask import Response
 
-def allowed_file(filename):
-    ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'xls', 'xlsx', 'png', 'jpg', 'jpeg'}
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def save_file(file):
-    """Save uploaded file and return filename and content"""
-    if not (file and file.filename and allowed_file(file.filename)):
-        return None, None, None, None
-        
-    try:
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{name}_{secrets.token_hex(8)}{ext}"
-        
-        file.seek(0)
-        file_content = file.read()
-        file_size = len(file_content)
-        
-        if file_size == 0:
-            return None, None, None, None
-            
-        # Optional: save to disk
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        with open(file_path, 'wb') as f:
-            f.write(file_content)
-            
-        return unique_filename, filename, file_size, file_content
-    except Exception as e:
-        app.logger.error(f"Erro no save_file: {e}")
-        return None, None, None, None
+def attach_uploaded_files(request_obj, files, upload_ids=()):
+    """Grava os arquivos enviados pelo pipeline de upload e adiciona os anexos à sessão.
+
+    `upload_ids` são sessões de upload em blocos já concluídas pelo navegador (API /uploads).
+    Retorna (nomes anexados, [(nome, motivo)] dos arquivos recusados).
+    """
+    uploaded = []
+    completed, rejected = take_completed_uploads(upload_ids, current_user)
+    for saved in completed:
+        db.session.add(Attachment(
+            request_id=request_obj.id,
+            uploaded_by_id=current_user.id,
+            **saved
+        ))
+        uploaded.append(saved['original_filename'])
+    for file in files or []:
+        if not file or not file.filename:
+            continue
+        try:
+            saved = save_upload(file)
+        except UploadError as e:
+            rejected.append((file.filename, str(e)))
+            continue
+        except Exception as e:
+            app.logger.error(f"Erro no upload de {file.filename}: {e}")
+            rejected.append((file.filename, 'erro ao gravar o arquivo'))
+            continue
+        db.session.add(Attachment(
+            request_id=request_obj.id,
+            uploaded_by_id=current_user.id,
+            **saved
+        ))
+        uploaded.append(saved['original_filename'])
+    return uploaded, rejected
 
+def flash_rejected_uploads(rejected):
+    for filename, reason in rejected:
+        flash(f'Arquivo "{filename}" não anexado: {reason}.', 'warning')
 
 @app.route('/')
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Check for overdue deadlines and send alerts
-    check_and_send_deadline_alerts()
-    
     # Get filter parameters
     search_form = SearchForm()
-    search = request.args.get('search', '')
-    status_filter = request.args.get('status_filter', '')
-    priority_filter = request.args.get('priority_filter', '')
-    impact_filter = request.args.get('impact_filter', '')
-    classe_filter = request.args.get('classe_filter', '')
-    categoria_filter = request.args.get('categoria_filter', '')
-    responsible_filter = request.args.get('responsible_filter', 0, type=int)
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    
-    # Build query
-    query = AcquisitionRequest.query
-    
-    if search:
-        query = query.filter(or_(
-            AcquisitionRequest.title.contains(search),
-            AcquisitionRequest.description.contains(search)
-        ))
-    
-    if status_filter:
-        query = query.filter(AcquisitionRequest.status == status_filter)
-
-
-    if priority_filter:
-        query = query.filter(AcquisitionRequest.priority == priority_filter)
-
-    if impact_filter:
-        query = query.filter(AcquisitionRequest.impact == impact_filter)
-        
-    if classe_filter:
-        query = query.filter(AcquisitionRequest.classe == classe_filter)
-        
-    if categoria_filter:
-        query = query.filter(AcquisitionRequest.categoria == categoria_filter)
-    
-    if responsible_filter > 0:
-        query = query.filter(AcquisitionRequest.responsible_id == responsible_filter)
+    request_filter = RequestFilter.from_args(request.args)
+    query = request_filter.query()
     
-    # Date range filtering
-    if date_from:
-        try:
-            from_date = datetime.strptime(date_from, '%Y-%m-%d').date()
-            query = query.filter(AcquisitionRequest.request_date >= from_date)
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            to_date = datetime.strptime(date_to, '%Y-%m-%d').date()
-            query = query.filter(AcquisitionRequest.request_date <= to_date)
-        except ValueError:
-            pass
+    # Calculate totals from all filtered requests (not just current page)
+    filtered_totals = request_filter.get_totals()
+    # Filtros pequenos: ids calculados agora ficam em cache para os botões de exportação e PDF
+    if filtered_totals['count'] <= REPORT_SYNC_MAX_ROWS:
+        request_filter.get_ids()
     
-    # Get pagination parameters
-    page = request.args.get('page', 1, type=int)
     per_page = 10  # 10 items per page as requested
     
-    # Order by most recent and paginate
-    requests_pagination = query.order_by(desc(AcquisitionRequest.updated_at)).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    if 'page' in request.args:
+        # Paginação numerada (OFFSET), mantida para links antigos
+        page = request.args.get('page', 1, type=int)
+        requests_pagination = with_people(query).order_by(desc(AcquisitionRequest.updated_at)).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+    else:
+        # Paginação por cursor em (updated_at, id), com custo constante em qualquer página
+        requests_pagination = KeysetPagination(
+            with_people(query), AcquisitionRequest.updated_at, AcquisitionRequest.id,
+            cursor=request.args.get('cursor'), per_page=per_page,
+            total=filtered_totals['count']
+        )
     requests = requests_pagination.items
     
     # Get statistics for dashboard
-    total_requests = AcquisitionRequest.query.count()
-    status_counts = {}
-    for status_code, status_name in AcquisitionRequest.STATUS_CHOICES:
-        count = AcquisitionRequest.query.filter_by(status=status_code).count()
-        status_counts[status_name] = count
-    
-    # Get counts and values per class
-    classe_stats = {}
-    for classe_code, classe_name in AcquisitionRequest.CLASSE_CHOICES:
-        requests_in_classe = AcquisitionRequest.query.filter_by(classe=classe_code).all()
-        count = len(requests_in_classe)
-        total_value = sum([req.estimated_value or 0 for req in requests_in_classe])
-        classe_stats[classe_name] = {
-            'count': count,
-            'total_value': total_value
-        }
+    stats = get_request_stats()
     
     # Set form defaults from URL parameters
-    search_form.search.data = search
-    search_form.status_filter.data = status_filter
-    search_form.priority_filter.data = priority_filter
-    search_form.impact_filter.data = impact_filter
-    search_form.classe_filter.data = classe_filter
-    search_form.categoria_filter.data = categoria_filter
-    search_form.responsible_filter.data = responsible_filter
-    if date_from:
-        try:
-            search_form.date_from.data = datetime.strptime(date_from, '%Y-%m-%d').date()
-        except ValueError:
-            pass
-    if date_to:
-        try:
-            search_form.date_to.data = datetime.strptime(date_to, '%Y-%m-%d').date()
-        except ValueError:
-            pass
-    
-    # Calculate totals from all filtered requests (not just current page)
-    all_filtered_requests = query.all()  # Get all requests matching the filters
-    total_estimated = sum([req.estimated_value or 0 for req in all_filtered_requests])
-    total_final = sum([req.final_value or 0 for req in all_filtered_requests])
+    search_form.search.data = request_filter.search
+    search_form.status_filter.data = request_filter.status
+    search_form.priority_filter.data = request_filter.priority
+    search_form.impact_filter.data = request_filter.impact
+    search_form.classe_filter.data = request_filter.classe
+    search_form.categoria_filter.data = request_filter.categoria
+    search_form.responsible_filter.data = request_filter.responsible_id
+    search_form.date_from.data = request_filter.date_from
+    search_form.date_to.data = request_filter.date_to
+    
+    # Trechos destacados e resultados mais relevantes da busca textual
+    search = request_filter.search
+    search_snippets = get_snippets([req.id for req in requests], search) if search else {}
+    top_search_results = search_requests(search, limit=5, query=query) if search else []
     
     # Separate into in-progress and completed
     in_progress_requests = [req for req in requests if req.is_in_progress()]
@@ -317,44 +134,25 @@ def dashboard():
                          completed_requests=completed_requests,
                          pagination=requests_pagination,
                          search_form=search_form,
-                         total_requests=total_requests,
-                         status_counts=status_counts,
-                         classe_stats=classe_stats,
-                         total_estimated=total_estimated,
-                         total_final=total_final,
-                         current_search=search,
-                         current_status_filter=status_filter,
-                         current_priority_filter=priority_filter,
-                         current_impact_filter=impact_filter,
-                         current_classe_filter=classe_filter,
-                         current_categoria_filter=categoria_filter,
-                         current_responsible_filter=responsible_filter,
-                         current_date_from=date_from,
-                         current_date_to=date_to)
+                         search_snippets=search_snippets,
+                         top_search_results=top_search_results,
+                         total_requests=stats['total_requests'],
+                         status_counts=stats['status_counts'],
+                         classe_stats=stats['classe_stats'],
+                         total_estimated=filtered_totals['total_estimated'],
+                         total_final=filtered_totals['total_final'],
+                         filter_args=request_filter.to_args(),
+                         current_search=search)
 
 @app.route('/analytics')
 @login_required
 def analytics():
-    # Basic stats
-    total_requests = AcquisitionRequest.query.count()
-    
-    # Status distribution
-    status_data = {}
-    for status_code, status_name in AcquisitionRequest.STATUS_CHOICES:
-        count = AcquisitionRequest.query.filter_by(status=status_code).count()
-        status_data[status_name] = count
-        
-    # Class distribution (Values)
-    class_values = {}
-    for class_code, class_name in AcquisitionRequest.CLASSE_CHOICES:
-        total = db.session.query(func.sum(AcquisitionRequest.estimated_value)).filter_by(classe=class_code).scalar() or 0
-        class_values[class_name] = float(total)
-        
-    # Priority distribution
-    priority_data = {}
-    for prio_code, prio_name in AcquisitionRequest.PRIORITY_CHOICES:
-        count = AcquisitionRequest.query.filter_by(priority=prio_code).count()
-        priority_data[prio_name] = count
+    # Status, class and priority distribution in a single grouped query
+    stats = get_request_stats()
+    total_requests = stats['total_requests']
+    status_data = stats['status_counts']
+    class_values = {name: float(data['total_value']) for name, data in stats['classe_stats'].items()}
+    priority_data = stats['priority_counts']
 
     # Requests over time (last 30 days)
     from datetime import timedelta
@@ -478,42 +276,21 @@ def new_request():
         db.session.add(status_change)
         
         # Handle file uploads
-        uploaded_files = []
-        try:
-            attachment_files = request.files.getlist('attachments')
-            for file in attachment_files:
-                if file and file.filename:
-                    unique_filename, original_filename, file_size, file_content = save_file(file)
-                    if unique_filename and file_content:
-                        attachment = Attachment(
-                            filename=unique_filename,
-                            original_filename=original_filename,
-                            file_size=file_size,
-                            file_content=file_content,
-                            request_id=request_obj.id,
-                            uploaded_by_id=current_user.id
-                        )
-                        db.session.add(attachment)
-                        uploaded_files.append(original_filename)
-        except Exception as e:
-            app.logger.error(f"Erro no upload (novo): {e}")
+        uploaded_files, rejected_files = attach_uploaded_files(request_obj, request.files.getlist('attachments'),
+                                                              request.form.getlist('upload_ids'))
+        
+        # E-mail automático: gravado na fila junto com o pedido e enviado pelo worker
+        notified_email = queue_request_notification(request_obj)
         
         db.session.commit()
         
         flash_message = f'Pedido de aquisição "{request_obj.title}" criado com sucesso!'
-        
-        # Envio de e-mail automático após criação do pedido
-        if request_obj.responsible_id:
-            responsible_user = db.session.get(User, request_obj.responsible_id)
-            if responsible_user and responsible_user.email:
-                success, info = send_notification_email(responsible_user.email, responsible_user.full_name, request_obj)
-                if success:
-                    flash_message += f' E-mail de notificação enviado para: {info}'
-                else:
-                    flash_message += f' (Falha ao enviar e-mail: {info})'
+        if notified_email:
+            flash_message += f' E-mail de notificação para {notified_email} adicionado à fila de envio.'
         if uploaded_files:
             flash_message += f' Arquivos anexados: {", ".join(uploaded_files)}'
         flash(flash_message, 'success')
+        flash_rejected_uploads(rejected_files)
         return redirect(url_for('view_request', id=request_obj.id))
     
     return render_template('request_form.html', form=form, request_obj=None, title='Novo Pedido de Aquisição')
@@ -522,8 +299,20 @@ def new_request():
 @login_required
 def view_request(id):
     request_obj = AcquisitionRequest.query.get_or_404(id)
-    status_history = StatusChange.query.filter_by(request_id=id).order_by(desc(StatusChange.change_date)).all()
-    return render_template('request_detail.html', request_obj=request_obj, status_history=status_history)
+    status_history = status_history_query(id).all()
+    attachments = attachments_query(id).all()
+    return render_template('request_detail.html', request_obj=request_obj, status_history=status_history,
+                         attachments=attachments)
+
+@app.route('/request/<int:id>/attachments')
+@login_required
+def list_attachments(id):
+    """Metadados dos anexos de um pedido em JSON (sem carregar o conteúdo dos arquivos)"""
+    AcquisitionRequest.query.get_or_404(id)
+    attachments = attachment_metadata(id)
+    for attachment in attachments:
+        attachment['download_url'] = url_for('download_attachment', id=attachment['id'])
+    return jsonify(attachments)
 
 @app.route('/request/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -572,59 +361,23 @@ def edit_request(id):
             db.session.add(status_change)
         
         # Handle attachments
-        try:
-            # Get the list of files from the form field
-            attachment_files = form.attachments.data
-            
-            if attachment_files:
-                for file in attachment_files:
-                    # Check if file has a filename and is not empty
-                    if not file or not file.filename or file.filename == '':
-                        continue
-                    
-                    # Verificação de tamanho
-                    file.seek(0, os.SEEK_END)
-                    size = file.tell()
-                    file.seek(0)
-                    
-                    if size == 0:
-                        continue
-                    
-                    filename = secure_filename(file.filename)
-                    name, ext = os.path.splitext(filename)
-                    unique_filename = f"{name}_{secrets.token_hex(8)}{ext}"
-                    
-                    file_content = file.read()
-                    
-                    attachment = Attachment(
-                        filename=unique_filename,
-                        original_filename=filename,
-                        file_size=size,
-                        file_content=file_content,
-                        request_id=request_obj.id,
-                        uploaded_by_id=current_user.id
-                    )
-                    db.session.add(attachment)
-                    app.logger.info(f"Novo anexo adicionado: {filename}")
-        except Exception as e:
-            app.logger.error(f"Erro nos anexos: {e}")
+        uploaded_files, rejected_files = attach_uploaded_files(request_obj, form.attachments.data,
+                                                              request.form.getlist('upload_ids'))
+        for filename in uploaded_files:
+            app.logger.info(f"Novo anexo adicionado: {filename}")
         
         try:
+            # E-mail automático: gravado na fila junto com a alteração e enviado pelo worker
+            notified_email = queue_request_notification(request_obj)
+            
             db.session.commit()
             
             flash_message = f'Pedido "{request_obj.title}" atualizado!'
-            
-            # Envio de e-mail automático após edição do pedido
-            if request_obj.responsible_id:
-                responsible_user = db.session.get(User, request_obj.responsible_id)
-                if responsible_user and responsible_user.email:
-                    success, info = send_notification_email(responsible_user.email, responsible_user.full_name, request_obj)
-                    if success:
-                        flash_message += f' E-mail de notificação enviado para: {info}'
-                    else:
-                        flash_message += f' (Falha ao enviar e-mail: {info})'
+            if notified_email:
+                flash_message += f' E-mail de notificação para {notified_email} adicionado à fila de envio.'
             
             flash(flash_message, 'success')
+            flash_rejected_uploads(rejected_files)
             return redirect(url_for('view_request', id=id))
         except Exception as e:
             db.session.rollback()
@@ -658,25 +411,134 @@ def edit_request(id):
             
     return render_template('request_form.html', form=form, request_obj=request_obj, title='Editar Pedido')
 
+# Miniaturas nunca mudam para um mesmo anexo (derivadas do hash do conteúdo)
+PREVIEW_CACHE_MAX_AGE = 365 * 24 * 3600
+
+def _validate_api_csrf():
+    """API JSON de uploads: o token CSRF vem no cabeçalho X-CSRFToken"""
+    if app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except ValidationError:
+            abort(400, 'Token CSRF inválido')
+
+def _get_upload_or_404(upload_id):
+    upload = get_session(upload_id, current_user)
+    if upload is None:
+        abort(404)
+    return upload
+
+@app.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    """Abre uma sessão de upload em blocos: {"filename", "size"}"""
+    _validate_api_csrf()
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = create_session(current_user, data.get('filename'), int(data.get('size') or 0))
+    except (UploadError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(session_info(upload)), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    """Estado da sessão e blocos já recebidos (para retomar o envio)"""
+    return jsonify(session_info(_get_upload_or_404(upload_id)))
+
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id, index):
+    _validate_api_csrf()
+    upload = _get_upload_or_404(upload_id)
+    try:
+        write_chunk(upload, index, request.stream)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'index': index}), 200
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    _validate_api_csrf()
+    upload = _get_upload_or_404(upload_id)
+    try:
+        complete_session(upload)
+    except UploadError as e:
+        return jsonify({'error': str(e), **session_info(upload)}), 400
+    return jsonify(session_info(upload))
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    _validate_api_csrf()
+    upload = _get_upload_or_404(upload_id)
+    if upload.status != 'attached':
+        discard_session(upload)
+    return '', 204
+
 @app.route('/attachment/<int:id>/download')
 @login_required
 def download_attachment(id):
     attachment = Attachment.query.get_or_404(id)
+    if attachment.blob_sha256:
+        return send_blob(attachment.blob_sha256, attachment.original_filename)
+    
     if not attachment.file_content:
         # Fallback to filesystem
         try:
-            return send_from_directory(app.config['UPLOAD_FOLDER'], attachment.filename)
+            return send_from_directory(app.config['UPLOAD_FOLDER'], attachment.filename,
+                                       as_attachment=True, download_name=attachment.original_filename)
         except:
             abort(404)
     
     import io
     return send_file(
         io.BytesIO(attachment.file_content),
-        mimetype='application/octet-stream',
+        mimetype=guess_mimetype(attachment.original_filename),
         as_attachment=True,
         download_name=attachment.original_filename
     )
 
+def _zip_response(entries, filename):
+    response = Response(stream_with_context(stream_zip(entries)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@app.route('/request/<int:id>/attachments.zip')
+@login_required
+def download_request_attachments(id):
+    """Todos os anexos do pedido em um ZIP gerado durante o envio"""
+    request_obj = AcquisitionRequest.query.get_or_404(id)
+    entries = attachment_entries([request_obj.id])
+    if not entries:
+        flash('Este pedido não possui anexos.', 'info')
+        return redirect(url_for('view_request', id=id))
+    return _zip_response(entries, f"anexos_pedido_{id}.zip")
+
+@app.route('/attachments/filtered.zip')
+@login_required
+def download_filtered_attachments():
+    """Anexos de todos os pedidos que atendem aos filtros do dashboard, uma pasta por pedido"""
+    request_filter = RequestFilter.from_args(request.args)
+    entries = attachment_entries(request_filter.get_ids())
+    if not entries:
+        flash('Nenhum anexo encontrado para os filtros selecionados.', 'info')
+        return redirect(url_for('dashboard', **request_filter.to_args()))
+    return _zip_response(entries, f"anexos_filtrados_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
+
+@app.route('/attachment/<int:id>/preview')
+@login_required
+def attachment_preview(id):
+    """Miniatura do anexo (gerada em segundo plano pelo scheduler)"""
+    attachment = Attachment.query.get_or_404(id)
+    if not attachment.has_preview:
+        abort(404)
+    preview_format = attachment.blob.preview_format
+    name, _ = os.path.splitext(attachment.original_filename)
+    return send_blob(preview_key(attachment.blob_sha256, preview_format), f"{name}.{preview_format}",
+                     as_attachment=False, cache_max_age=PREVIEW_CACHE_MAX_AGE)
+
 @app.route('/attachment/<int:id>/delete', methods=['POST'])
 @login_required
 def delete_attachment(id):
@@ -689,7 +551,7 @@ def delete_attachment(id):
         return redirect(url_for('edit_request', id=request_obj.id))
     
     try:
-        # Delete from disk if exists
+        # Delete legacy copy from disk if exists (blob store content is released by reference count)
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], attachment.filename)
         if os.path.exists(file_path):
             os.remove(file_path)
@@ -709,19 +571,37 @@ def delete_attachment(id):
 def admin_panel():
     
     # Get statistics
-    total_users = User.query.count()
-    active_users = User.query.filter_by(is_active=True).count()
-    total_requests = AcquisitionRequest.query.count()
+    user_counts = get_user_counts()
+    total_requests = get_request_stats()['total_requests']
     
-    recent_requests = AcquisitionRequest.query.order_by(desc(AcquisitionRequest.created_at)).limit(5).all()
-    recent_changes = StatusChange.query.order_by(desc(StatusChange.change_date)).limit(10).all()
+    recent_requests = recent_requests_query().limit(5).all()
+    recent_changes = recent_changes_query().limit(10).all()
+    deadline_runs = get_last_runs(limit=5)
+    outbox_counts = get_outbox_counts()
     
     return render_template('admin_panel.html',
-                         total_users=total_users,
-                         active_users=active_users,
+                         total_users=user_counts['total_users'],
+                         active_users=user_counts['active_users'],
                          total_requests=total_requests,
                          recent_requests=recent_requests,
-                         recent_changes=recent_changes)
+                         recent_changes=recent_changes,
+                         deadline_runs=deadline_runs,
+                         deadline_interval_minutes=DEADLINE_ALERT_INTERVAL // 60,
+                         outbox_counts=outbox_counts)
+
+@app.route('/admin/indexes')
+@login_required
+def index_report():
+    """Relatório de uso dos índices e planos de execução das listagens"""
+    if not current_user.is_admin:
+        flash('Acesso negado.', 'danger')
+        return redirect(url_for('dashboard'))
+    
+    return render_template('index_report.html',
+                         usage=get_index_usage(),
+                         missing_indexes=get_missing_indexes(),
+                         probes=explain_probe_queries(),
+                         dialect=db.engine.dialect.name)
 
 @app.route('/admin/users')
 @login_required
@@ -824,15 +704,20 @@ def generate_request_pdf_route(id):
     """Gera PDF de um pedido específico"""
     try:
         request_obj = AcquisitionRequest.query.get_or_404(id)
-        pdf_buffer = generate_request_pdf(request_obj)
+        # Regenerated only when the request, its attachments or its status history change
+        # The PDF itself is built in the rendering process pool from plain dicts
+        pdf_path, _ = cached_report('request', {'id': request_obj.id}, get_request_version(request_obj.id),
+                                    lambda path: render_document('request_pdf', request_pdf_data(request_obj), path))
         
         filename = f"Pedido_{request_obj.id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
         
-        return Response(
-            pdf_buffer.getvalue(),
-            mimetype='application/pdf',
-            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
-        )
+        return send_file(pdf_path, mimetype='application/pdf', as_attachment=True, download_name=filename)
+    except RenderBusy:
+        flash('Muitos documentos sendo gerados no momento. Tente novamente em instantes.', 'warning')
+        return redirect(url_for('view_request', id=id))
+    except RenderTimeout:
+        flash('A geração do PDF demorou mais que o esperado. Tente novamente em instantes.', 'warning')
+        return redirect(url_for('view_request', id=id))
     except Exception as e:
         app.logger.error(f"Erro ao gerar PDF do pedido {id}: {e}")
         flash('Erro ao gerar PDF. Tente novamente.', 'danger')
@@ -843,65 +728,58 @@ def generate_request_pdf_route(id):
 def generate_filtered_pdf():
     """Gera relatório filtrado em PDF"""
     try:
-        # Get the same filter parameters as dashboard
-        search = request.args.get('search', '')
-        status_filter = request.args.get('status_filter', '')
-        classe_filter = request.args.get('classe_filter', '')
-        categoria_filter = request.args.get('categoria_filter', '')
-        responsible_filter = request.args.get('responsible_filter', 0, type=int)
-        date_from = request.args.get('date_from', '')
-        date_to = request.args.get('date_to', '')
-        
-        # Apply same filters as dashboard
-        query = AcquisitionRequest.query
-        
-        if search:
-            query = query.filter(or_(
-                AcquisitionRequest.title.contains(search),
-                AcquisitionRequest.description.contains(search)
-            ))
-        
-        if status_filter:
-            query = query.filter(AcquisitionRequest.status == status_filter)
-            
-        if classe_filter:
-            query = query.filter(AcquisitionRequest.classe == classe_filter)
-            
-        if categoria_filter:
-            query = query.filter(AcquisitionRequest.categoria == categoria_filter)
-        
-        if responsible_filter > 0:
-            query = query.filter(AcquisitionRequest.responsible_id == responsible_filter)
-        
-        if date_from:
-            try:
-                from_date = datetime.strptime(date_from, '%Y-%m-%d').date()
-                query = query.filter(AcquisitionRequest.request_date >= from_date)
-            except ValueError:
-                pass
-        
-        if date_to:
-            try:
-                to_date = datetime.strptime(date_to, '%Y-%m-%d').date()
-                query = query.filter(AcquisitionRequest.request_date <= to_date)
-            except ValueError:
-                pass
-        
-        filtered_requests = query.order_by(desc(AcquisitionRequest.updated_at)).all()
-        pdf_buffer = generate_general_report(filtered_requests)
+        # Same filters as dashboard; matching ids are cached per filter and data version
+        request_filter = RequestFilter.from_args(request.args)
+        if request_filter.get_totals()['count'] > REPORT_SYNC_MAX_ROWS:
+            return _enqueue_report_redirect('pdf_filtered', request_filter)
+        pdf_path, _ = cached_report('general', request_filter.to_args(), get_report_version(),
+                                    lambda path: render_document('general_report',
+                                                                 general_report_data(load_requests(request_filter.get_ids())), path))
         
         filename = f"Relatorio_Filtrado_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
         
-        return Response(
-            pdf_buffer.getvalue(),
-            mimetype='application/pdf',
-            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
-        )
+        return send_file(pdf_path, mimetype='application/pdf', as_attachment=True, download_name=filename)
+    except (RenderBusy, RenderTimeout):
+        # Pool ocupado ou relatório pesado demais para a requisição: segue pela fila de relatórios
+        return _enqueue_report_redirect('pdf_filtered', request_filter)
     except Exception as e:
         app.logger.error(f"Erro ao gerar relatório filtrado: {e}")
         flash('Erro ao gerar relatório. Tente novamente.', 'danger')
         return redirect(url_for('dashboard'))
 
+def _enqueue_report_redirect(kind, request_filter):
+    """Relatórios grandes são gerados pelo worker de relatórios; o usuário acompanha na página do job"""
+    job = enqueue_report(current_user, kind, request_filter)
+    flash('O relatório é grande e está sendo gerado em segundo plano. O link de download aparecerá aqui.', 'info')
+    return redirect(url_for('report_job_status', id=job.id))
+
+def _get_report_job_or_404(id):
+    job = db.session.get(ReportJob, id)
+    if job is None or (job.user_id != current_user.id and not current_user.is_admin):
+        abort(404)
+    return job
+
+@app.route('/reports/jobs/<id>')
+@login_required
+def report_job_status(id):
+    """Página de acompanhamento de um relatório em segundo plano"""
+    job = _get_report_job_or_404(id)
+    return render_template('report_job.html', job=job, job_info=job_info(job))
+
+@app.route('/reports/jobs/<id>.json')
+@login_required
+def report_job_json(id):
+    return jsonify(job_info(_get_report_job_or_404(id)))
+
+@app.route('/reports/jobs/<id>/download')
+@login_required
+def download_report_job(id):
+    job = _get_report_job_or_404(id)
+    if job.status != 'done' or not job.result_key or (job.expires_at and job.expires_at < datetime.utcnow()):
+        flash('Este relatório não está disponível para download.', 'warning')
+        return redirect(url_for('report_job_status', id=id))
+    return send_blob(job.result_key, job.result_name)
+
 @app.route('/request/<int:id>/delete', methods=['POST'])
 @login_required
 def delete_request(id):
@@ -910,7 +788,7 @@ def delete_request(id):
     request_obj = AcquisitionRequest.query.get_or_404(id)
     
     try:
-        # Excluir arquivos anexos do sistema de arquivos
+        # Excluir cópias legadas dos anexos em uploads/ (o conteúdo no blob store é liberado pela contagem de referências)
         for attachment in request_obj.attachments:
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], attachment.filename)
             if os.path.exists(file_path):
@@ -942,64 +820,40 @@ def internal_error(error):
 @login_required
 def export_excel_filtered():
     """Export filtered requests to Excel"""
-    # Get the same filter parameters as dashboard
-    search = request.args.get('search', '')
-    status_filter = request.args.get('status_filter', '')
-    classe_filter = request.args.get('classe_filter', '')
-    categoria_filter = request.args.get('categoria_filter', '')
-    responsible_filter = request.args.get('responsible_filter', 0, type=int)
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    
-    # Apply same filters as dashboard
-    query = AcquisitionRequest.query
-    
-    if search:
-        query = query.filter(or_(
-            AcquisitionRequest.title.contains(search),
-            AcquisitionRequest.description.contains(search)
-        ))
-    
-    if status_filter:
-        query = query.filter(AcquisitionRequest.status == status_filter)
-        
-    if classe_filter:
-        query = query.filter(AcquisitionRequest.classe == classe_filter)
-        
-    if categoria_filter:
-        query = query.filter(AcquisitionRequest.categoria == categoria_filter)
-    
-    if responsible_filter > 0:
-        query = query.filter(AcquisitionRequest.responsible_id == responsible_filter)
-    
-    if date_from:
-        try:
-            from_date = datetime.strptime(date_from, '%Y-%m-%d').date()
-            query = query.filter(AcquisitionRequest.request_date >= from_date)
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            to_date = datetime.strptime(date_to, '%Y-%m-%d').date()
-            query = query.filter(AcquisitionRequest.request_date <= to_date)
-        except ValueError:
-            pass
-    
-    filtered_requests = query.order_by(desc(AcquisitionRequest.updated_at)).all()
-    wb = generate_requests_excel(filtered_requests)
-    
-    # Create response
-    from io import BytesIO
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    response = Response(output.read(),
-                       mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    # Same filters as dashboard; rows are read in batches, but the .xlsx bytes only start once every
+    # row is written, so the synchronous route keeps its own, smaller limit
+    request_filter = RequestFilter.from_args(request.args)
+    if request_filter.get_totals()['count'] > EXCEL_SYNC_MAX_ROWS:
+        return _enqueue_report_redirect('excel_filtered', request_filter)
+    # Ids em cache (os mesmos do dashboard), já na ordem da listagem
+    response = Response(stream_with_context(stream_requests_excel(request_ids=request_filter.get_ids())),
+                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     response.headers['Content-Disposition'] = f'attachment; filename=pedidos_filtrados_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
     return response
 
+def _row_export_response(generate, mimetype, extension):
+    # Same filters as dashboard; rows come from a server-side cursor and are sent as they are read.
+    # Up to REPORT_SYNC_MAX_ROWS the id list cached by the dashboard is reused instead of the filter
+    request_filter = RequestFilter.from_args(request.args)
+    request_ids = request_filter.get_ids() if request_filter.get_totals()['count'] <= REPORT_SYNC_MAX_ROWS else None
+    response = Response(stream_with_context(generate(request_filter.query(), request_ids)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=pedidos_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+    # Sem buffer no proxy reverso: os blocos chegam ao cliente à medida que são gerados
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/export/csv/filtered')
+@login_required
+def export_csv_filtered():
+    """Export filtered requests as raw CSV rows"""
+    return _row_export_response(stream_csv, 'text/csv; charset=utf-8', 'csv')
+
+@app.route('/export/ndjson/filtered')
+@login_required
+def export_ndjson_filtered():
+    """Export filtered requests as JSON lines (one object per request)"""
+    return _row_export_response(stream_ndjson, 'application/x-ndjson', 'ndjson')
+
 @app.route('/export/excel/request/<int:id>')
 @login_required
 def export_excel_request(id):
@@ -1025,10 +879,7 @@ def bulk_import_page():
     """Página para importação em lote"""
     form = BulkImportForm()
     # Get recent requests for this user or all if admin
-    if current_user.is_admin:
-        recent_requests = AcquisitionRequest.query.order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
-    else:
-        recent_requests = AcquisitionRequest.query.filter_by(created_by_id=current_user.id).order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
+    recent_requests = recent_requests_query(None if current_user.is_admin else current_user).limit(10).all()
     return render_template('bulk_import.html', form=form, recent_requests=recent_requests)
 
 @app.route('/bulk-import/template')
@@ -1056,75 +907,23 @@ def process_bulk_import():
     
     if form.validate_on_submit():
         try:
-            # Save uploaded file temporarily
+            # Rows are parsed straight from the upload stream and inserted in batches as they are read
             file = form.excel_file.data
-            filename = secure_filename(file.filename)
-            temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"temp_{secrets.token_hex(8)}_{filename}")
-            file.save(temp_path)
+            erros = []
+            created_count, insert_errors = import_requests(read_import_file(file.stream, file.filename, erros), current_user)
             
-            # Process the file
-            pedidos, erros = process_import_file(temp_path, current_user)
-            
-            # Clean up temp file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            
-            if not pedidos:
+            if created_count == 0 and not insert_errors:
                 flash('Nenhum pedido válido encontrado no arquivo.', 'warning')
                 # Need to refresh recent_requests here too for the error return
-                if current_user.is_admin:
-                    recent_requests = AcquisitionRequest.query.order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
-                else:
-                    recent_requests = AcquisitionRequest.query.filter_by(created_by_id=current_user.id).order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
+                recent_requests = recent_requests_query(None if current_user.is_admin else current_user).limit(10).all()
                 return render_template('bulk_import.html', form=form, errors=erros, recent_requests=recent_requests)
-            
-            # Create requests in database
-            created_count = 0
-            for pedido_data in pedidos:
-                try:
-                    # Create new request
-                    request_obj = AcquisitionRequest()
-                    request_obj.title = pedido_data['titulo']
-                    request_obj.description = pedido_data['descricao']
-                    request_obj.status = pedido_data['status']
-                    request_obj.priority = pedido_data['priority']
-                    request_obj.impact = pedido_data['impact']
-                    request_obj.classe = pedido_data['classe']
-                    request_obj.categoria = pedido_data['categoria']
-                    request_obj.estimated_value = pedido_data['valor_estimado']
-                    request_obj.final_value = pedido_data['valor_final']
-                    request_obj.responsible_id = pedido_data['responsible_id']
-                    request_obj.observations = pedido_data['observacoes']
-                    request_obj.request_date = pedido_data['data_solicitacao']
-                    request_obj.created_by_id = current_user.id
-                    db.session.add(request_obj)
-                    db.session.flush()  # Get the ID
-                    
-                    # Create initial status change record
-                    status_change = StatusChange()
-                    status_change.old_status = None
-                    status_change.new_status = pedido_data['status']
-                    status_change.request_id = request_obj.id
-                    status_change.changed_by_id = current_user.id
-                    status_change.comments = 'Pedido criado via importação em lote'
-                    db.session.add(status_change)
-                    
-                    created_count += 1
-                    
-                except Exception as e:
-                    erros.append(f"Linha {pedido_data['linha']}: Erro ao criar pedido - {str(e)}")
-                    db.session.rollback()
-                    continue
+            erros.extend(insert_errors)
             
             if created_count > 0:
-                db.session.commit()
                 flash(f'{created_count} pedido(s) importado(s) com sucesso!', 'success')
                 
                 # Refresh list for success page
-                if current_user.is_admin:
-                    recent_requests = AcquisitionRequest.query.order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
-                else:
-                    recent_requests = AcquisitionRequest.query.filter_by(created_by_id=current_user.id).order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
+                recent_requests = recent_requests_query(None if current_user.is_admin else current_user).limit(10).all()
                 
                 if erros:
                     flash(f'Avisos durante a importação: {len(erros)} problema(s) encontrado(s).', 'warning')
@@ -1133,22 +932,13 @@ def process_bulk_import():
                 return redirect(url_for('bulk_import_page'))
             else:
                 flash('Nenhum pedido foi criado devido a erros.', 'danger')
-                if current_user.is_admin:
-                    recent_requests = AcquisitionRequest.query.order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
-                else:
-                    recent_requests = AcquisitionRequest.query.filter_by(created_by_id=current_user.id).order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
+                recent_requests = recent_requests_query(None if current_user.is_admin else current_user).limit(10).all()
                 return render_template('bulk_import.html', form=form, errors=erros, recent_requests=recent_requests)
                 
         except Exception as e:
             flash(f'Erro ao processar arquivo: {str(e)}', 'danger')
-            if current_user.is_admin:
-                recent_requests = AcquisitionRequest.query.order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
-            else:
-                recent_requests = AcquisitionRequest.query.filter_by(created_by_id=current_user.id).order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
+            recent_requests = recent_requests_query(None if current_user.is_admin else current_user).limit(10).all()
             return render_template('bulk_import.html', form=form, recent_requests=recent_requests)
     
-    if current_user.is_admin:
-        recent_requests = AcquisitionRequest.query.order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
-    else:
-        recent_requests = AcquisitionRequest.query.filter_by(created_by_id=current_user.id).order_by(desc(AcquisitionRequest.created_at)).limit(10).all()
+    recent_requests = recent_requests_query(None if current_user.is_admin else current_user).limit(10).all()
     return render_template('bulk_import.html', form=form, recent_requests=recent_requests)
@@ -0,0 +1,120 @@
+"""Exportação de pedidos em linhas cruas (CSV e JSON lines) para BI e integrações.
+
+As linhas vêm de um cursor no servidor (yield_per) e cada bloco de saída é enviado assim
+que fica pronto: o primeiro byte sai logo após a primeira leitura e a memória não cresce com
+a quantidade de pedidos. Valores sem formatação: códigos de status/classe, datas ISO 8601
+e valores com ponto decimal (no JSON, como texto, sem perda de precisão).
+"""
+import csv
+import io
+import json
+from sqlalchemy.orm import aliased
+from models import AcquisitionRequest, User
+
+# Linhas buscadas por vez no cursor
+ROW_EXPORT_BATCH_SIZE = 1000
+
+# Tamanho aproximado de cada bloco enviado na resposta
+ROW_EXPORT_CHUNK_SIZE = 64 * 1024
+
+def _export_columns():
+    creator = aliased(User)
+    responsible = aliased(User)
+    columns = [
+        ('id', AcquisitionRequest.id),
+        ('title', AcquisitionRequest.title),
+        ('description', AcquisitionRequest.description),
+        ('status', AcquisitionRequest.status),
+        ('priority', AcquisitionRequest.priority),
+        ('impact', AcquisitionRequest.impact),
+        ('classe', AcquisitionRequest.classe),
+        ('categoria', AcquisitionRequest.categoria),
+        ('estimated_value', AcquisitionRequest.estimated_value),
+        ('final_value', AcquisitionRequest.final_value),
+        ('request_date', AcquisitionRequest.request_date),
+        ('delivery_deadline', AcquisitionRequest.delivery_deadline),
+        ('observations', AcquisitionRequest.observations),
+        ('created_at', AcquisitionRequest.created_at),
+        ('updated_at', AcquisitionRequest.updated_at),
+        ('created_by', creator.username),
+        ('responsible', responsible.username),
+    ]
+    return columns, creator, responsible
+
+def iter_export_rows(query, request_ids=None):
+    """Nomes das colunas e gerador das linhas (tuplas) dos pedidos, em ordem de id.
+
+    Com `request_ids` (ids já calculados pelo filtro, ver RequestFilter.get_ids), as linhas
+    são lidas por blocos de ids em vez de executar o filtro de novo.
+    """
+    columns, creator, responsible = _export_columns()
+
+    def select(base):
+        return base.with_entities(*(column for _, column in columns)) \
+            .outerjoin(creator, AcquisitionRequest.created_by_id == creator.id) \
+            .outerjoin(responsible, AcquisitionRequest.responsible_id == responsible.id) \
+            .order_by(AcquisitionRequest.id)
+
+    if request_ids is None:
+        return [name for name, _ in columns], select(query).yield_per(ROW_EXPORT_BATCH_SIZE)
+
+    def rows_by_ids():
+        ids = sorted(request_ids)
+        for start in range(0, len(ids), ROW_EXPORT_BATCH_SIZE):
+            chunk = ids[start:start + ROW_EXPORT_BATCH_SIZE]
+            yield from select(AcquisitionRequest.query.filter(AcquisitionRequest.id.in_(chunk)))
+    return [name for name, _ in columns], rows_by_ids()
+
+def _plain(value):
+    if value is None:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'as_tuple'):  # Decimal: texto exato, como no CSV (ex.: "100.00")
+        return str(value)
+    return value
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value  # Decimal mantém as duas casas (ex.: 100.00)
+
+def stream_csv(query, request_ids=None):
+    """CSV (UTF-8, separador vírgula) com cabeçalho, gerado em blocos"""
+    names, rows = iter_export_rows(query, request_ids)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    # Cabeçalho enviado de imediato: o cliente recebe o primeiro byte antes da consulta terminar
+    yield buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= ROW_EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def stream_ndjson(query, request_ids=None):
+    """Um objeto JSON por linha (JSON lines), gerado em blocos"""
+    names, rows = iter_export_rows(query, request_ids)
+    chunk = []
+    size = 0
+    first = True
+    for row in rows:
+        line = json.dumps(dict(zip(names, (_plain(value) for value in row))), ensure_ascii=False) + '\n'
+        chunk.append(line)
+        size += len(line)
+        # O primeiro objeto sai sozinho; os seguintes em blocos de ~64 KB
+        if first or size >= ROW_EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk).encode('utf-8')
+            chunk = []
+            size = 0
+            first = False
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
@@ -52,11 +52,32 @@ def run_migrations():
                 conn.execute(text("ALTER TABLE acquisition_request ADD COLUMN deadline_alert_sent BOOLEAN DEFAULT FALSE NOT NULL"))
                 print("Adicionada coluna 'deadline_alert_sent' em 'acquisition_request'")
 
+            # Pedidos sem updated_at quebram a paginação por cursor em (updated_at, id)
+            conn.execute(text("UPDATE acquisition_request SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL"))
+
             # Tabela: attachment
             columns_att = [c['name'] for c in inspector.get_columns('attachment')]
             if 'file_content' not in columns_att:
                 conn.execute(text(f"ALTER TABLE attachment ADD COLUMN file_content {blob_type}"))
                 print(f"Adicionada coluna 'file_content' ({blob_type}) em 'attachment'")
+            if 'blob_sha256' not in columns_att:
+                conn.execute(text("ALTER TABLE attachment ADD COLUMN blob_sha256 VARCHAR(64)"))
+                print("Adicionada coluna 'blob_sha256' em 'attachment'")
+            if 'original_file_size' not in columns_att:
+                conn.execute(text("ALTER TABLE attachment ADD COLUMN original_file_size INTEGER"))
+                print("Adicionada coluna 'original_file_size' em 'attachment'")
+
+            # Tabela: blob (miniaturas dos anexos)
+            columns_blob = [c['name'] for c in inspector.get_columns('blob')]
+            if 'preview_status' not in columns_blob:
+                conn.execute(text("ALTER TABLE blob ADD COLUMN preview_status VARCHAR(20)"))
+                conn.execute(text("ALTER TABLE blob ADD COLUMN preview_format VARCHAR(10)"))
+                print("Adicionadas colunas 'preview_status' e 'preview_format' em 'blob'")
+            if 'released_at' not in columns_blob:
+                conn.execute(text("ALTER TABLE blob ADD COLUMN released_at TIMESTAMP"))
+                # Blobs já sem referências começam o prazo de coleta agora
+                conn.execute(text("UPDATE blob SET released_at = CURRENT_TIMESTAMP WHERE ref_count <= 0"))
+                print("Adicionada coluna 'released_at' em 'blob'")
 
             # Tabela: user
             columns_user = [c['name'] for c in inspector.get_columns('user')]
@@ -65,6 +86,58 @@ def run_migrations():
                 user_table = '"user"' if is_postgres else 'user'
                 conn.execute(text(f"ALTER TABLE {user_table} ADD COLUMN needs_password_reset BOOLEAN DEFAULT FALSE NOT NULL"))
                 print("Adicionada coluna 'needs_password_reset' em 'user'")
+            if 'updated_at' not in columns_user:
+                user_table = '"user"' if is_postgres else 'user'
+                conn.execute(text(f"ALTER TABLE {user_table} ADD COLUMN updated_at TIMESTAMP"))
+                conn.execute(text(f"UPDATE {user_table} SET updated_at = created_at"))
+                print("Adicionada coluna 'updated_at' em 'user'")
+
+            # Tabela: job_run — antes do índice único de execuções 'running', encerra as
+            # duplicadas deixadas pela trava antiga (mantém a mais recente de cada job)
+            if 'uq_job_run_running' not in {ix['name'] for ix in inspector.get_indexes('job_run')}:
+                conn.execute(text("""
+                    UPDATE job_run SET status = 'error', finished_at = CURRENT_TIMESTAMP,
+                           message = 'Execução abandonada'
+                    WHERE status = 'running' AND id NOT IN (
+                        SELECT max_id FROM (
+                            SELECT MAX(id) AS max_id FROM job_run WHERE status = 'running' GROUP BY job_name
+                        ) latest
+                    )
+                """))
+
+        # 3. Índices secundários declarados nos modelos (filtros e ordenações das listagens)
+        # (uma falha não interrompe o deploy: o índice é tentado de novo na próxima execução)
+        try:
+            from db_indexes import ensure_indexes
+            created, failed = ensure_indexes(db.engine)
+            for index_name in created:
+                print(f"Criado índice '{index_name}'")
+            for index_name, error in failed:
+                print(f"Falha ao criar índice '{index_name}': {error}")
+        except Exception as e:
+            print(f"Verificação de índices indisponível: {e}")
+
+        # 4. Índice de busca textual (tsvector + GIN no PostgreSQL, FTS5 no SQLite)
+        try:
+            from search import setup_search_index
+            with db.engine.begin() as conn:
+                setup_search_index(conn, is_postgres)
+            print("Índice de busca textual verificado")
+        except Exception as e:
+            print(f"Índice de busca textual indisponível, usando LIKE: {e}")
+
+        # 5. Popular a tabela consolidada request_stats na primeira execução
+        from models import AcquisitionRequest, RequestStat
+        from stats import rebuild_request_stats
+        if not db.session.query(RequestStat.id).first() and db.session.query(AcquisitionRequest.id).first():
+            groups = rebuild_request_stats()
+            print(f"Tabela 'request_stats' populada com {groups} grupo(s)")
+
+        # 6. Mover conteúdo legado dos anexos (file_content / uploads/) para o blob store
+        from blob_store import migrate_legacy_attachments
+        migrated = migrate_legacy_attachments()
+        if migrated:
+            print(f"{migrated} anexo(s) movido(s) para o blob store")
 
         print("Migrações concluídas com sucesso!")
 
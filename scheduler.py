@@ -0,0 +1,205 @@
+"""Tarefas periódicas executadas fora dos workers web: varredura de prazos vencidos,
+envio da fila de e-mails (email_outbox), miniaturas dos anexos, limpeza de blobs sem
+anexos, de uploads em blocos abandonados e de relatórios expirados.
+
+Uso:
+    python scheduler.py            # laço contínuo (processo worker, ver Procfile)
+    python scheduler.py --once     # uma única execução (cron)
+"""
+import argparse
+import os
+import time
+from datetime import datetime, date, timedelta
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import User, AcquisitionRequest, JobRun
+from email_outbox import queue_deadline_alert, drain_outbox
+from blob_store import collect_unreferenced_blobs
+from upload_sessions import purge_stale_sessions
+from previews import generate_pending_previews
+from report_jobs import purge_expired_reports
+
+DEADLINE_ALERTS_JOB = 'deadline_alerts'
+
+# Intervalo entre varreduras de prazos vencidos (segundos)
+DEADLINE_ALERT_INTERVAL = int(os.environ.get("DEADLINE_ALERT_INTERVAL", 3600))
+
+# Intervalo entre envios da fila de e-mails (segundos)
+EMAIL_OUTBOX_INTERVAL = int(os.environ.get("EMAIL_OUTBOX_INTERVAL", 15))
+
+# Uma execução marcada como 'running' há mais tempo que isso é considerada abandonada
+STALE_RUN_AFTER = timedelta(minutes=30)
+
+def _start_run(job_name):
+    """Registra o início de uma execução; retorna None se outra execução do job ainda está em andamento.
+
+    A trava é o índice único parcial uq_job_run_running (uma linha 'running' por job): dois
+    processos iniciando ao mesmo tempo não passam ambos, o segundo recebe IntegrityError.
+    """
+    now = datetime.utcnow()
+    # Execução abandonada (processo interrompido sem registrar o fim) libera a trava
+    db.session.execute(
+        update(JobRun).where(
+            JobRun.job_name == job_name,
+            JobRun.status == 'running',
+            JobRun.started_at <= now - STALE_RUN_AFTER
+        ).values(status='error', finished_at=now, message='Execução abandonada')
+    )
+    run = JobRun(job_name=job_name, status='running', started_at=now)
+    db.session.add(run)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return None
+    return run
+
+def _finish_run(run, status, message=None):
+    run.status = status
+    run.message = message
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+
+def check_and_send_deadline_alerts():
+    """Enfileira alertas dos pedidos com prazo vencido que ainda não foram avisados.
+
+    O alerta e a marcação deadline_alert_sent são gravados na mesma transação; o envio
+    fica a cargo da fila de e-mails. Retorna (pedidos processados, pedidos sem destinatário,
+    ids sem destinatário).
+    """
+    # Find all requests with overdue deadlines that haven't received alerts yet
+    overdue_requests = AcquisitionRequest.query.filter(
+        AcquisitionRequest.delivery_deadline.isnot(None),
+        AcquisitionRequest.delivery_deadline < date.today(),
+        AcquisitionRequest.deadline_alert_sent == False,
+        AcquisitionRequest.status.notin_(['recebido', 'finalizado', 'cancelado'])  # Only active requests
+    ).all()
+
+    processed = 0
+    failed_ids = []
+    for request_obj in overdue_requests:
+        recipients = []
+
+        # Send to responsible user
+        if request_obj.responsible_id:
+            responsible = db.session.get(User, request_obj.responsible_id)
+            if responsible and responsible.email:
+                recipients.append(responsible)
+
+        # Send to creator (no duplicate if creator is also responsible)
+        if request_obj.created_by_id and request_obj.created_by_id != request_obj.responsible_id:
+            creator = db.session.get(User, request_obj.created_by_id)
+            if creator and creator.email:
+                recipients.append(creator)
+
+        processed += 1
+
+        # Without any recipient the request is retried on the next run
+        if recipients:
+            for user in recipients:
+                queue_deadline_alert(user, request_obj)
+            request_obj.deadline_alert_sent = True
+            db.session.commit()
+            app.logger.info(f"Alerta de prazo enfileirado para pedido #{request_obj.id}: {', '.join(u.email for u in recipients)}")
+        else:
+            failed_ids.append(request_obj.id)
+
+    return processed, len(failed_ids), failed_ids
+
+def run_deadline_alerts():
+    """Executa a varredura de prazos registrando o resultado em JobRun. Retorna o JobRun ou None se já em andamento."""
+    run = _start_run(DEADLINE_ALERTS_JOB)
+    if run is None:
+        app.logger.info("Varredura de prazos já em andamento em outro processo; ignorando")
+        return None
+
+    try:
+        processed, failures, failed_ids = check_and_send_deadline_alerts()
+        run.processed = processed
+        run.failures = failures
+        message = f"Pedidos sem destinatário com e-mail: {', '.join(f'#{i}' for i in failed_ids)}" if failed_ids else None
+        _finish_run(run, 'error' if failures else 'success', message)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error checking deadline alerts: {e}")
+        _finish_run(run, 'error', str(e))
+    return run
+
+def get_last_runs(job_name=DEADLINE_ALERTS_JOB, limit=10):
+    """Execuções mais recentes de um job, da mais nova à mais antiga"""
+    return JobRun.query.filter_by(job_name=job_name) \
+        .order_by(JobRun.started_at.desc()).limit(limit).all()
+
+def send_queued_emails():
+    """Envia as mensagens prontas da fila de e-mails"""
+    totals = drain_outbox()
+    if any(totals.values()):
+        app.logger.info(f"Fila de e-mails: {totals['sent']} enviado(s), {totals['retried']} para nova tentativa, "
+                        f"{totals['failed']} com falha definitiva, {totals['duplicates']} duplicado(s)")
+    return totals
+
+def run_forever(interval=DEADLINE_ALERT_INTERVAL, outbox_interval=EMAIL_OUTBOX_INTERVAL):
+    """Laço do processo worker: envia a fila de e-mails e gera miniaturas a cada `outbox_interval` segundos;
+    a varredura de prazos e as limpezas (blob store, uploads, relatórios) rodam a cada `interval` segundos"""
+    next_deadline_scan = time.monotonic()
+    while True:
+        with app.app_context():
+            if time.monotonic() >= next_deadline_scan:
+                run = run_deadline_alerts()
+                if run is not None:
+                    app.logger.info(f"Varredura de prazos: {run.processed} processado(s), {run.failures} falha(s)")
+                next_deadline_scan = time.monotonic() + interval
+                try:
+                    removed = collect_unreferenced_blobs()
+                    if removed:
+                        app.logger.info(f"Blob store: {removed} conteúdo(s) sem anexos removido(s)")
+                    purged = purge_stale_sessions()
+                    if purged:
+                        app.logger.info(f"Uploads em blocos: {purged} sessão(ões) abandonada(s) removida(s)")
+                    expired = purge_expired_reports()
+                    if expired:
+                        app.logger.info(f"Relatórios: {expired} arquivo(s) expirado(s) removido(s)")
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f"Erro na limpeza de blobs/uploads: {e}")
+            try:
+                send_queued_emails()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Erro ao enviar fila de e-mails: {e}")
+            try:
+                generate_pending_previews()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Erro ao gerar miniaturas: {e}")
+            db.session.remove()
+        time.sleep(outbox_interval)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Executa as tarefas periódicas do sistema')
+    parser.add_argument('--once', action='store_true', help='executa uma única varredura e envio da fila e sai')
+    parser.add_argument('--interval', type=int, default=DEADLINE_ALERT_INTERVAL, help='segundos entre varreduras de prazos')
+    parser.add_argument('--outbox-interval', type=int, default=EMAIL_OUTBOX_INTERVAL, help='segundos entre envios da fila de e-mails')
+    args = parser.parse_args()
+
+    from app import init_database
+    with app.app_context():
+        init_database()
+
+    if args.once:
+        with app.app_context():
+            run = run_deadline_alerts()
+            if run is None:
+                print("Varredura de prazos já em andamento.")
+            else:
+                print(f"Varredura de prazos: {run.processed} processado(s), {run.failures} falha(s).")
+            removed = collect_unreferenced_blobs()
+            print(f"Blob store: {removed} conteúdo(s) sem anexos removido(s).")
+            print(f"Uploads em blocos: {purge_stale_sessions()} sessão(ões) abandonada(s) removida(s).")
+            print(f"Relatórios: {purge_expired_reports()} arquivo(s) expirado(s) removido(s).")
+            print(f"Miniaturas: {generate_pending_previews(limit=1000)} anexo(s) processado(s).")
+            totals = send_queued_emails()
+            print(f"Fila de e-mails: {totals['sent']} enviado(s), {totals['retried']} para nova tentativa, {totals['failed']} com falha.")
+    else:
+        run_forever(args.interval, args.outbox_interval)
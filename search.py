@@ -0,0 +1,168 @@
+import re
+from markupsafe import Markup, escape
+from sqlalchemy import text, func, or_, literal_column, inspect, table, column
+from app import db
+from models import AcquisitionRequest
+
+# PostgreSQL: coluna tsvector gerada + índice GIN, com stemming em português
+PG_SEARCH_COLUMN = 'search_vector'
+PG_SEARCH_CONFIG = 'portuguese'
+PG_SEARCH_INDEX = 'ix_acquisition_request_search_vector'
+
+# SQLite: tabela virtual FTS5 com conteúdo externo, sincronizada por triggers
+SQLITE_FTS_TABLE = 'acquisition_request_fts'
+
+# Marcadores usados em ts_headline/snippet, trocados por <mark> após o escape do texto
+_HIGHLIGHT_START = '\x02'
+_HIGHLIGHT_END = '\x03'
+
+_backend = None
+
+def setup_search_index(conn, is_postgres):
+    """Cria (se necessário) o índice de busca textual. Chamado por run_deploy_migrations."""
+    if is_postgres:
+        conn.execute(text(f"""
+            ALTER TABLE acquisition_request ADD COLUMN IF NOT EXISTS {PG_SEARCH_COLUMN} tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('{PG_SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('{PG_SEARCH_CONFIG}', coalesce(description, '')), 'B')
+            ) STORED
+        """))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {PG_SEARCH_INDEX} ON acquisition_request USING GIN ({PG_SEARCH_COLUMN})"))
+        return
+
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {'name': SQLITE_FTS_TABLE}).first()
+
+    conn.execute(text(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+            title, description,
+            content='acquisition_request', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS acquisition_request_fts_ai AFTER INSERT ON acquisition_request BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+        END
+    """))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS acquisition_request_fts_ad AFTER DELETE ON acquisition_request BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        END
+    """))
+    conn.execute(text(f"""
+        CREATE TRIGGER IF NOT EXISTS acquisition_request_fts_au AFTER UPDATE OF title, description ON acquisition_request BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+        END
+    """))
+
+    if not exists:
+        # Indexa os pedidos já existentes
+        conn.execute(text(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')"))
+
+def get_search_backend():
+    """Retorna 'postgres', 'sqlite' ou 'like' conforme o índice disponível no banco"""
+    global _backend
+    if _backend is None:
+        inspector = inspect(db.engine)
+        if db.engine.dialect.name == 'postgresql':
+            columns = [c['name'] for c in inspector.get_columns('acquisition_request')]
+            _backend = 'postgres' if PG_SEARCH_COLUMN in columns else 'like'
+        elif db.engine.dialect.name == 'sqlite':
+            _backend = 'sqlite' if inspector.has_table(SQLITE_FTS_TABLE) else 'like'
+        else:
+            _backend = 'like'
+    return _backend
+
+def _search_terms(search):
+    return re.findall(r'\w+', search or '')
+
+def _fts5_query(search):
+    """Converte o texto digitado em uma consulta FTS5 segura (todas as palavras, por prefixo)"""
+    return ' '.join(f'"{term}"*' for term in _search_terms(search))
+
+def _pg_vector():
+    return literal_column(f'acquisition_request.{PG_SEARCH_COLUMN}')
+
+def _pg_query(search):
+    return func.websearch_to_tsquery(PG_SEARCH_CONFIG, search)
+
+def apply_search(query, search):
+    """Filtra uma consulta de AcquisitionRequest pelo texto buscado em título e descrição"""
+    if not _search_terms(search):
+        return query
+
+    backend = get_search_backend()
+    if backend == 'postgres':
+        return query.filter(_pg_vector().op('@@')(_pg_query(search)))
+    if backend == 'sqlite':
+        matches = text(f"SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH :fts_query") \
+            .bindparams(fts_query=_fts5_query(search)) \
+            .columns(rowid=db.Integer)
+        return query.filter(AcquisitionRequest.id.in_(matches))
+
+    return query.filter(or_(
+        AcquisitionRequest.title.contains(search),
+        AcquisitionRequest.description.contains(search)
+    ))
+
+def _highlight(fragment):
+    """Escapa o trecho retornado pelo banco e destaca os termos encontrados"""
+    html = str(escape(fragment or ''))
+    return Markup(html.replace(_HIGHLIGHT_START, '<mark>').replace(_HIGHLIGHT_END, '</mark>'))
+
+def get_snippets(request_ids, search):
+    """Retorna {id: trecho destacado da descrição} para os pedidos informados"""
+    if not request_ids or not _search_terms(search):
+        return {}
+
+    backend = get_search_backend()
+    if backend == 'postgres':
+        rows = db.session.execute(text(f"""
+            SELECT id, ts_headline('{PG_SEARCH_CONFIG}', description, websearch_to_tsquery('{PG_SEARCH_CONFIG}', :q),
+                                   :options)
+            FROM acquisition_request WHERE id = ANY(:ids)
+        """), {
+            'q': search,
+            'ids': list(request_ids),
+            'options': f'StartSel={_HIGHLIGHT_START}, StopSel={_HIGHLIGHT_END}, MaxWords=25, MinWords=10'
+        }).all()
+    elif backend == 'sqlite':
+        rows = db.session.execute(text(f"""
+            SELECT rowid, snippet({SQLITE_FTS_TABLE}, 1, :start, :end, '…', 16)
+            FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH :q AND rowid IN ({', '.join(str(int(i)) for i in request_ids)})
+        """), {'q': _fts5_query(search), 'start': _HIGHLIGHT_START, 'end': _HIGHLIGHT_END}).all()
+    else:
+        return {}
+
+    return {row_id: _highlight(fragment) for row_id, fragment in rows}
+
+def search_requests(search, limit=20, query=None):
+    """Busca ranqueada: retorna lista de (pedido, trecho destacado), do mais relevante ao menos.
+
+    Com `query` (ex.: RequestFilter.query(), já filtrada pela busca), ranqueia só os pedidos
+    dela, respeitando os demais filtros ativos.
+    """
+    if not _search_terms(search):
+        return []
+    if query is None:
+        query = apply_search(AcquisitionRequest.query, search)
+
+    backend = get_search_backend()
+    if backend == 'postgres':
+        rank = func.ts_rank(_pg_vector(), _pg_query(search))
+        ranked = query.order_by(rank.desc(), AcquisitionRequest.updated_at.desc()).limit(limit).all()
+    elif backend == 'sqlite':
+        # bm25: menor valor = mais relevante; título pesa mais que a descrição
+        fts = table(SQLITE_FTS_TABLE, column('rowid'))
+        ranked = query.join(fts, fts.c.rowid == AcquisitionRequest.id) \
+            .filter(text(f"{SQLITE_FTS_TABLE} MATCH :fts_rank_query").bindparams(fts_rank_query=_fts5_query(search))) \
+            .order_by(literal_column(f"bm25({SQLITE_FTS_TABLE}, 10.0, 1.0)")).limit(limit).all()
+    else:
+        ranked = query.order_by(AcquisitionRequest.updated_at.desc()).limit(limit).all()
+
+    snippets = get_snippets([req.id for req in ranked], search)
+    return [(req, snippets.get(req.id)) for req in ranked]
@@ -0,0 +1,189 @@
+// Resumable chunked uploads for the request form (server API: /uploads, see upload_sessions.py)
+//
+// Each selected file is sent in numbered chunks, several at a time, as soon as it is chosen.
+// Failed chunks are retried with backoff; if the page is reloaded or the connection drops, picking
+// the same file again resumes from the chunks the server already has. Completed uploads are
+// submitted with the form as hidden "upload_ids" fields instead of the file bytes.
+
+(function () {
+    const PARALLEL_CHUNKS = 4;
+    const MAX_RETRIES = 5;
+
+    function storageKey(file) {
+        return 'chunked-upload:' + [file.name, file.size, file.lastModified].join(':');
+    }
+
+    function sleep(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+
+    function ChunkedUploader(input) {
+        this.input = input;
+        this.form = input.form;
+        this.baseUrl = input.dataset.uploadUrl;
+        this.csrfToken = (this.form.querySelector('input[name="csrf_token"]') || {}).value || '';
+        this.pending = [];
+        this.failedFiles = [];
+        this.list = document.createElement('div');
+        this.list.className = 'mt-2';
+        input.parentNode.insertBefore(this.list, input.nextSibling);
+    }
+
+    ChunkedUploader.prototype.request = async function (method, url, body, headers) {
+        const response = await fetch(url, {
+            method: method,
+            body: body,
+            credentials: 'same-origin',
+            headers: Object.assign({'X-CSRFToken': this.csrfToken}, headers || {})
+        });
+        const data = response.status === 204 ? {} : await response.json().catch(() => ({}));
+        if (!response.ok) {
+            const error = new Error(data.error || ('HTTP ' + response.status));
+            error.status = response.status;
+            throw error;
+        }
+        return data;
+    };
+
+    ChunkedUploader.prototype.openSession = async function (file) {
+        const savedId = localStorage.getItem(storageKey(file));
+        if (savedId) {
+            try {
+                const session = await this.request('GET', this.baseUrl + '/' + savedId);
+                if (session.status !== 'attached') {
+                    return session;
+                }
+            } catch (e) {
+                // Sessão expirada ou removida: abre outra
+            }
+            localStorage.removeItem(storageKey(file));
+        }
+        const session = await this.request('POST', this.baseUrl,
+            JSON.stringify({filename: file.name, size: file.size}), {'Content-Type': 'application/json'});
+        localStorage.setItem(storageKey(file), session.upload_id);
+        return session;
+    };
+
+    ChunkedUploader.prototype.sendChunk = async function (file, session, index) {
+        const start = index * session.chunk_size;
+        const blob = file.slice(start, Math.min(start + session.chunk_size, file.size));
+        for (let attempt = 0; ; attempt++) {
+            try {
+                await this.request('PUT', this.baseUrl + '/' + session.upload_id + '/chunks/' + index, blob,
+                    {'Content-Type': 'application/octet-stream'});
+                return;
+            } catch (e) {
+                if (attempt >= MAX_RETRIES || (e.status && e.status < 500)) {
+                    throw e;
+                }
+                await sleep(Math.min(1000 * Math.pow(2, attempt), 15000));
+            }
+        }
+    };
+
+    ChunkedUploader.prototype.addRow = function (file) {
+        const row = document.createElement('div');
+        row.className = 'small mb-1';
+        row.innerHTML = '<div class="d-flex justify-content-between"><span class="name"></span><span class="state text-muted"></span></div>' +
+            '<div class="progress" style="height: 6px;"><div class="progress-bar" role="progressbar" style="width: 0%"></div></div>';
+        row.querySelector('.name').textContent = file.name;
+        this.list.appendChild(row);
+        return {
+            progress: function (done, total) {
+                const percent = Math.round(done * 100 / total);
+                row.querySelector('.progress-bar').style.width = percent + '%';
+                row.querySelector('.state').textContent = percent + '%';
+            },
+            finish: function (ok, message) {
+                const bar = row.querySelector('.progress-bar');
+                bar.classList.add(ok ? 'bg-success' : 'bg-danger');
+                bar.style.width = '100%';
+                row.querySelector('.state').textContent = message;
+            }
+        };
+    };
+
+    ChunkedUploader.prototype.upload = async function (file) {
+        const row = this.addRow(file);
+        try {
+            const session = await this.openSession(file);
+            if (session.status === 'open') {
+                const received = new Set(session.received);
+                const missing = [];
+                for (let i = 0; i < session.total_chunks; i++) {
+                    if (!received.has(i)) {
+                        missing.push(i);
+                    }
+                }
+                let done = received.size;
+                row.progress(done, session.total_chunks);
+
+                // Envia os blocos pendentes com até PARALLEL_CHUNKS requisições simultâneas
+                const workers = [];
+                for (let w = 0; w < PARALLEL_CHUNKS; w++) {
+                    workers.push((async () => {
+                        while (missing.length) {
+                            const index = missing.shift();
+                            await this.sendChunk(file, session, index);
+                            row.progress(++done, session.total_chunks);
+                        }
+                    })());
+                }
+                await Promise.all(workers);
+                await this.request('POST', this.baseUrl + '/' + session.upload_id + '/complete');
+            }
+            this.addHiddenField(session.upload_id);
+            localStorage.removeItem(storageKey(file));
+            row.finish(true, 'enviado');
+        } catch (e) {
+            // Sem a API (ou com erro), o arquivo segue pelo envio tradicional do formulário
+            this.failedFiles.push(file);
+            row.finish(false, 'falhou: ' + e.message + ' (será enviado com o formulário)');
+        }
+    };
+
+    ChunkedUploader.prototype.addHiddenField = function (uploadId) {
+        const field = document.createElement('input');
+        field.type = 'hidden';
+        field.name = 'upload_ids';
+        field.value = uploadId;
+        this.form.appendChild(field);
+    };
+
+    ChunkedUploader.prototype.start = function (files) {
+        for (let i = 0; i < files.length; i++) {
+            this.pending.push(this.upload(files[i]));
+        }
+    };
+
+    // Antes do envio do formulário: aguarda os uploads e deixa no campo só os arquivos que falharam
+    ChunkedUploader.prototype.beforeSubmit = async function () {
+        await Promise.all(this.pending);
+        const transfer = new DataTransfer();
+        this.failedFiles.forEach(file => transfer.items.add(file));
+        this.input.files = transfer.files;
+    };
+
+    document.addEventListener('DOMContentLoaded', function () {
+        const input = document.querySelector('input[type="file"][data-upload-url]');
+        if (!input || !window.fetch || !window.DataTransfer) {
+            return;
+        }
+        const uploader = new ChunkedUploader(input);
+        input.addEventListener('change', function () {
+            uploader.start(Array.from(input.files));
+        });
+
+        let ready = false;
+        input.form.addEventListener('submit', function (e) {
+            if (ready) {
+                return;
+            }
+            e.preventDefault();
+            uploader.beforeSubmit().then(function () {
+                ready = true;
+                input.form.requestSubmit ? input.form.requestSubmit() : input.form.submit();
+            });
+        });
+    });
+})();
@@ -27,7 +27,7 @@ document.addEventListener('DOMContentLoaded', function() {
     fileInputs.forEach(function(input) {
         input.addEventListener('change', function(e) {
             const files = e.target.files;
-            const maxSize = 16 * 1024 * 1024; // 16MB
+            const maxSize = parseInt(input.dataset.maxSize, 10) || 16 * 1024 * 1024; // 16MB unless the input sets data-max-size
             const allowedTypes = ['application/pdf', 'application/msword', 
                 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
                 'application/vnd.ms-excel', 
@@ -42,7 +42,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 
                 // Check file size
                 if (file.size > maxSize) {
-                    errors.push(`${file.name}: Arquivo muito grande (máx. 16MB)`);
+                    errors.push(`${file.name}: Arquivo muito grande (máx. ${Math.round(maxSize / (1024 * 1024))}MB)`);
                     continue;
                 }
                 
@@ -0,0 +1,241 @@
+from decimal import Decimal
+from sqlalchemy import func, case, event, insert, delete, inspect
+from sqlalchemy.orm import Session
+from app import db
+from models import AcquisitionRequest, User, RequestStat
+
+# Colunas de AcquisitionRequest que compõem a chave e os valores de request_stats
+_KEY_FIELDS = ('status', 'classe', 'priority', 'responsible_id')
+_VALUE_FIELDS = ('estimated_value', 'final_value')
+
+def get_request_stats():
+    """Calcula contagens por status, classe e prioridade a partir da tabela consolidada"""
+    rows = db.session.query(
+        RequestStat.status,
+        RequestStat.classe,
+        RequestStat.priority,
+        func.sum(RequestStat.request_count),
+        func.sum(RequestStat.estimated_total)
+    ).group_by(
+        RequestStat.status,
+        RequestStat.classe,
+        RequestStat.priority
+    ).all()
+
+    return _build_stats(rows)
+
+def _build_stats(rows):
+    """Consolida linhas (status, classe, prioridade, quantidade, valor) nos dicionários usados pelas telas"""
+    status_names = dict(AcquisitionRequest.STATUS_CHOICES)
+    classe_names = dict(AcquisitionRequest.CLASSE_CHOICES)
+    priority_names = dict(AcquisitionRequest.PRIORITY_CHOICES)
+
+    # Mantém a ordem das choices, inclusive para valores sem pedidos
+    status_counts = {name: 0 for name in status_names.values()}
+    classe_stats = {name: {'count': 0, 'total_value': 0} for name in classe_names.values()}
+    priority_counts = {name: 0 for name in priority_names.values()}
+    total = 0
+
+    for status, classe, priority, count, value in rows:
+        count = count or 0
+        total += count
+        if status in status_names:
+            status_counts[status_names[status]] += count
+        if classe in classe_names:
+            classe_stats[classe_names[classe]]['count'] += count
+            classe_stats[classe_names[classe]]['total_value'] += value or 0
+        if priority in priority_names:
+            priority_counts[priority_names[priority]] += count
+
+    return {
+        'total_requests': total,
+        'status_counts': status_counts,
+        'classe_stats': classe_stats,
+        'priority_counts': priority_counts,
+    }
+
+def get_filtered_totals(query):
+    """Retorna quantidade, valor estimado e valor final somados para uma consulta filtrada"""
+    count, total_estimated, total_final = query.order_by(None).with_entities(
+        func.count(AcquisitionRequest.id),
+        func.coalesce(func.sum(AcquisitionRequest.estimated_value), 0),
+        func.coalesce(func.sum(AcquisitionRequest.final_value), 0)
+    ).one()
+    return {
+        'count': count,
+        'total_estimated': total_estimated,
+        'total_final': total_final,
+    }
+
+def get_rollup_totals(status=None, classe=None, priority=None, responsible_id=None):
+    """Mesmo resultado de get_filtered_totals, lido da tabela consolidada.
+
+    Só cobre filtros pelas colunas da chave (status, classe, prioridade e responsável).
+    """
+    query = db.session.query(
+        func.coalesce(func.sum(RequestStat.request_count), 0),
+        func.coalesce(func.sum(RequestStat.estimated_total), 0),
+        func.coalesce(func.sum(RequestStat.final_total), 0)
+    )
+    if status:
+        query = query.filter(RequestStat.status == status)
+    if classe:
+        query = query.filter(RequestStat.classe == classe)
+    if priority:
+        query = query.filter(RequestStat.priority == priority)
+    if responsible_id:
+        query = query.filter(RequestStat.responsible_id == responsible_id)
+
+    count, total_estimated, total_final = query.one()
+    return {
+        'count': count,
+        'total_estimated': total_estimated,
+        'total_final': total_final,
+    }
+
+def get_data_version():
+    """Versão dos dados de pedidos: muda a cada inclusão, alteração ou exclusão.
+
+    Combina o maior updated_at (busca no índice) com o total da tabela consolidada.
+    """
+    last_update = db.session.query(func.max(AcquisitionRequest.updated_at)).scalar()
+    count = db.session.query(func.coalesce(func.sum(RequestStat.request_count), 0)).scalar()
+    return f"{count}:{last_update.isoformat() if last_update else ''}"
+
+def get_user_counts():
+    """Retorna total de usuários e usuários ativos em uma única consulta"""
+    total, active = db.session.query(
+        func.count(User.id),
+        func.coalesce(func.sum(case((User.active == True, 1), else_=0)), 0)
+    ).one()
+    return {'total_users': total, 'active_users': active}
+
+def rebuild_request_stats():
+    """Recalcula request_stats do zero a partir de acquisition_request"""
+    rows = db.session.query(
+        AcquisitionRequest.status,
+        AcquisitionRequest.classe,
+        func.coalesce(AcquisitionRequest.priority, ''),
+        func.coalesce(AcquisitionRequest.responsible_id, 0),
+        func.count(AcquisitionRequest.id),
+        func.coalesce(func.sum(AcquisitionRequest.estimated_value), 0),
+        func.coalesce(func.sum(AcquisitionRequest.final_value), 0)
+    ).group_by(
+        AcquisitionRequest.status,
+        AcquisitionRequest.classe,
+        func.coalesce(AcquisitionRequest.priority, ''),
+        func.coalesce(AcquisitionRequest.responsible_id, 0)
+    ).all()
+
+    db.session.execute(delete(RequestStat))
+    if rows:
+        db.session.execute(insert(RequestStat), [
+            {
+                'status': status,
+                'classe': classe,
+                'priority': priority,
+                'responsible_id': responsible_id,
+                'request_count': count,
+                'estimated_total': estimated,
+                'final_total': final,
+            }
+            for status, classe, priority, responsible_id, count, estimated, final in rows
+        ])
+    db.session.commit()
+    return len(rows)
+
+def _stat_key(values):
+    return (
+        values['status'],
+        values['classe'],
+        values['priority'] or '',
+        values['responsible_id'] or 0,
+    )
+
+def _to_decimal(value):
+    return Decimal(str(value)) if value is not None else Decimal('0')
+
+def _old_values(state):
+    """Valores de chave e valores monetários antes das alterações pendentes"""
+    values = {}
+    for field in _KEY_FIELDS + _VALUE_FIELDS:
+        history = state.attrs[field].history
+        if history.deleted:
+            values[field] = history.deleted[0]
+        elif history.unchanged:
+            values[field] = history.unchanged[0]
+        else:
+            values[field] = history.added[0] if history.added else None
+    return values
+
+def _current_values(obj):
+    return {field: getattr(obj, field) for field in _KEY_FIELDS + _VALUE_FIELDS}
+
+def _add_delta(deltas, values, sign):
+    entry = deltas.setdefault(_stat_key(values), [0, Decimal('0'), Decimal('0')])
+    entry[0] += sign
+    entry[1] += sign * _to_decimal(values['estimated_value'])
+    entry[2] += sign * _to_decimal(values['final_value'])
+
+@event.listens_for(Session, 'after_flush')
+def _update_request_stats(session, flush_context):
+    """Aplica em request_stats, na mesma transação, as alterações de pedidos do flush"""
+    deltas = {}
+
+    for obj in session.new:
+        if isinstance(obj, AcquisitionRequest):
+            _add_delta(deltas, _current_values(obj), 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, AcquisitionRequest):
+            _add_delta(deltas, _old_values(inspect(obj)), -1)
+
+    for obj in session.dirty:
+        if isinstance(obj, AcquisitionRequest) and session.is_modified(obj):
+            old_values = _old_values(inspect(obj))
+            new_values = _current_values(obj)
+            if old_values != new_values:
+                _add_delta(deltas, old_values, -1)
+                _add_delta(deltas, new_values, 1)
+
+    _apply_deltas(session.connection(), deltas)
+
+def record_inserted_requests(session, rows):
+    """Soma em request_stats pedidos gravados com insert() em lote (que não passam pelo after_flush)"""
+    deltas = {}
+    for values in rows:
+        _add_delta(deltas, values, 1)
+    _apply_deltas(session.connection(), deltas)
+
+def upsert_statement(connection, table):
+    """INSERT ... ON CONFLICT do banco em uso (PostgreSQL ou SQLite)"""
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(table)
+
+def _apply_deltas(connection, deltas):
+    # Upsert atômico: com UPDATE seguido de INSERT, duas transações criando a mesma combinação
+    # ao mesmo tempo fariam a segunda falhar com IntegrityError dentro do after_flush
+    table = RequestStat.__table__
+    for (status, classe, priority, responsible_id), (count, estimated, final) in deltas.items():
+        if count == 0 and estimated == 0 and final == 0:
+            continue
+        stmt = upsert_statement(connection, table).values(
+            status=status,
+            classe=classe,
+            priority=priority,
+            responsible_id=responsible_id,
+            request_count=count,
+            estimated_total=estimated,
+            final_total=final
+        )
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['status', 'classe', 'priority', 'responsible_id'],
+            set_={
+                'request_count': table.c.request_count + stmt.excluded.request_count,
+                'estimated_total': table.c.estimated_total + stmt.excluded.estimated_total,
+                'final_total': table.c.final_total + stmt.excluded.final_total,
+            }
+        ))
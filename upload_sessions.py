@@ -0,0 +1,231 @@
+"""Uploads retomáveis em blocos (API /uploads usada pelo formulário de pedidos).
+
+Fluxo: o navegador cria a sessão (nome e tamanho), envia os blocos numerados em paralelo
+(PUT, idempotente: reenviar um bloco apenas o sobrescreve), consulta quais blocos já chegaram
+para retomar após uma queda de conexão e pede a montagem. A montagem verifica assinatura,
+tamanho e SHA-256 e deixa o arquivo pronto; ao salvar o pedido, os ids das sessões concluídas
+viram anexos no blob store.
+
+Blocos ficam em uploads/sessions/<id>/<n>.part; sessões abandonadas são removidas pelo scheduler.
+O arquivo montado só é apagado depois do commit do pedido que o anexou: se a transação voltar
+atrás, uma nova tentativa grava o mesmo anexo a partir dele.
+"""
+import os
+import secrets
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import app, db
+from models import UploadSession
+from attachment_uploads import (UploadError, UPLOAD_CHUNK_SIZE, validate_filename, stream_to_temp,
+                                iter_chunks, store_verified_file)
+
+# Tamanho de cada bloco enviado pelo navegador (cada PUT fica bem abaixo de MAX_CONTENT_LENGTH)
+SESSION_CHUNK_SIZE = app.config['UPLOAD_SESSION_CHUNK_SIZE']
+
+# Tamanho máximo de um arquivo enviado em blocos
+MAX_RESUMABLE_UPLOAD_SIZE = app.config['MAX_RESUMABLE_UPLOAD_SIZE']
+
+# Sessões não anexadas sem atividade por mais tempo que isso são descartadas
+SESSION_MAX_AGE = timedelta(hours=24)
+
+# Chave em session.info com os diretórios de sessões anexadas, removidos após o commit
+_ATTACHED_DIRS_KEY = 'attached_upload_dirs'
+
+def _sessions_root():
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'sessions')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _session_dir(upload):
+    return os.path.join(_sessions_root(), upload.id)
+
+def _part_path(upload, index):
+    return os.path.join(_session_dir(upload), f'{index}.part')
+
+def _assembled_path(upload):
+    return os.path.join(_session_dir(upload), 'assembled')
+
+def create_session(user, filename, total_size):
+    """Abre uma sessão de upload; lança UploadError se nome ou tamanho forem inválidos"""
+    filename, _ = validate_filename(filename)
+    if total_size <= 0:
+        raise UploadError('arquivo vazio')
+    if total_size > MAX_RESUMABLE_UPLOAD_SIZE:
+        raise UploadError(f'arquivo maior que {MAX_RESUMABLE_UPLOAD_SIZE // (1024 * 1024)} MB')
+
+    upload = UploadSession(
+        id=secrets.token_hex(16),
+        user_id=user.id,
+        filename=filename,
+        total_size=total_size,
+        chunk_size=SESSION_CHUNK_SIZE,
+        total_chunks=-(-total_size // SESSION_CHUNK_SIZE)
+    )
+    db.session.add(upload)
+    db.session.commit()
+    os.makedirs(_session_dir(upload), exist_ok=True)
+    return upload
+
+def get_session(upload_id, user):
+    """Sessão do usuário informado (None se não existir ou for de outro usuário)"""
+    upload = db.session.get(UploadSession, upload_id)
+    if upload is None or upload.user_id != user.id:
+        return None
+    return upload
+
+def received_chunks(upload):
+    """Índices dos blocos já gravados"""
+    directory = _session_dir(upload)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(name[:-5]) for name in os.listdir(directory) if name.endswith('.part'))
+
+def session_info(upload):
+    return {
+        'upload_id': upload.id,
+        'filename': upload.filename,
+        'size': upload.total_size,
+        'chunk_size': upload.chunk_size,
+        'total_chunks': upload.total_chunks,
+        'status': upload.status,
+        'received': received_chunks(upload) if upload.status == 'open' else list(range(upload.total_chunks)),
+    }
+
+def _expected_chunk_size(upload, index):
+    if index == upload.total_chunks - 1:
+        return upload.total_size - upload.chunk_size * (upload.total_chunks - 1)
+    return upload.chunk_size
+
+def write_chunk(upload, index, stream):
+    """Grava o bloco `index` lido de `stream` (atômico: temporário + rename)"""
+    if upload.status != 'open':
+        raise UploadError('upload já concluído')
+    if not 0 <= index < upload.total_chunks:
+        raise UploadError('bloco fora do intervalo')
+
+    expected = _expected_chunk_size(upload, index)
+    directory = _session_dir(upload)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    written = 0
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in iter_chunks(stream):
+                written += len(chunk)
+                if written > expected:
+                    raise UploadError('bloco maior que o esperado')
+                tmp.write(chunk)
+        if written != expected:
+            raise UploadError(f'bloco incompleto ({written} de {expected} bytes)')
+        os.replace(tmp_path, _part_path(upload, index))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # Marca atividade para a limpeza de sessões abandonadas
+    upload.updated_at = datetime.utcnow()
+    db.session.commit()
+
+def _iter_parts(upload):
+    for index in range(upload.total_chunks):
+        with open(_part_path(upload, index), 'rb') as part:
+            yield from iter_chunks(part, UPLOAD_CHUNK_SIZE)
+
+def complete_session(upload):
+    """Monta os blocos em um único arquivo verificado; lança UploadError se faltar algum bloco"""
+    if upload.status != 'open':
+        return upload
+
+    missing = sorted(set(range(upload.total_chunks)) - set(received_chunks(upload)))
+    if missing:
+        raise UploadError(f'blocos pendentes: {", ".join(str(i) for i in missing[:20])}')
+
+    _, extension = validate_filename(upload.filename)
+    tmp_path, size, blob_sha256 = stream_to_temp(_iter_parts(upload), extension, temp_dir=_session_dir(upload))
+    if size != upload.total_size:
+        os.remove(tmp_path)
+        raise UploadError('tamanho final diferente do informado')
+
+    os.replace(tmp_path, _assembled_path(upload))
+    for index in range(upload.total_chunks):
+        os.remove(_part_path(upload, index))
+
+    upload.status = 'complete'
+    upload.blob_sha256 = blob_sha256
+    db.session.commit()
+    return upload
+
+def _link_copy(path):
+    """Cópia (hard link, se possível) de `path` no mesmo diretório, consumida por store_verified_file"""
+    copy_path = os.path.join(os.path.dirname(path), f'.store-{secrets.token_hex(8)}')
+    try:
+        os.link(path, copy_path)
+    except OSError:
+        shutil.copyfile(path, copy_path)
+    return copy_path
+
+def take_completed_uploads(upload_ids, user):
+    """Grava no blob store os arquivos das sessões concluídas do usuário.
+
+    Retorna (dados dos anexos, [(nome, motivo)] dos arquivos recusados). As sessões gravadas
+    ficam marcadas como 'attached' na transação de quem chamou (gravadas junto com o pedido);
+    os arquivos montados são removidos só depois do commit. Uma sessão recusada continua
+    'complete', disponível para nova tentativa ou para a limpeza de sessões abandonadas.
+    """
+    attachments = []
+    rejected = []
+    for upload_id in dict.fromkeys(upload_ids):
+        upload = get_session(upload_id, user)
+        if upload is None or upload.status != 'complete':
+            continue
+
+        assembled = _assembled_path(upload)
+        if not os.path.exists(assembled):
+            app.logger.warning(f"Upload {upload.id} sem arquivo montado; anexo ignorado")
+            continue
+        try:
+            _, extension = validate_filename(upload.filename)
+            # store_verified_file consome o arquivo (e pode reduzir a foto, mudando hash e tamanho):
+            # usa uma cópia para que uma nova tentativa após rollback refaça exatamente o mesmo anexo
+            saved = store_verified_file(_link_copy(assembled), upload.filename, extension,
+                                        upload.total_size, upload.blob_sha256)
+        except UploadError as e:
+            rejected.append((upload.filename, str(e)))
+            continue
+        except Exception as e:
+            app.logger.error(f"Erro ao gravar o upload {upload.id} ({upload.filename}): {e}")
+            rejected.append((upload.filename, 'erro ao gravar o arquivo'))
+            continue
+        attachments.append(saved)
+        upload.status = 'attached'
+        db.session.info.setdefault(_ATTACHED_DIRS_KEY, []).append(_session_dir(upload))
+    return attachments, rejected
+
+@event.listens_for(Session, 'after_commit')
+def _remove_attached_uploads(session):
+    """Após o commit do pedido, apaga os arquivos das sessões anexadas"""
+    for directory in session.info.pop(_ATTACHED_DIRS_KEY, []):
+        shutil.rmtree(directory, ignore_errors=True)
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_uploads_after_rollback(session):
+    # As sessões voltam a 'complete' e os arquivos montados continuam disponíveis
+    session.info.pop(_ATTACHED_DIRS_KEY, None)
+
+def discard_session(upload):
+    shutil.rmtree(_session_dir(upload), ignore_errors=True)
+    db.session.delete(upload)
+    db.session.commit()
+
+def purge_stale_sessions(max_age=SESSION_MAX_AGE):
+    """Remove sessões sem atividade há mais de `max_age` (e seus blocos). Retorna a quantidade removida."""
+    stale = UploadSession.query.filter(UploadSession.updated_at < datetime.utcnow() - max_age).all()
+    for upload in stale:
+        shutil.rmtree(_session_dir(upload), ignore_errors=True)
+        db.session.delete(upload)
+    db.session.commit()
+    return len(stale)